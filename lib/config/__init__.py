@@ -8,5 +8,6 @@
 from .defaults import _C as config
 from .defaults_imagenet import _C as config_imagenet
 from .defaults import update_config, merge_configs
+from .variants import VARIANTS, get_variant_config
 
 
@@ -45,6 +45,14 @@ _C.MODEL.EXTRA.PRETRAINED_LAYERS = ['*']
 _C.MODEL.EXTRA.STEM_INPLANES = 64
 _C.MODEL.EXTRA.FINAL_CONV_KERNEL = 1
 _C.MODEL.EXTRA.WITH_HEAD = True
+# inference checkpoints exported with BatchNorm folded into the convs (tools/export_inference.py)
+_C.MODEL.EXTRA.FOLDED_BN = False
+# inference head projecting every branch at its own resolution (lib/models/lean_head.py),
+# LEAN_HEAD_RANK > 0 uses the low-rank factorized projection
+_C.MODEL.EXTRA.LEAN_HEAD = False
+_C.MODEL.EXTRA.LEAN_HEAD_RANK = 0
+# input normalization folded into conv1 (lib/models/input_norm.py), the model takes raw uint8 crops
+_C.MODEL.EXTRA.RAW_INPUT = False
 
 _C.MODEL.EXTRA.STAGE2 = CN()
 _C.MODEL.EXTRA.STAGE2.NUM_MODULES = 1
@@ -0,0 +1,66 @@
+# ------------------------------------------------------------------------------
+# Named HRNet layouts, from the full W18 network down to cheaper variants.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+
+from .defaults import _C
+
+
+def make_layout(width, num_blocks=4, num_modules=(1, 4, 3), stage4_branches=4):
+    """
+    STAGE2..STAGE4 of an HRNet with BASIC blocks and SUM fusion.
+
+    :param width: channels of the highest resolution branch, every lower branch doubles them.
+    :param num_blocks: blocks per branch in every module.
+    :param num_modules: modules of stages 2, 3 and 4.
+    :param stage4_branches: 4, or 3 to drop the lowest resolution branch of stage 4.
+    """
+    layout = OrderedDict()
+    for stage, num_branches, stage_modules in zip(('STAGE2', 'STAGE3', 'STAGE4'), (2, 3, stage4_branches),
+                                                  num_modules):
+        layout[stage] = OrderedDict([
+            ('NUM_MODULES', stage_modules),
+            ('NUM_BRANCHES', num_branches),
+            ('BLOCK', 'BASIC'),
+            ('NUM_BLOCKS', [num_blocks] * num_branches),
+            ('NUM_CHANNELS', [width * 2 ** i for i in range(num_branches)]),
+            ('FUSE_METHOD', 'SUM'),
+        ])
+    return layout
+
+
+# w18 is the layout of the released checkpoints (experiments/*/face_alignment_*_hrnet_w18.yaml),
+# "small" follows HRNet-W18-Small-v2: 2 blocks per branch, fewer modules
+VARIANTS = OrderedDict([
+    ('w18', make_layout(18)),
+    ('w18-small', make_layout(18, num_blocks=2, num_modules=(1, 3, 2))),
+    ('w18-3branch', make_layout(18, stage4_branches=3)),
+    ('w12', make_layout(12)),
+    ('w12-small', make_layout(12, num_blocks=2, num_modules=(1, 3, 2))),
+    ('w9', make_layout(9)),
+    ('w9-small-3branch', make_layout(9, num_blocks=2, num_modules=(1, 3, 2), stage4_branches=3)),
+])
+
+
+def get_variant_config(name, base_config=None):
+    """
+    Config of the named variant, everything but the stage layout comes from `base_config`
+    (e.g. the config of a dataset model for its NUM_JOINTS), the defaults otherwise.
+
+    :return: frozen config, ready for `HighResolutionNet` / `get_face_alignment_net`.
+    """
+    if name not in VARIANTS:
+        raise ValueError(f"Unknown variant {name}, expected one of {list(VARIANTS)}")
+    cfg = (base_config if base_config is not None else _C).clone()
+    cfg.defrost()
+    for stage, values in VARIANTS[name].items():
+        for key, value in values.items():
+            cfg.MODEL.EXTRA[stage][key] = value
+    cfg.MODEL.INIT_WEIGHTS = False
+    cfg.freeze()
+    return cfg
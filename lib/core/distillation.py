@@ -0,0 +1,132 @@
+# ------------------------------------------------------------------------------
+# Heatmap distillation of a (smaller) HighResolutionNet student from a teacher.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+import logging
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from ..models.input_norm import normalized_state_dict, denormalize
+
+
+logger = logging.getLogger(__name__)
+
+# stem of HighResolutionNet, the same in every variant (lib/config/variants.py)
+STEM_PREFIXES = ('conv1.', 'bn1.', 'conv2.', 'bn2.', 'layer1.')
+
+
+def get_optimizer(cfg, model):
+    """
+    Optimizer of the TRAIN section of the config (sgd or adam).
+    """
+    params = [p for p in model.parameters() if p.requires_grad]
+    if cfg.TRAIN.OPTIMIZER == 'sgd':
+        return optim.SGD(params, lr=cfg.TRAIN.LR, momentum=cfg.TRAIN.MOMENTUM, weight_decay=cfg.TRAIN.WD,
+                         nesterov=cfg.TRAIN.NESTEROV)
+    if cfg.TRAIN.OPTIMIZER == 'adam':
+        return optim.Adam(params, lr=cfg.TRAIN.LR, weight_decay=cfg.TRAIN.WD)
+    raise ValueError(f"Unknown optimizer {cfg.TRAIN.OPTIMIZER}, expected sgd or adam")
+
+
+def copy_stem(teacher, student):
+    """
+    Initialize the stem of the student with the teacher's, the layouts only differ after it.
+
+    :return: number of copied tensors.
+    """
+    teacher_state = normalized_state_dict(teacher)
+    stem = {k: v for k, v in teacher_state.items() if k.startswith(STEM_PREFIXES)}
+    student_state = student.state_dict()
+    stem = {k: v for k, v in stem.items() if k in student_state and student_state[k].shape == v.shape}
+    student.load_state_dict(stem, strict=False)
+    return len(stem)
+
+
+def teacher_inputs(teacher, inputs):
+    """
+    The crops are normalized for the student, a RAW_INPUT teacher (`takes_raw_input`) reads their pixel values.
+    """
+    return denormalize(inputs) if getattr(teacher, 'takes_raw_input', False) else inputs
+
+
+class AverageMeter(object):
+    """Computes and stores the average and current value"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.val = 0
+        self.avg = 0
+        self.sum = 0
+        self.count = 0
+
+    def update(self, val, n=1):
+        self.val = val
+        self.sum += val * n
+        self.count += n
+        self.avg = self.sum / self.count if self.count != 0 else 0
+
+
+def distill_epoch(teacher, student, loader, criterion, optimizer, epoch, device='cpu', print_freq=20,
+                  max_steps=None):
+    """
+    One epoch of training the student on the teacher heatmaps of the same inputs.
+
+    :return: average loss
+    """
+    teacher.eval()
+    student.train()
+    losses = AverageMeter()
+    batch_time = AverageMeter()
+
+    end = time.time()
+    for i, inputs in enumerate(loader):
+        if max_steps is not None and i >= max_steps:
+            break
+        inputs = inputs.to(device)
+        with torch.no_grad():
+            target = teacher(teacher_inputs(teacher, inputs)).float()
+        output = student(inputs)
+        loss = criterion(output, target)
+
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        losses.update(loss.item(), inputs.size(0))
+        batch_time.update(time.time() - end)
+        end = time.time()
+
+        if i % print_freq == 0:
+            logger.info(f'Epoch: [{epoch}][{i}/{len(loader)}]\t'
+                        f'Time {batch_time.val:.3f}s ({batch_time.avg:.3f}s)\t'
+                        f'Loss {losses.val:.6f} ({losses.avg:.6f})')
+    return losses.avg
+
+
+def validate(teacher, student, loader, criterion, device='cpu'):
+    """
+    :return: average heatmap loss of the student against the teacher.
+    """
+    teacher.eval()
+    student.eval()
+    losses = AverageMeter()
+    with torch.no_grad():
+        for inputs in loader:
+            inputs = inputs.to(device)
+            target = teacher(teacher_inputs(teacher, inputs)).float()
+            losses.update(criterion(student(inputs), target).item(), inputs.size(0))
+    return losses.avg
+
+
+def get_criterion():
+    # the heatmap loss HRNet is trained with
+    return nn.MSELoss(reduction='mean')
@@ -0,0 +1,56 @@
+# ------------------------------------------------------------------------------
+# Copyright (c) Microsoft
+# Licensed under the MIT License.
+# Created by Tianheng Cheng(tianhengcheng@gmail.com)
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def get_interocular(pts_gt, box_size=None):
+    """
+    Normalization distance of the NME for one face, by number of landmarks (dataset).
+    """
+    num_lmks = pts_gt.shape[0]
+    if num_lmks == 19:  # aflw
+        if box_size is None:
+            # no annotated box: size of the box around the landmarks
+            w, h = pts_gt.max(0) - pts_gt.min(0)
+            box_size = np.sqrt(w * h)
+        return box_size
+    elif num_lmks == 29:  # cofw
+        return np.linalg.norm(pts_gt[8, ] - pts_gt[9, ])
+    elif num_lmks == 68:  # 300w
+        # interocular
+        return np.linalg.norm(pts_gt[36, ] - pts_gt[45, ])
+    elif num_lmks == 98:
+        return np.linalg.norm(pts_gt[60, ] - pts_gt[72, ])
+    else:
+        raise ValueError('Number of landmarks is wrong')
+
+
+def compute_nme(preds, target, box_size=None):
+    """
+    Normalized mean error of every sample.
+
+    :param preds: (N, L, 2) predicted landmarks.
+    :param target: (N, L, 2) reference landmarks.
+    :param box_size: optional (N,) face box sizes, used for AFLW.
+    :return: (N,) array
+    """
+    preds = np.asarray(preds, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    N = preds.shape[0]
+    L = preds.shape[1]
+    rmse = np.zeros(N)
+
+    for i in range(N):
+        pts_pred, pts_gt = preds[i, ], target[i, ]
+        interocular = get_interocular(pts_gt, None if box_size is None else box_size[i])
+        rmse[i] = np.sum(np.linalg.norm(pts_pred - pts_gt, axis=1)) / (interocular * L)
+
+    return rmse
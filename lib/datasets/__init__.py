@@ -0,0 +1,8 @@
+# ------------------------------------------------------------------------------
+# Local image folders used by the export, calibration and benchmark tools.
+# ------------------------------------------------------------------------------
+
+from .image_folder import IMAGE_EXTENSIONS, list_images, load_images
+from .face_crops import FaceCropDataset
+
+__all__ = ['IMAGE_EXTENSIONS', 'list_images', 'load_images', 'FaceCropDataset']
@@ -0,0 +1,61 @@
+# ------------------------------------------------------------------------------
+# Augmented face crops of a local image folder, for distillation.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import random
+
+import cv2
+import torch.utils.data as data
+
+from .image_folder import load_images
+
+
+class FaceCropDataset(data.Dataset):
+    """
+    Randomly scaled, rotated and flipped crops of face images, without annotations.
+
+    The images are expected to be roughly centered face crops (as for calibration). The crop
+    itself is done by `prepare`, the inference preprocessing, so the network sees training
+    inputs exactly as it sees served ones. Labels come from the teacher on the same crops,
+    so flipping needs no landmark remapping.
+    """
+
+    def __init__(self, folder, prepare, output_size=(256, 256), scale_factor=0.25, rot_factor=30, flip=True,
+                 is_train=True, limit=None):
+        """
+        :param folder: image folder (searched recursively).
+        :param prepare: callable(img, output_size=..., rot=..., center=..., scale=...) -> (CHW tensor, center, scale),
+                        e.g. `prepare_input` of the server.
+        :param scale_factor: crop scale is jittered uniformly within 1 +- scale_factor.
+        :param rot_factor: rotation in degrees, uniform within +-rot_factor for 60% of the samples.
+        :param flip: random horizontal flips.
+        :param is_train: False gives the plain centered crops.
+        """
+        self.images = load_images(folder, limit=limit)
+        if not self.images:
+            raise ValueError(f"No images found in {folder}")
+        self.prepare = prepare
+        self.output_size = tuple(output_size)
+        self.scale_factor = scale_factor
+        self.rot_factor = rot_factor
+        self.flip = flip
+        self.is_train = is_train
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, idx):
+        img = self.images[idx]
+        center = [img.shape[1] / 2, img.shape[0] / 2]
+        scale = max(img.shape[1] / self.output_size[0], img.shape[0] / self.output_size[1])
+        rot = 0
+        if self.is_train:
+            scale *= random.uniform(1 - self.scale_factor, 1 + self.scale_factor)
+            rot = random.uniform(-self.rot_factor, self.rot_factor) if random.random() <= 0.6 else 0
+            if self.flip and random.random() <= 0.5:
+                img = cv2.flip(img, 1)
+        return self.prepare(img, output_size=self.output_size, rot=rot, center=center, scale=scale)[0]
@@ -0,0 +1,36 @@
+# ------------------------------------------------------------------------------
+# Local image folders used by the export, calibration and benchmark tools.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import cv2
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(folder):
+    """
+    Sorted paths of the images in `folder` and its subfolders.
+    """
+    paths = []
+    for root, _, files in os.walk(folder):
+        paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def load_images(folder, limit=None):
+    """
+    BGR images (as read by cv2) of `folder`, at most `limit` of them.
+    """
+    images = []
+    for path in list_images(folder)[:limit]:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            images.append(img)
+    return images
@@ -11,5 +11,19 @@ from __future__ import print_function
 
 from .hrnet import get_face_alignment_net, HighResolutionNet
 from .cls_hrnet import HighResolutionNetImageNet, get_cls_net
+from .decoder import LandmarkDecoder, HighResolutionNetWithDecoder
+from .fold_bn import fold_batchnorm, fuse_conv_bn
+from .multihead import MultiHeadHighResolutionNet, get_multihead_net
+from .lean_head import LeanHead, convert_to_lean_head
+from .parallel import set_parallel_branches
+from .inplace_fuse import set_inplace_fuse
+from .pruning import prune_hrnet
+from .input_norm import RawInputConv, fold_input_normalization, unfold_input_normalization, normalized_state_dict, \
+    denormalize
 
-__all__ = ['HighResolutionNet', 'get_face_alignment_net', 'HighResolutionNetImageNet', 'get_cls_net']
+__all__ = ['HighResolutionNet', 'get_face_alignment_net', 'HighResolutionNetImageNet', 'get_cls_net',
+           'LandmarkDecoder', 'HighResolutionNetWithDecoder', 'fold_batchnorm', 'fuse_conv_bn',
+           'MultiHeadHighResolutionNet', 'get_multihead_net', 'LeanHead', 'convert_to_lean_head',
+           'set_parallel_branches', 'set_inplace_fuse', 'prune_hrnet',
+           'RawInputConv', 'fold_input_normalization', 'unfold_input_normalization', 'normalized_state_dict',
+           'denormalize']
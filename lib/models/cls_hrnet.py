@@ -20,6 +20,8 @@ import torch.nn as nn
 import torch._utils
 import torch.nn.functional as F
 
+from .meta_init import build_from_state_dict
+
 BN_MOMENTUM = 0.1
 logger = logging.getLogger(__name__)
 
@@ -503,6 +505,13 @@ class HighResolutionNetImageNet(nn.Module):
             self.load_state_dict(model_dict)
 
 
-def get_cls_net(config, **kwargs):
+def get_cls_net(config, state_dict=None, **kwargs):
+    """
+    With `state_dict` the network is built on the meta device and materialized from it,
+    without allocating and randomly initializing the weights first.
+    """
+    if state_dict is not None:
+        return build_from_state_dict(HighResolutionNetImageNet, state_dict, config, **kwargs)
+
     model = HighResolutionNetImageNet(config, **kwargs)
     return model
@@ -0,0 +1,63 @@
+# ------------------------------------------------------------------------------
+# Heatmap decoding inside the model graph.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+
+
+class LandmarkDecoder(nn.Module):
+    """
+    Heatmaps (N, P, H, W) -> landmarks (N, P, 2) and confidences (N, P).
+
+    Same math as `decode_preds` in utils_inference: argmax, quarter pixel shift towards
+    the higher neighbour and the inverse crop transform, truncated to whole pixels like
+    `transform_pixel`. The inverse crop transforms (N, 2, 3) map 1-based heatmap
+    coordinates (minus one) to image coordinates and are given per sample, see
+    `get_inverse_transforms`.
+    """
+
+    def forward(self, heatmaps, inv_transforms):
+        n, p, h, w = heatmaps.shape
+        maxval, idx = heatmaps.reshape(n, p, h * w).max(2)
+        col = idx % w
+        row = torch.div(idx, w, rounding_mode='floor')
+
+        # neighbours are read with clamped indices, points on the border are masked out
+        inside = (col >= 1) & (col <= w - 2) & (row >= 1) & (row <= h - 2) & (maxval > 0)
+        col_c = col.clamp(1, w - 2)
+        row_c = row.clamp(1, h - 2)
+        flat = heatmaps.reshape(n, p, h * w)
+        right = flat.gather(2, (row_c * w + col_c + 1).unsqueeze(2)).squeeze(2)
+        left = flat.gather(2, (row_c * w + col_c - 1).unsqueeze(2)).squeeze(2)
+        down = flat.gather(2, ((row_c + 1) * w + col_c).unsqueeze(2)).squeeze(2)
+        up = flat.gather(2, ((row_c - 1) * w + col_c).unsqueeze(2)).squeeze(2)
+        shift = torch.stack([right - left, down - up], 2).sign() * 0.25 * inside.unsqueeze(2).to(heatmaps.dtype)
+
+        coords = torch.stack([col + 1, row + 1], 2).to(heatmaps.dtype) * (maxval > 0).unsqueeze(2).to(heatmaps.dtype)
+        coords = coords + shift + 0.5
+
+        pts = coords.to(inv_transforms.dtype) - 1
+        pts = torch.matmul(pts, inv_transforms[:, :, :2].transpose(1, 2)) + inv_transforms[:, :, 2].unsqueeze(1)
+        return pts.trunc() + 1, maxval
+
+
+class HighResolutionNetWithDecoder(nn.Module):
+    """
+    Wraps a landmark network so that it returns final landmarks instead of heatmaps.
+
+    forward(x, inv_transforms) -> (landmarks (N, P, 2), confidences (N, P))
+    """
+    decodes_landmarks = True
+
+    def __init__(self, model):
+        super(HighResolutionNetWithDecoder, self).__init__()
+        self.model = model
+        self.decoder = LandmarkDecoder()
+
+    def forward(self, x, inv_transforms):
+        return self.decoder(self.model(x), inv_transforms)
@@ -0,0 +1,59 @@
+# ------------------------------------------------------------------------------
+# BatchNorm folding for inference.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+
+
+def fuse_conv_bn(conv, bn):
+    """
+    Conv2d with the (eval mode) BatchNorm2d that follows it folded into its weight and bias.
+    """
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True,
+                      padding_mode=conv.padding_mode, device=conv.weight.device, dtype=conv.weight.dtype)
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
+def fold_batchnorm(model):
+    """
+    Fold every BatchNorm2d of an HRNet into the conv before it, in place.
+
+    Covers conv/bn attribute pairs of the stem and the blocks (conv1/bn1, conv2/bn2, conv3/bn3)
+    and Conv2d -> BatchNorm2d pairs inside nn.Sequential (downsample, transitions, fuse layers,
+    head). Folded BatchNorm2d modules become nn.Identity, so they disappear from the state dict.
+    The unused softmax of HighResolutionNet is dropped as well.
+    Works on meta tensors too, which is how folded checkpoints get their module structure.
+    """
+    model.eval()
+    for module in list(model.modules()):
+        if isinstance(module, nn.Sequential):
+            children = list(module._modules.items())
+            for (conv_name, conv), (bn_name, bn) in zip(children, children[1:]):
+                if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                    module._modules[conv_name] = fuse_conv_bn(conv, bn)
+                    module._modules[bn_name] = nn.Identity()
+        for i in (1, 2, 3):
+            conv = module._modules.get('conv{}'.format(i))
+            bn = module._modules.get('bn{}'.format(i))
+            if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                setattr(module, 'conv{}'.format(i), fuse_conv_bn(conv, bn))
+                setattr(module, 'bn{}'.format(i), nn.Identity())
+
+    if isinstance(getattr(model, 'sf', None), nn.Softmax):
+        del model.sf
+    return model
+
+
+def count_batchnorm(model):
+    return sum(isinstance(m, nn.BatchNorm2d) for m in model.modules())
@@ -11,11 +11,19 @@ from __future__ import print_function
 
 import os
 import logging
+import functools
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .meta_init import build_from_state_dict
+from .fold_bn import fold_batchnorm
+from .lean_head import convert_to_lean_head
+from .parallel import run_parallel
+from .inplace_fuse import fuse_inplace, can_fuse_inplace
+from .input_norm import fold_input_normalization
+
 
 BatchNorm2d = nn.BatchNorm2d
 BN_MOMENTUM = 0.01
@@ -119,6 +127,13 @@ class HighResolutionModule(nn.Module):
         self.fuse_layers = self._make_fuse_layers()
         self.relu = nn.ReLU(inplace=True)
 
+        # concurrent branches / fuse paths, see lib/models/parallel.py
+        self.parallel_mode = None
+        self.parallel_workers = 4
+        self.parallel_intra_op_threads = None
+        # allocation-free fusion for inference, see lib/models/inplace_fuse.py
+        self.inplace_fuse = False
+
     def _check_branches(self, num_branches, blocks, num_blocks,
                         num_inchannels, num_channels):
         if num_branches != len(num_blocks):
@@ -225,26 +240,46 @@ class HighResolutionModule(nn.Module):
         if self.num_branches == 1:
             return [self.branches[0](x[0])]
 
+        if self.parallel_mode is not None:
+            return self._forward_parallel(x)
+
+        if self.inplace_fuse and can_fuse_inplace(x[0]):
+            return fuse_inplace(self, [branch(x_i) for branch, x_i in zip(self.branches, x)])
+
         for i in range(self.num_branches):
             x[i] = self.branches[i](x[i])
 
         x_fuse = []
         for i in range(len(self.fuse_layers)):
-            y = x[0] if i == 0 else self.fuse_layers[i][0](x[0])
-            for j in range(1, self.num_branches):
-                if i == j:
-                    y = y + x[j]
-                elif j > i:
-                    y = y + F.interpolate(
-                        self.fuse_layers[i][j](x[j]),
-                        size=[x[i].shape[2], x[i].shape[3]],
-                        mode='bilinear', align_corners=True)
-                else:
-                    y = y + self.fuse_layers[i][j](x[j])
-            x_fuse.append(self.relu(y))
+            x_fuse.append(self._fuse(i, *x))
 
         return x_fuse
 
+    def _fuse(self, i, *x):
+        y = x[0] if i == 0 else self.fuse_layers[i][0](x[0])
+        for j in range(1, self.num_branches):
+            if i == j:
+                y = y + x[j]
+            elif j > i:
+                y = y + F.interpolate(
+                    self.fuse_layers[i][j](x[j]),
+                    size=[x[i].shape[2], x[i].shape[3]],
+                    mode='bilinear', align_corners=True)
+            else:
+                y = y + self.fuse_layers[i][j](x[j])
+        return self.relu(y)
+
+    def _forward_parallel(self, x):
+        """
+        Same computation as `forward`, the branches run concurrently, then the fuse paths
+        of all output branches (each reads every branch) run concurrently.
+        """
+        options = dict(mode=self.parallel_mode, num_workers=self.parallel_workers,
+                       intra_op_threads=self.parallel_intra_op_threads)
+        x = run_parallel([(self.branches[i], (x[i],)) for i in range(self.num_branches)], **options)
+        return run_parallel([(functools.partial(self._fuse, i), tuple(x)) for i in range(len(self.fuse_layers))],
+                            **options)
+
 
 blocks_dict = {
     'BASIC': BasicBlock,
@@ -252,6 +287,34 @@ blocks_dict = {
 }
 
 
+def make_head(in_channels, num_joints, final_conv_kernel):
+    """Landmark head on the concatenated branches: 1x1 conv, BN, ReLU, heatmap conv"""
+    return nn.Sequential(
+        nn.Conv2d(
+            in_channels=in_channels,
+            out_channels=in_channels,
+            kernel_size=1,
+            stride=1,
+            padding=1 if final_conv_kernel == 3 else 0),
+        BatchNorm2d(in_channels, momentum=BN_MOMENTUM),
+        nn.ReLU(inplace=True),
+        nn.Conv2d(
+            in_channels=in_channels,
+            out_channels=num_joints,
+            kernel_size=final_conv_kernel,
+            stride=1,
+            padding=1 if final_conv_kernel == 3 else 0)
+    )
+
+
+def concat_branches(x):
+    """Upsample the lower resolution branches to the first one and concatenate them"""
+    height, width = x[0].size(2), x[0].size(3)
+    upsampled = [F.interpolate(branch, size=(height, width), mode='bilinear', align_corners=False)
+                 for branch in x[1:]]
+    return torch.cat([x[0]] + upsampled, 1)
+
+
 class HighResolutionNet(nn.Module):
 
     def __init__(self, config, **kwargs):
@@ -300,24 +363,13 @@ class HighResolutionNet(nn.Module):
         self.stage4, pre_stage_channels = self._make_stage(
             self.stage4_cfg, num_channels, multi_scale_output=True)
 
+        self.branch_channels = list(pre_stage_channels)
         final_inp_channels = sum(pre_stage_channels)
 
-        self.head = nn.Sequential(
-            nn.Conv2d(
-                in_channels=final_inp_channels,
-                out_channels=final_inp_channels,
-                kernel_size=1,
-                stride=1,
-                padding=1 if extra.FINAL_CONV_KERNEL == 3 else 0),
-            BatchNorm2d(final_inp_channels, momentum=BN_MOMENTUM),
-            nn.ReLU(inplace=True),
-            nn.Conv2d(
-                in_channels=final_inp_channels,
-                out_channels=config.MODEL.NUM_JOINTS,
-                kernel_size=extra.FINAL_CONV_KERNEL,
-                stride=1,
-                padding=1 if extra.FINAL_CONV_KERNEL == 3 else 0)
-        )
+        self.head = make_head(final_inp_channels, config.MODEL.NUM_JOINTS, extra.FINAL_CONV_KERNEL)
+
+        if extra.get('FOLDED_BN', False):
+            fold_batchnorm(self)
 
     def _make_transition_layer(
             self, num_channels_pre_layer, num_channels_cur_layer):
@@ -437,12 +489,16 @@ class HighResolutionNet(nn.Module):
 
         if not with_head:
             return x
+        return self.forward_head(x)
+
+    def forward_head(self, x):
+        """
+        Heatmaps from the stage-4 branch outputs.
+        """
         # Head Part
-        height, width = x[0].size(2), x[0].size(3)
-        x1 = F.interpolate(x[1], size=(height, width), mode='bilinear', align_corners=False)
-        x2 = F.interpolate(x[2], size=(height, width), mode='bilinear', align_corners=False)
-        x3 = F.interpolate(x[3], size=(height, width), mode='bilinear', align_corners=False)
-        x = torch.cat([x[0], x1, x2, x3], 1)
+        if getattr(self.head, 'takes_branches', False):
+            return self.head(x)
+        x = concat_branches(x)
         x = self.head(x)
 
         return x
@@ -470,11 +526,23 @@ class HighResolutionNet(nn.Module):
             self.load_state_dict(model_dict)
 
 
-def get_face_alignment_net(config, **kwargs):
-
-    model = HighResolutionNet(config, **kwargs)
-    pretrained = config.MODEL.PRETRAINED if config.MODEL.INIT_WEIGHTS else ''
-    model.init_weights(pretrained=pretrained)
+def get_face_alignment_net(config, state_dict=None, **kwargs):
+    """
+    With `state_dict` the network is built on the meta device and materialized from it,
+    without allocating and randomly initializing the weights first.
+    """
+    if state_dict is not None:
+        model = build_from_state_dict(HighResolutionNet, state_dict, config, **kwargs)
+    else:
+        model = HighResolutionNet(config, **kwargs)
+        pretrained = config.MODEL.PRETRAINED if config.MODEL.INIT_WEIGHTS else ''
+        model.init_weights(pretrained=pretrained)
+
+    if config.MODEL.EXTRA.get('LEAN_HEAD', False):
+        model.eval()
+        convert_to_lean_head(model, model.branch_channels, rank=config.MODEL.EXTRA.get('LEAN_HEAD_RANK', 0))
+    if config.MODEL.EXTRA.get('RAW_INPUT', False):
+        fold_input_normalization(model, image_size=config.MODEL.IMAGE_SIZE)
 
     return model
 
@@ -0,0 +1,98 @@
+# ------------------------------------------------------------------------------
+# Allocation-free fusion of the HighResolutionModule branches for inference.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class UpsampleBuffers(threading.local):
+    """
+    Scratch tensors for the upsampled fuse terms, one per (shape, dtype, device) and thread.
+
+    An upsampled term is added to its accumulator right away, so every module of the network
+    (and every forward) reuses the same few buffers instead of allocating a tensor per term.
+    Batches of different sizes need their own buffers, the least recently used ones beyond
+    `capacity` are dropped.
+    """
+
+    capacity = 12
+
+    def __init__(self):
+        self.buffers = OrderedDict()
+
+    def get(self, shape, dtype, device):
+        key = (tuple(shape), dtype, device)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = torch.empty(shape, dtype=dtype, device=device)
+            while len(self.buffers) > self.capacity:
+                self.buffers.popitem(last=False)
+        else:
+            self.buffers.move_to_end(key)
+        return buffer
+
+    def clear(self):
+        self.buffers.clear()
+
+
+upsample_buffers = UpsampleBuffers()
+
+
+def upsample_into(x, size, align_corners=True):
+    """
+    F.interpolate(x, size, mode='bilinear') written into a shared scratch buffer.
+    """
+    out = upsample_buffers.get((x.size(0), x.size(1), size[0], size[1]), x.dtype, x.device)
+    return torch._C._nn.upsample_bilinear2d(x, list(size), align_corners, None, None, out=out)
+
+
+def can_fuse_inplace(x):
+    """
+    The in-place path needs eager inference: autograd, tracing (the scratch buffers would be
+    frozen as constants) and autocast (no out= variants) take the regular path.
+    """
+    return not (torch.is_grad_enabled() or torch.jit.is_tracing() or torch.jit.is_scripting()
+                or torch.is_autocast_enabled(x.device.type))
+
+
+def fuse_inplace(module, x):
+    """
+    Fuse the branch outputs `x` of a HighResolutionModule without temporary tensors.
+
+    Output i > 0 accumulates into the output of its own first (downsampling) fuse conv, output 0
+    is computed last and accumulates into x[0], which no other output reads any more. Upsampled
+    terms go through the shared `upsample_buffers`. The terms are added in the same order as in
+    `HighResolutionModule.forward`, so the result is identical.
+
+    :param x: branch outputs, owned by the caller (output 0 is written into x[0]).
+    """
+    x_fuse = [None] * len(module.fuse_layers)
+    for i in reversed(range(len(module.fuse_layers))):
+        y = x[0] if i == 0 else module.fuse_layers[i][0](x[0])
+        size = (x[i].shape[2], x[i].shape[3])
+        for j in range(1, module.num_branches):
+            if i == j:
+                y.add_(x[j])
+            elif j > i:
+                y.add_(upsample_into(module.fuse_layers[i][j](x[j]), size))
+            else:
+                y.add_(module.fuse_layers[i][j](x[j]))
+        x_fuse[i] = y.relu_()
+    return x_fuse
+
+
+def set_inplace_fuse(model, enabled=True):
+    """
+    Switch the fusion of every HighResolutionModule of `model` to `fuse_inplace` (inference only).
+    """
+    for module in model.modules():
+        if hasattr(module, 'inplace_fuse'):
+            module.inplace_fuse = enabled
+    return model
@@ -0,0 +1,147 @@
+# ------------------------------------------------------------------------------
+# Input normalization folded into the first convolution.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# ImageNet statistics of [0, 1] images, as in src/server/utils/preprocessing.py
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+class RawInputConv(nn.Module):
+    """
+    conv(normalize(x)) for raw pixel input x (uint8 or float in [0, 255]),
+    with normalize(x) = (x / 255 - mean) / std per channel.
+
+    The per-channel scale goes into the conv weight. The per-channel shift can't become a plain
+    bias: the original conv zero-pads the *normalized* image, so the output positions whose taps
+    reach into the padding only get part of the shift. It is added instead as a bias map, the conv
+    of the constant shift image (plus the original bias), exact on the border as well. The map
+    depends on the input size only and is cached per size, device and dtype; under TorchScript
+    (the saved INT8 models) the map of `image_size` is kept as a buffer, other sizes compute it per call.
+    """
+
+    takes_raw_input = True
+    __jit_ignored_attributes__ = ['_bias_maps']
+
+    def __init__(self, conv, mean=MEAN, std=STD, pixel_scale=1 / 255., image_size=None):
+        """
+        :param conv: first Conv2d of the network, reading the normalized image.
+        :param image_size: (width, height) of the model input, its bias map is prepared upfront.
+        """
+        super(RawInputConv, self).__init__()
+        self.mean, self.std, self.pixel_scale = tuple(mean), tuple(std), pixel_scale
+        weight = conv.weight.detach().double()
+        std = torch.tensor(std, dtype=torch.float64, device=weight.device)
+        mean = torch.tensor(mean, dtype=torch.float64, device=weight.device)
+        scale = pixel_scale / std
+        shift = -mean / std
+
+        self.conv = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                              padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=False,
+                              device=conv.weight.device, dtype=conv.weight.dtype)
+        with torch.no_grad():
+            self.conv.weight.copy_(weight * scale.view(1, -1, 1, 1))
+        # the shift image is constant per channel, its conv reduces to one input channel
+        shift_kernel = (weight * shift.view(1, -1, 1, 1)).sum(1, keepdim=True)
+        bias = conv.bias.detach() if conv.bias is not None else torch.zeros(conv.out_channels, device=weight.device)
+        self.register_buffer('shift_kernel', shift_kernel.to(conv.weight.dtype))
+        self.register_buffer('bias', bias.to(conv.weight.dtype))
+        self._bias_maps = {}
+        image_bias_map = torch.empty(0, device=weight.device, dtype=conv.weight.dtype)
+        if image_size is not None:
+            image_bias_map = self.bias_map(image_size[1], image_size[0], weight.device, conv.weight.dtype)
+        self.register_buffer('image_bias_map', image_bias_map, persistent=False)
+
+    @torch.jit.unused
+    def normalized_conv(self):
+        """
+        :return: Conv2d of the normalized image this module was folded from (bias-free, as the HRNet stem).
+        """
+        conv = self.conv
+        scale = self.pixel_scale / torch.tensor(self.std, dtype=torch.float64, device=conv.weight.device)
+        normalized = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                               padding=conv.padding, dilation=conv.dilation, groups=conv.groups,
+                               bias=bool(self.bias.any()), device=conv.weight.device, dtype=conv.weight.dtype)
+        with torch.no_grad():
+            normalized.weight.copy_(conv.weight.double() / scale.view(1, -1, 1, 1))
+            if normalized.bias is not None:
+                normalized.bias.copy_(self.bias)
+        return normalized
+
+    def compute_bias_map(self, height: int, width: int, device: torch.device) -> torch.Tensor:
+        ones = torch.ones(1, 1, height, width, dtype=torch.float64, device=device)
+        return F.conv2d(ones, self.shift_kernel.double().to(device), self.bias.double().to(device),
+                        stride=self.conv.stride, padding=self.conv.padding, dilation=self.conv.dilation)
+
+    @torch.jit.unused
+    def bias_map(self, height, width, device, dtype):
+        """
+        :return: (1, out_channels, H', W') map added to the conv output of a (height, width) input.
+        """
+        key = (height, width, str(device), dtype)
+        if key not in self._bias_maps:
+            self._bias_maps[key] = self.compute_bias_map(height, width, device).to(dtype)
+        return self._bias_maps[key]
+
+    def forward(self, x):
+        y = self.conv(x.to(self.conv.weight.dtype))
+        if torch.jit.is_scripting():
+            if self.image_bias_map.shape[-2:] == y.shape[-2:]:
+                return y + self.image_bias_map
+            return y + self.compute_bias_map(x.size(2), x.size(3), y.device).to(y.dtype)
+        # plain ints, so that traced and exported graphs keep the map as a constant
+        y += self.bias_map(int(x.size(2)), int(x.size(3)), y.device, y.dtype)
+        return y
+
+
+def fold_input_normalization(model, image_size=None, mean=MEAN, std=STD):
+    """
+    Replace `model.conv1` of a HighResolutionNet with a `RawInputConv`, in place: the model
+    then takes raw (uint8 or [0, 255] float) crops instead of normalized ones.
+    """
+    model.conv1 = RawInputConv(model.conv1, mean=mean, std=std, image_size=image_size)
+    model.takes_raw_input = True
+    return model
+
+
+def unfold_input_normalization(model):
+    """
+    Undo `fold_input_normalization`, in place: `model.conv1` reads normalized crops again.
+    """
+    if isinstance(model.conv1, RawInputConv):
+        model.conv1 = model.conv1.normalized_conv()
+    model.takes_raw_input = False
+    return model
+
+
+def normalized_state_dict(model):
+    """
+    State dict of `model` with its `RawInputConv`s turned back into the convs of normalized input,
+    as the network was before `fold_input_normalization` (for pruning and initializing other networks).
+    """
+    state_dict = model.state_dict()
+    for name, module in model.named_modules():
+        if isinstance(module, RawInputConv):
+            prefix = f'{name}.'
+            for key in [k for k in state_dict if k.startswith(prefix)]:
+                del state_dict[key]
+            for key, value in module.normalized_conv().state_dict().items():
+                state_dict[prefix + key] = value
+    return state_dict
+
+
+def denormalize(x, mean=MEAN, std=STD, pixel_scale=1 / 255.):
+    """
+    Raw pixel values of normalized crops, the input of models with `takes_raw_input`.
+    """
+    mean = torch.tensor(mean, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+    std = torch.tensor(std, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+    return (x * std + mean) / pixel_scale
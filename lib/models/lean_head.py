@@ -0,0 +1,108 @@
+# ------------------------------------------------------------------------------
+# Inference head working on the branches at their native resolution.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .fold_bn import fuse_conv_bn
+
+
+class LeanHead(nn.Module):
+    """
+    Drop-in replacement of the landmark head that never builds the concatenated
+    (sum of branch channels) x H x W tensor.
+
+    The first 1x1 conv of the head is linear and bilinear upsampling mixes pixels with the
+    same weights in every channel, so conv(cat(up(x_i))) == sum(up(conv_i(x_i))) + bias, where
+    conv_i is the slice of the conv weight that reads branch i. Every branch is projected at its
+    own resolution, only the projections are upsampled and summed. BatchNorm is folded into the
+    conv first; ReLU and the final conv are kept as they are.
+
+    With `rank` the (folded) conv weight W is factorized by SVD, W ~ U_r S_r V_r^T: the branches are
+    projected to `rank` channels with V_r^T, upsampled and summed, and U_r S_r expands them back at
+    full resolution. This is an approximation, see tools/lean_head_report.py for its accuracy.
+    """
+
+    # HighResolutionNet.forward_head passes the branch list instead of the concatenated tensor
+    takes_branches = True
+
+    def __init__(self, head, branch_channels, rank=0):
+        """
+        :param head: head Sequential of HighResolutionNet (conv 1x1, BN or Identity, ReLU, final conv).
+        :param branch_channels: channels of the stage-4 branches, in concatenation order.
+        :param rank: rank of the factorized projection, 0 keeps the exact full rank head.
+        """
+        super(LeanHead, self).__init__()
+        conv, bn, relu, final_layer = head[0], head[1], head[2], head[3]
+        if isinstance(bn, nn.BatchNorm2d):
+            conv = fuse_conv_bn(conv, bn)
+        if conv.kernel_size != (1, 1) or conv.groups != 1:
+            raise ValueError(f"LeanHead needs a 1x1 first conv, got kernel {conv.kernel_size}, groups {conv.groups}")
+        if sum(branch_channels) != conv.in_channels:
+            raise ValueError(f"Branches have {sum(branch_channels)} channels, the head expects {conv.in_channels}")
+
+        self.padding = conv.padding[0]
+        weight = conv.weight.detach()[:, :, 0, 0]
+        bias = conv.bias.detach() if conv.bias is not None else torch.zeros(conv.out_channels, dtype=weight.dtype,
+                                                                            device=weight.device)
+        out_channels = conv.out_channels
+
+        self.rank = int(rank) if rank and rank < min(weight.shape) else 0
+        if self.rank:
+            u, s, vh = torch.linalg.svd(weight.double(), full_matrices=False)
+            project = vh[:self.rank].to(weight.dtype)
+            self.expand = nn.Conv2d(self.rank, out_channels, kernel_size=1, bias=False)
+            with torch.no_grad():
+                self.expand.weight.copy_((u[:, :self.rank] * s[:self.rank]).to(weight.dtype)[:, :, None, None])
+            project_channels = self.rank
+        else:
+            project = weight
+            self.expand = None
+            project_channels = out_channels
+
+        self.branch_convs = nn.ModuleList()
+        start = 0
+        for channels in branch_channels:
+            branch_conv = nn.Conv2d(channels, project_channels, kernel_size=1, bias=False)
+            with torch.no_grad():
+                branch_conv.weight.copy_(project[:, start:start + channels, None, None])
+            self.branch_convs.append(branch_conv)
+            start += channels
+        self.bias = nn.Parameter(bias.clone(), requires_grad=False)
+        self.relu = relu
+        self.final_layer = final_layer
+        self.to(device=weight.device, dtype=weight.dtype)
+
+    def forward(self, x):
+        height, width = x[0].size(2), x[0].size(3)
+        # the projections are wide: bilinear upsampling of wide NCHW tensors goes through
+        # channels_last copies on CPU, running the head in channels_last avoids them
+        x = [branch.contiguous(memory_format=torch.channels_last) for branch in x]
+        y = self.branch_convs[0](x[0])
+        for branch_conv, branch in zip(self.branch_convs[1:], x[1:]):
+            y.add_(F.interpolate(branch_conv(branch), size=(height, width), mode='bilinear', align_corners=False))
+        if self.expand is not None:
+            y = self.expand(y)
+        bias = self.bias.view(1, -1, 1, 1)
+        y.add_(bias)
+        if self.padding:
+            # the padded conv sees zeros on the border, its output there is the bias
+            p = self.padding
+            border = bias.expand(y.size(0), -1, height + 2 * p, width + 2 * p).clone()
+            border[:, :, p:-p, p:-p] = y
+            y = border
+        return self.final_layer(self.relu(y)).contiguous()
+
+
+def convert_to_lean_head(model, branch_channels, rank=0):
+    """
+    Replace `model.head` of a HighResolutionNet (in eval mode) with a LeanHead, in place.
+    """
+    model.head = LeanHead(model.head, branch_channels, rank=rank).eval()
+    return model
@@ -0,0 +1,23 @@
+# ------------------------------------------------------------------------------
+# Build networks straight from a checkpoint, skipping random initialization.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+
+
+def build_from_state_dict(model_cls, state_dict, *args, **kwargs):
+    """
+    Construct `model_cls(*args, **kwargs)` on the meta device and materialize it from `state_dict`.
+
+    No parameter memory is allocated and no init op runs during construction; the checkpoint
+    tensors become the parameters and buffers as they are (`assign=True`), so memory-mapped
+    tensors stay memory-mapped. The state dict must contain every parameter and buffer.
+    """
+    with torch.device('meta'):
+        model = model_cls(*args, **kwargs)
+    model.load_state_dict(state_dict, assign=True)
+    return model
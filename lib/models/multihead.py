@@ -0,0 +1,135 @@
+# ------------------------------------------------------------------------------
+# One HRNet backbone shared by the landmark heads of several datasets.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+from .hrnet import get_face_alignment_net, make_head, concat_branches
+from .fold_bn import fold_batchnorm
+from .lean_head import LeanHead
+
+
+def get_head_channels(config):
+    extra = config.MODEL.EXTRA
+    return sum(extra.STAGE4.NUM_CHANNELS)
+
+
+def build_head(config, state_dict):
+    """
+    Landmark head of `config` materialized from the `head.*` tensors of a full checkpoint.
+    """
+    extra = config.MODEL.EXTRA
+    with torch.device('meta'):
+        head = make_head(get_head_channels(config), config.MODEL.NUM_JOINTS, extra.FINAL_CONV_KERNEL)
+        if extra.get('FOLDED_BN', False):
+            fold_batchnorm(head)
+    head.load_state_dict({k[len('head.'):]: v for k, v in state_dict.items() if k.startswith('head.')}, assign=True)
+    if extra.get('LEAN_HEAD', False):
+        head = LeanHead(head.eval(), list(extra.STAGE4.NUM_CHANNELS), rank=extra.get('LEAN_HEAD_RANK', 0))
+    return head.eval()
+
+
+class MultiHeadHighResolutionNet(nn.Module):
+    """
+    HighResolutionNet backbone run once, followed by any subset of dataset heads.
+
+    The stage-4 branches are upsampled and concatenated once and shared by all heads
+    (`LeanHead`s take the branches as they are), so N landmark schemas cost one backbone
+    plus N heads instead of N full networks.
+    """
+
+    def __init__(self, backbone, heads):
+        """
+        :param backbone: HighResolutionNet, its own head is not used.
+        :param heads: OrderedDict head name -> head module.
+        """
+        super(MultiHeadHighResolutionNet, self).__init__()
+        self.backbone = backbone
+        if hasattr(self.backbone, 'head'):
+            del self.backbone.head
+        self.heads = nn.ModuleDict(heads)
+
+    @property
+    def head_names(self):
+        return list(self.heads.keys())
+
+    def forward(self, x, heads=None):
+        """
+        :param x: (N, 3, H, W) input.
+        :param heads: names of the heads to run, all heads by default.
+        :return: OrderedDict head name -> (N, num_joints, H/4, W/4) heatmaps
+        """
+        branches = self.backbone(x, with_head=False)
+        features = None
+        outputs = OrderedDict()
+        for name in (heads or self.heads.keys()):
+            head = self.heads[name]
+            if getattr(head, 'takes_branches', False):
+                outputs[name] = head(branches)
+                continue
+            if features is None:
+                features = concat_branches(branches)
+            outputs[name] = head(features)
+        return outputs
+
+
+def backbone_mismatches(state_dicts, backbone):
+    """
+    Backbone tensors (every key but `head.*`) of each checkpoint that differ from those of `backbone`.
+
+    :return: OrderedDict head name -> mismatched keys, only for the checkpoints with any.
+    """
+    reference = {k: v for k, v in state_dicts[backbone].items() if not k.startswith('head.')}
+    mismatches = OrderedDict()
+    for name, state_dict in state_dicts.items():
+        if name == backbone:
+            continue
+        keys = {k for k in state_dict if not k.startswith('head.')}
+        mismatched = sorted(keys.symmetric_difference(reference))
+        mismatched += [k for k in sorted(keys & set(reference))
+                       if state_dict[k].shape != reference[k].shape or not torch.equal(state_dict[k], reference[k])]
+        if mismatched:
+            mismatches[name] = mismatched
+    return mismatches
+
+
+def get_multihead_net(configs, state_dicts, backbone=None, check_backbone=True):
+    """
+    Build a multi-head network from full per-dataset checkpoints.
+
+    A head only gives meaningful landmarks on the features it was trained on, so all checkpoints
+    must share the backbone tensors exactly (heads fine-tuned on one frozen backbone, tools/finetune_heads.py).
+
+    :param configs: OrderedDict head name -> model config.
+    :param state_dicts: dict head name -> checkpoint state dict.
+    :param backbone: head name whose checkpoint provides the backbone, the first one by default.
+    :param check_backbone: False accepts heads of separately trained backbones, only to measure
+                           their drift (tools/multihead_report.py), never to serve them.
+    :return: MultiHeadHighResolutionNet
+    """
+    names = list(configs.keys())
+    backbone = backbone or names[0]
+    channels = get_head_channels(configs[backbone])
+    for name in names:
+        if get_head_channels(configs[name]) != channels:
+            raise ValueError(f"Head {name} expects {get_head_channels(configs[name])} channels, "
+                             f"the {backbone} backbone gives {channels}")
+    if check_backbone:
+        mismatches = backbone_mismatches({name: state_dicts[name] for name in names}, backbone)
+        if mismatches:
+            details = ', '.join(f"{name} ({len(keys)} tensors, e.g. {keys[0]})" for name, keys in mismatches.items())
+            raise ValueError(f"The backbones of {details} differ from the {backbone} one: their heads were trained "
+                             f"on other features. Fine-tune them on the {backbone} backbone first "
+                             f"(tools/finetune_heads.py)")
+
+    model = get_face_alignment_net(configs[backbone], state_dict=state_dicts[backbone])
+    heads = OrderedDict((name, model.head if name == backbone else build_head(configs[name], state_dicts[name]))
+                        for name in names)
+    return MultiHeadHighResolutionNet(model, heads).eval()
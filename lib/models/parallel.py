@@ -0,0 +1,95 @@
+# ------------------------------------------------------------------------------
+# Concurrent execution of the independent HRNet branches and fuse paths.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+# threads: eager, a shared thread pool (torch ops release the GIL)
+# fork: torch.jit.fork, runs on the inter-op pool once the model is traced/scripted
+#       (eager fork runs synchronously), see torch.set_num_interop_threads
+PARALLEL_MODES = ('threads', 'fork')
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(num_workers, intra_op_threads=None):
+    """
+    Process wide thread pool shared by all modules, one per (workers, intra-op threads).
+
+    Every worker sets its own intra-op thread count, otherwise each of them would start
+    a full size OpenMP team and the cores would be oversubscribed.
+    """
+    key = (num_workers, intra_op_threads)
+    with _executors_lock:
+        if key not in _executors:
+            initializer = (lambda: torch.set_num_threads(intra_op_threads)) if intra_op_threads else None
+            _executors[key] = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='hrnet-branch',
+                                                 initializer=initializer)
+        return _executors[key]
+
+
+def in_caller_state(fn):
+    """
+    Wrap `fn` to run in the grad, inference and autocast modes of the calling thread:
+    they are thread local, pool threads would otherwise record autograd graphs and run fp32.
+    """
+    grad_enabled = torch.is_grad_enabled()
+    inference_mode = torch.is_inference_mode_enabled()
+    autocast = [(device, torch.get_autocast_dtype(device)) for device in ('cpu', 'cuda')
+                if torch.is_autocast_enabled(device)]
+
+    def run(*args):
+        with ExitStack() as stack:
+            if inference_mode:
+                stack.enter_context(torch.inference_mode())
+            stack.enter_context(torch.set_grad_enabled(grad_enabled))
+            for device, dtype in autocast:
+                stack.enter_context(torch.autocast(device, dtype=dtype))
+            return fn(*args)
+    return run
+
+
+def run_parallel(tasks, mode, num_workers=4, intra_op_threads=None):
+    """
+    Run independent (fn, args) tasks concurrently.
+
+    :return: list of results in task order.
+    """
+    if mode == 'fork':
+        futures = [torch.jit.fork(fn, *args) for fn, args in tasks]
+        return [torch.jit.wait(future) for future in futures]
+    if mode == 'threads':
+        executor = get_executor(num_workers, intra_op_threads)
+        futures = [executor.submit(in_caller_state(fn), *args) for fn, args in tasks[1:]]
+        # the calling thread takes the first task instead of waiting idle
+        first = tasks[0][0](*tasks[0][1])
+        return [first] + [future.result() for future in futures]
+    raise ValueError(f"Unknown parallel mode {mode}, expected one of {PARALLEL_MODES}")
+
+
+def set_parallel_branches(model, mode, num_workers=4, intra_op_threads=None):
+    """
+    Run the branches and the fuse paths of every HighResolutionModule of `model` concurrently.
+
+    :param mode: one of PARALLEL_MODES, None restores sequential execution.
+    :param num_workers: threads of the shared pool (mode 'threads').
+    :param intra_op_threads: intra-op threads of every pool thread (mode 'threads'), None keeps the default.
+    """
+    if mode is not None and mode not in PARALLEL_MODES:
+        raise ValueError(f"Unknown parallel mode {mode}, expected one of {PARALLEL_MODES}")
+    for module in model.modules():
+        if hasattr(module, 'parallel_mode'):
+            module.parallel_mode = mode
+            module.parallel_workers = num_workers
+            module.parallel_intra_op_threads = intra_op_threads
+    return model
@@ -0,0 +1,290 @@
+# ------------------------------------------------------------------------------
+# Structured channel pruning of HighResolutionNet into a smaller dense network.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import defaultdict, OrderedDict
+
+import torch
+import torch.nn as nn
+
+from .hrnet import HighResolutionNet, BasicBlock, get_face_alignment_net
+from .input_norm import normalized_state_dict
+
+CRITERIA = ('gamma', 'activation')
+
+FULL = 'full'
+CONCAT = 'concat'
+
+
+class ChannelSpaces(object):
+    """
+    Which channel set every conv and BatchNorm of an HRNet reads and writes.
+
+    A stream is the residual signal of one branch: the blocks add to it, the fuse layers write
+    into it, the transitions create it and the head reads it, so one channel set is removed from
+    all of them at once. A branch that passes to the next stage without a transition conv keeps
+    its stream. Every other channel set (inside a block, between the convs of a downsampling
+    fuse path, inside the head) is private to its layer pair and chosen on its own. FULL channels
+    (input, stem, heatmaps) are never pruned.
+    """
+
+    def __init__(self, model):
+        if not isinstance(model, HighResolutionNet):
+            raise TypeError(f"Expected a HighResolutionNet, got {type(model).__name__}")
+        if getattr(model.head, 'takes_branches', False):
+            raise ValueError("Prune the model before converting its head to a LeanHead")
+        self.layers = OrderedDict()  # module path -> (out space, in space)
+        self.producers = defaultdict(list)  # space -> modules writing it (BatchNorm, or the conv when folded)
+        self.width = OrderedDict()  # space -> channels
+        self.alias = {}
+        self.inner_spaces = []
+        self.stage_streams = OrderedDict()  # stage -> stream of every branch
+        self._walk(model)
+
+    def stream(self, stage, branch):
+        key = ('stream', stage, branch)
+        while key in self.alias:
+            key = self.alias[key]
+        return key
+
+    def _conv_bn(self, path, conv, bn_name, bn, in_space, out_space):
+        self.layers[path + conv] = (out_space, in_space)
+        if isinstance(bn, nn.BatchNorm2d):
+            self.layers[path + bn_name] = (out_space, out_space)
+            self.producers[out_space].append(path + bn_name)
+        else:
+            self.producers[out_space].append(path + conv)
+
+    def _add_conv(self, modules, path, conv_name, bn_name, in_space, out_space):
+        conv = modules[conv_name]
+        self.width.setdefault(out_space, conv.out_channels)
+        if out_space[0] == 'inner' and out_space not in self.inner_spaces:
+            self.inner_spaces.append(out_space)
+        self._conv_bn(path, conv_name, bn_name, modules.get(bn_name), in_space, out_space)
+
+    def _walk(self, model):
+        pre_spaces = [FULL]
+        for stage, transition_name in ((2, 'transition1'), (3, 'transition2'), (4, 'transition3')):
+            transition = getattr(model, transition_name)
+            for k, layer in enumerate(transition):
+                path = f'{transition_name}.{k}.'
+                if k < len(pre_spaces):
+                    if layer is None:
+                        self.alias[('stream', stage, k)] = pre_spaces[k]
+                    else:
+                        self._add_conv(layer._modules, path, '0', '1', pre_spaces[k], self.stream(stage, k))
+                else:
+                    in_space = pre_spaces[-1]
+                    for j, sub in enumerate(layer):
+                        last = j == len(layer) - 1
+                        out_space = self.stream(stage, k) if last else ('inner', f'{path}{j}')
+                        self._add_conv(sub._modules, f'{path}{j}.', '0', '1', in_space, out_space)
+                        in_space = out_space
+
+            stage_module = getattr(model, f'stage{stage}')
+            for m, module in enumerate(stage_module):
+                self._walk_module(module, f'stage{stage}.{m}.', stage)
+            pre_spaces = [self.stream(stage, i) for i in range(stage_module[-1].num_branches)]
+            self.stage_streams[stage] = pre_spaces
+
+        head_inner = ('inner', 'head')
+        self.inner_spaces.append(head_inner)
+        self.width[head_inner] = model.head[0].out_channels
+        self._conv_bn('head.', '0', '1', model.head[1], CONCAT, head_inner)
+        self.layers['head.3'] = (FULL, head_inner)
+
+    def _walk_module(self, module, path, stage):
+        for i, branch in enumerate(module.branches):
+            stream = self.stream(stage, i)
+            for b, block in enumerate(branch):
+                if not isinstance(block, BasicBlock):
+                    raise TypeError(f"Only BASIC blocks can be pruned, got {type(block).__name__}")
+                block_path = f'{path}branches.{i}.{b}.'
+                inner = ('inner', block_path)
+                self._add_conv(block._modules, block_path, 'conv1', 'bn1', stream, inner)
+                self._add_conv(block._modules, block_path, 'conv2', 'bn2', inner, stream)
+                if block.downsample is not None:
+                    self._add_conv(block.downsample._modules, block_path + 'downsample.', '0', '1', stream, stream)
+        if module.fuse_layers is None:
+            return
+        for i, row in enumerate(module.fuse_layers):
+            for j, fuse in enumerate(row):
+                if fuse is None:
+                    continue
+                fuse_path = f'{path}fuse_layers.{i}.{j}.'
+                if j > i:
+                    self._add_conv(fuse._modules, fuse_path, '0', '1', self.stream(stage, j), self.stream(stage, i))
+                    continue
+                in_space = self.stream(stage, j)
+                for k, sub in enumerate(fuse):
+                    last = k == len(fuse) - 1
+                    out_space = self.stream(stage, i) if last else ('inner', f'{fuse_path}{k}')
+                    self._add_conv(sub._modules, f'{fuse_path}{k}.', '0', '1', in_space, out_space)
+                    in_space = out_space
+
+    @property
+    def streams(self):
+        return list(OrderedDict.fromkeys(s for streams in self.stage_streams.values() for s in streams))
+
+
+def gamma_scores(model, spaces):
+    """
+    Channel importance from the BatchNorm scales writing each channel set; a stream sums the
+    |gamma| of all its writers, each normalized by its mean so that no layer dominates.
+    """
+    modules = dict(model.named_modules())
+    scores = {}
+    for space in spaces.streams + spaces.inner_spaces:
+        total = 0
+        for name in spaces.producers[space]:
+            bn = modules[name]
+            if not isinstance(bn, nn.BatchNorm2d):
+                raise ValueError(f"{name} has no BatchNorm (folded model?), use the 'activation' criterion")
+            gamma = bn.weight.detach().abs().float()
+            total = total + gamma / gamma.mean().clamp_min(1e-12)
+        scores[space] = total
+    return scores
+
+
+def activation_scores(model, spaces, inputs, batch_size=8):
+    """
+    Channel importance from the mean absolute activations on `inputs`: the outputs of the stage
+    modules for the streams, the (ReLU'd) outputs of their writers for the other channel sets.
+    """
+    modules = dict(model.named_modules())
+    scores = defaultdict(float)
+
+    def add(space, tensor):
+        value = tensor.detach().float().abs().mean((0, 2, 3))
+        scores[space] = scores[space] + value / value.mean().clamp_min(1e-12)
+
+    def stream_hook(streams):
+        def hook(module, inputs, output):
+            for stream, y in zip(streams, output):
+                add(stream, y)
+        return hook
+
+    def inner_hook(space):
+        def hook(module, inputs, output):
+            add(space, torch.relu(output))
+        return hook
+
+    handles = []
+    for stage, streams in spaces.stage_streams.items():
+        for module in getattr(model, f'stage{stage}'):
+            handles.append(module.register_forward_hook(stream_hook(streams)))
+    for space in spaces.inner_spaces:
+        handles.append(modules[spaces.producers[space][0]].register_forward_hook(inner_hook(space)))
+    model.eval()
+    try:
+        with torch.no_grad():
+            for start in range(0, len(inputs), batch_size):
+                model(inputs[start:start + batch_size])
+    finally:
+        for handle in handles:
+            handle.remove()
+    return dict(scores)
+
+
+def kept_width(width, ratio, multiple_of=1):
+    keep = int(round(width * (1 - ratio) / multiple_of)) * multiple_of
+    return min(width, max(multiple_of, keep, 1))
+
+
+def top_channels(score, count):
+    return torch.sort(torch.topk(score, count).indices).values
+
+
+def pruned_config(config, spaces, stream_widths):
+    cfg = config.clone()
+    cfg.defrost()
+    for stage, streams in spaces.stage_streams.items():
+        cfg.MODEL.EXTRA[f'STAGE{stage}'].NUM_CHANNELS = [stream_widths[s] for s in streams]
+    # pruned from the unfolded stem, the pruned network reads normalized crops
+    cfg.MODEL.EXTRA.RAW_INPUT = False
+    cfg.MODEL.INIT_WEIGHTS = False
+    cfg.freeze()
+    return cfg
+
+
+def prune_hrnet(model, config, ratios, criterion='gamma', inputs=None, multiple_of=1):
+    """
+    Remove the least important channels of every branch stream, consistently across the blocks,
+    fuse layers, transitions and head, and rebuild a dense smaller network.
+
+    :param model: HighResolutionNet built from `config` (not folded for the 'gamma' criterion).
+    :param ratios: fraction of channels to remove per branch (one value, or one per branch of stage 4).
+    :param criterion: 'gamma' (BatchNorm scales) or 'activation' (mean |activation| on `inputs`).
+    :param inputs: (N, 3, H, W) calibration inputs for the 'activation' criterion (raw crops for
+                   RAW_INPUT models; the pruned model reads normalized ones).
+    :param multiple_of: round the kept widths to a multiple of this (vector-friendly shapes).
+    :return: (pruned model in eval mode, its config)
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown criterion {criterion}, expected one of {CRITERIA}")
+    spaces = ChannelSpaces(model)
+    num_branches = len(spaces.stage_streams[4])
+    ratios = list(ratios) if isinstance(ratios, (list, tuple)) else [ratios] * num_branches
+    if len(ratios) != num_branches:
+        raise ValueError(f"Expected {num_branches} ratios, got {len(ratios)}")
+    if criterion == 'activation':
+        if inputs is None:
+            raise ValueError("The 'activation' criterion needs calibration inputs")
+        scores = activation_scores(model, spaces, inputs)
+    else:
+        scores = gamma_scores(model, spaces)
+
+    # branch i keeps its stream through the stages, it is pruned with ratios[i]
+    stream_ratio = {}
+    for stage, streams in spaces.stage_streams.items():
+        for i, stream in enumerate(streams):
+            stream_ratio[stream] = ratios[i]
+    keep = {}
+    stream_widths = {}
+    for stream in spaces.streams:
+        stream_widths[stream] = kept_width(spaces.width[stream], stream_ratio[stream], multiple_of)
+        keep[stream] = top_channels(scores[stream], stream_widths[stream])
+
+    cfg = pruned_config(config, spaces, stream_widths)
+    with torch.device('meta'):
+        target = HighResolutionNet(cfg)
+    # a transition conv exists only between different widths, pruning must not make them equal
+    collapsed = [f'{name}.{k}' for name in ('transition1', 'transition2', 'transition3')
+                 for k, (source, pruned) in enumerate(zip(getattr(model, name), getattr(target, name)))
+                 if (source is None) != (pruned is None)]
+    if collapsed:
+        raise ValueError(f"Pruning to {cfg.MODEL.EXTRA.STAGE4.NUM_CHANNELS} channels gives equal widths "
+                         f"around {', '.join(collapsed)}, which would drop the transition convs; "
+                         f"use other ratios or multiple_of")
+    target_modules = dict(target.named_modules())
+    for space in spaces.inner_spaces:
+        path = next(p for p, (out_space, _) in spaces.layers.items() if out_space == space)
+        count = target_modules[path].weight.shape[0]
+        keep[space] = top_channels(scores[space], count)
+
+    offsets, start = [], 0
+    for stream in spaces.stage_streams[4]:
+        offsets.append(start)
+        start += spaces.width[stream]
+    keep[CONCAT] = torch.cat([keep[s] + offset for s, offset in zip(spaces.stage_streams[4], offsets)])
+
+    state_dict = normalized_state_dict(model)
+    pruned = OrderedDict()
+    for key, target_tensor in target.state_dict().items():
+        path, name = key.rsplit('.', 1)
+        tensor = state_dict[key]
+        if path in spaces.layers and tensor.dim() > 0:
+            out_space, in_space = spaces.layers[path]
+            if out_space in keep:
+                tensor = tensor.index_select(0, keep[out_space].to(tensor.device))
+            if tensor.dim() == 4 and in_space in keep:
+                tensor = tensor.index_select(1, keep[in_space].to(tensor.device))
+        if tensor.shape != target_tensor.shape:
+            raise RuntimeError(f"{key}: pruned to {tuple(tensor.shape)}, the config needs {tuple(target_tensor.shape)}")
+        pruned[key] = tensor.clone()
+
+    return get_face_alignment_net(cfg, state_dict=pruned).eval(), cfg
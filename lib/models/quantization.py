@@ -0,0 +1,78 @@
+# ------------------------------------------------------------------------------
+# INT8 static post-training quantization of HighResolutionNet.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from .input_norm import RawInputConv
+
+
+class HeatmapNet(nn.Module):
+    """
+    Calls the wrapped network with its default arguments, so FX traces the heatmap path only.
+    """
+
+    def __init__(self, model):
+        super(HeatmapNet, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)
+
+
+def quantize_int8(model, calibration_batches, backend='x86'):
+    """
+    Static INT8 quantization with FX graph mode.
+
+    Conv/BN/ReLU are fused, every conv (stem, blocks, transitions, fuse layers, head), the
+    residual and fuse-layer adds, the upsampling and the head concat run on quint8 tensors.
+    Inputs and outputs stay float. The first conv of raw input models (`RawInputConv`, its bias
+    map depends on the input size) is not traced and stays float.
+
+    :param model: float HighResolutionNet in eval mode, on CPU.
+    :param calibration_batches: iterable of (N, 3, H, W) float input batches for the observers.
+    :param backend: quantized engine, 'x86'/'fbgemm' for x86 servers, 'qnnpack' for ARM.
+    :return: quantized torch.fx.GraphModule
+    """
+    torch.backends.quantized.engine = backend
+    calibration_batches = iter(calibration_batches)
+    example = next(calibration_batches)
+
+    custom_config = PrepareCustomConfig().set_non_traceable_module_classes([RawInputConv])
+    prepared = prepare_fx(HeatmapNet(copy.deepcopy(model)).eval(), get_default_qconfig_mapping(backend),
+                          example_inputs=(example,), prepare_custom_config=custom_config)
+    with torch.no_grad():
+        prepared(example)
+        for batch in calibration_batches:
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def save_int8(quantized_model, path, backend='x86'):
+    """
+    Save a quantized model as TorchScript, with the engine it was calibrated for.
+    """
+    torch.jit.save(torch.jit.script(quantized_model), path, _extra_files={'quantized_engine': backend})
+
+
+def load_int8(path):
+    """
+    :return: (TorchScript module, quantized engine name); the engine is also activated.
+    """
+    extra_files = {'quantized_engine': ''}
+    model = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    backend = extra_files['quantized_engine']
+    if isinstance(backend, bytes):
+        backend = backend.decode('utf-8')
+    torch.backends.quantized.engine = backend or torch.backends.quantized.engine
+    return model.eval(), backend
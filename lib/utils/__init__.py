@@ -0,0 +1,10 @@
+# ------------------------------------------------------------------------------
+# Helpers shared by the models and the tools.
+# ------------------------------------------------------------------------------
+
+from .model_stats import count_parameters, count_macs, layer_macs
+from .profiler import profile_modules, group_branches, format_table
+from .benchmark import make_inputs, latency_ms
+
+__all__ = ['count_parameters', 'count_macs', 'layer_macs', 'profile_modules', 'group_branches', 'format_table',
+           'make_inputs', 'latency_ms']
@@ -0,0 +1,43 @@
+# ------------------------------------------------------------------------------
+# Input batches and latency measurement shared by the export, report and benchmark tools.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import torch
+
+
+def make_inputs(images, prepare, num_inputs, image_size=(256, 256), seed=0):
+    """
+    Model inputs with their crop centers and scales, for `run_model` of the server.
+
+    :param images: face images, every one used at least once (cycled up to `num_inputs`);
+                   without images `num_inputs` random inputs cropped from a whole `image_size` image.
+    :param prepare: callable(img, output_size=...) -> (CHW tensor, center, scale), `prepare_input` of the server.
+    :param image_size: (width, height), MODEL.IMAGE_SIZE of the model.
+    :return: (N, 3, H, W) normalized inputs, centers, scales
+    """
+    width, height = image_size
+    if images:
+        inputs = [prepare(images[i % len(images)], output_size=image_size)
+                  for i in range(max(num_inputs, len(images)))]
+        return torch.stack([x[0] for x in inputs]), [x[1] for x in inputs], [x[2] for x in inputs]
+    torch.manual_seed(seed)
+    center, scale = torch.Tensor([width / 2, height / 2]), max(width, height) / 200
+    return torch.randn(num_inputs, 3, height, width), [center] * num_inputs, [scale] * num_inputs
+
+
+def latency_ms(model, img_tensor, repeats=5):
+    """
+    Mean forward time after one warm-up forward, without autograd.
+    """
+    with torch.no_grad():
+        model(img_tensor)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(img_tensor)
+    return 1000.0 * (time.perf_counter() - start) / repeats
@@ -0,0 +1,51 @@
+# ------------------------------------------------------------------------------
+# Parameter and multiply-accumulate counts of the networks.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def layer_macs(module, output):
+    """
+    Multiply-accumulates of one sample through a Conv2d or Linear layer, 0 for other layers.
+    """
+    if isinstance(module, nn.Conv2d):
+        kernel = module.kernel_size[0] * module.kernel_size[1] * module.in_channels // module.groups
+        return output[0].numel() * kernel
+    if isinstance(module, nn.Linear):
+        return output[0].numel() * module.in_features
+    return 0
+
+
+def count_macs(model, input_size=(3, 256, 256), forward=None):
+    """
+    Multiply-accumulates of the Conv2d and Linear layers for one sample (BatchNorm, activations
+    and resampling are not counted).
+
+    :param input_size: (C, H, W) of the input.
+    :param forward: callable(model, x) to run instead of model(x).
+    """
+    macs = []
+
+    def hook(module, _, output):
+        macs.append(layer_macs(module, output))
+
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    param = next(model.parameters())
+    x = torch.zeros((1,) + tuple(input_size), dtype=param.dtype, device=param.device)
+    try:
+        with torch.no_grad():
+            forward(model, x) if forward is not None else model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return sum(macs)
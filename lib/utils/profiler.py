@@ -0,0 +1,177 @@
+# ------------------------------------------------------------------------------
+# Per-module wall time, MACs, parameters and activation sizes of the networks.
+# ------------------------------------------------------------------------------
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+import time
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+from .model_stats import layer_macs
+
+# module paths aggregated per branch, for the HRNets of hrnet.py and cls_hrnet.py:
+# the blocks of branch i, the fuse paths into output i (summed over the modules of a stage)
+# and the per-branch layers around the stages
+BRANCH_GROUPS = (
+    (re.compile(r'^(stage\d+)\.\d+\.branches\.(\d+)$'), '{0}.branch{1}'),
+    (re.compile(r'^(stage\d+)\.\d+\.fuse_layers\.(\d+)\.\d+$'), '{0}.fuse{1}'),
+    (re.compile(r'^(transition\d+)\.(\d+)$'), '{0}.branch{1}'),
+    (re.compile(r'^(incre_modules)\.(\d+)$'), '{0}.branch{1}'),
+    (re.compile(r'^(downsamp_modules)\.(\d+)$'), '{0}.branch{1}'),
+)
+
+FIELDS = ('time_ms', 'macs', 'params', 'activation_bytes')
+
+
+def output_bytes(output):
+    if torch.is_tensor(output):
+        return output.numel() * output.element_size()
+    if isinstance(output, (list, tuple)):
+        return sum(output_bytes(y) for y in output)
+    if isinstance(output, dict):
+        return sum(output_bytes(y) for y in output.values())
+    return 0
+
+
+def ancestors(path):
+    """
+    '', 'stage2', 'stage2.0', ... 'stage2.0.branches.1.0.conv1' for 'stage2.0.branches.1.0.conv1'.
+    """
+    parts = path.split('.') if path else []
+    return [''] + ['.'.join(parts[:k]) for k in range(1, len(parts) + 1)]
+
+
+def profile_modules(model, x, repeats=10, warmup=2, forward=None):
+    """
+    Forward hooks on every module: inclusive wall time, MACs, parameters and output sizes.
+
+    Times are measured around every module call (the children included) and averaged over
+    `repeats` forwards, the hooks themselves cost a few microseconds per call. Run the model
+    sequentially (no parallel branches) for times that add up.
+
+    :param x: input batch.
+    :param forward: callable(model, x) to run instead of model(x).
+    :return: OrderedDict module path ('' - the whole model) -> dict with
+             calls: calls per forward,
+             time_ms: inclusive wall time per forward (of the children for containers that aren't called),
+             macs: Conv2d and Linear multiply-accumulates per sample, the children included,
+             params: parameters, the children included,
+             activation_bytes: size of the module outputs per forward.
+    """
+    sync = x.is_cuda
+    stats = OrderedDict()
+    paths = {}
+    for path, module in model.named_modules():
+        paths[module] = path
+        stats[path] = {'calls': 0, 'time_ms': 0.0, 'macs': 0, 'params': sum(p.numel() for p in module.parameters()),
+                       'activation_bytes': 0}
+    starts = {}
+    recording = [False]
+
+    def pre_hook(module, _):
+        if sync:
+            torch.cuda.synchronize()
+        starts.setdefault(module, []).append(time.perf_counter())
+
+    def hook(module, _, output):
+        if sync:
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - starts[module].pop()
+        if not recording[0]:
+            return None
+        path = paths[module]
+        entry = stats[path]
+        entry['calls'] += 1
+        entry['time_ms'] += 1000.0 * elapsed
+        entry['activation_bytes'] += output_bytes(output)
+        macs = layer_macs(module, output) if isinstance(module, (nn.Conv2d, nn.Linear)) else 0
+        if macs:
+            for ancestor in ancestors(path):
+                stats[ancestor]['macs'] += macs
+        return None
+
+    handles = []
+    for module in model.modules():
+        handles.append(module.register_forward_pre_hook(pre_hook))
+        handles.append(module.register_forward_hook(hook))
+    try:
+        with torch.no_grad():
+            for i in range(warmup + repeats):
+                recording[0] = i >= warmup
+                forward(model, x) if forward is not None else model(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    for entry in stats.values():
+        entry['calls'] = entry['calls'] // repeats
+        entry['time_ms'] /= repeats
+        entry['activation_bytes'] //= repeats
+        entry['macs'] //= repeats
+    # containers that are never called themselves (ModuleList) get the sums of their children,
+    # children come after their parents in `named_modules`
+    for path in reversed(list(stats)):
+        parent = path.rpartition('.')[0] if path else None
+        if parent is not None and stats[parent]['calls'] == 0:
+            stats[parent]['time_ms'] += stats[path]['time_ms']
+            stats[parent]['activation_bytes'] += stats[path]['activation_bytes']
+    return OrderedDict((path, entry) for path, entry in stats.items() if entry['calls'] or entry['macs'])
+
+
+def group_branches(stats, groups=BRANCH_GROUPS):
+    """
+    Sum the module statistics of every branch (see `BRANCH_GROUPS`); for every stage the time
+    not spent in its branches and fuse paths (additions, in place fusing, ReLUs) is `{stage}.other`.
+
+    :return: OrderedDict group name -> dict of `FIELDS`.
+    """
+    grouped = OrderedDict()
+    for path, entry in stats.items():
+        for pattern, name in groups:
+            match = pattern.match(path)
+            if match:
+                group = grouped.setdefault(name.format(*match.groups()), dict.fromkeys(FIELDS, 0))
+                for field in FIELDS:
+                    group[field] += entry[field]
+                break
+
+    for stage in [path for path in stats if re.match(r'^stage\d+$', path)]:
+        inner = [g for name, g in grouped.items() if re.match(rf'^{stage}\.(branch|fuse)\d+$', name)]
+        if inner:
+            grouped[f'{stage}.other'] = {
+                'time_ms': stats[stage]['time_ms'] - sum(g['time_ms'] for g in inner),
+                'macs': stats[stage]['macs'] - sum(g['macs'] for g in inner),
+                'params': stats[stage]['params'] - sum(g['params'] for g in inner),
+                'activation_bytes': 0,
+            }
+    return OrderedDict(sorted(grouped.items(), key=lambda item: _group_order(item[0])))
+
+
+def _group_order(name):
+    prefix, _, suffix = name.partition('.')
+    number = re.search(r'\d+', prefix)
+    kind = re.match(r'[a-z]+', suffix).group(0)
+    index = re.search(r'\d+$', suffix)
+    return (int(number.group(0)) if number else 99, prefix, kind, int(index.group(0)) if index else 0)
+
+
+def format_table(rows, total, title='module'):
+    """
+    :param rows: OrderedDict name -> dict of `FIELDS`.
+    :param total: dict of `FIELDS` of the whole model, for the time and MAC shares.
+    """
+    width = max([len(title)] + [len(name) for name in rows])
+    lines = [f"{title:<{width}} | {'ms':>8} | {'time %':>6} | {'MMACs':>9} | {'MACs %':>6} | {'params':>9} | {'act MB':>8}"]
+    lines.append('-' * len(lines[0]))
+    for name, entry in rows.items():
+        time_share = 100.0 * entry['time_ms'] / total['time_ms'] if total['time_ms'] else 0.0
+        mac_share = 100.0 * entry['macs'] / total['macs'] if total['macs'] else 0.0
+        lines.append(f"{name:<{width}} | {entry['time_ms']:>8.2f} | {time_share:>6.1f} | {entry['macs'] / 1e6:>9.1f} | "
+                     f"{mac_share:>6.1f} | {entry['params']:>9,} | {entry['activation_bytes'] / 2 ** 20:>8.2f}")
+    return '\n'.join(lines)
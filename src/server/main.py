@@ -1,4 +1,5 @@
 import os
+from functools import partial
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import cv2
@@ -6,16 +7,26 @@ import numpy as np
 from pathlib import Path
 import io
 import base64
-import torch
 
 # --- Project Root Definition ---
 current_file = Path(__file__).resolve()
 PROJECT_ROOT = current_file.parent.parent.parent
 
+# torch - модели PyTorch (или onnxruntime, см. MODEL_BACKEND);
+# slim - экспортированный ONNX граф через cv2.dnn, процесс сервера вообще не импортирует torch.
+SERVING_MODE = os.environ.get('SERVING_MODE', 'torch')
+
 # Import your original utility functions
-from utils.utils_inference import get_lmks_by_img, get_model_by_name
+if SERVING_MODE == 'slim':
+    from utils.slim_inference import prepare_input_np as prepare_input, load_slim_model, run_slim_batch
+else:
+    import torch
+    from utils.utils_inference import prepare_input, model_registry, load_multihead_model, run_multihead_batch
+    from utils.batching import run_torch_batch
+from utils.preprocessing import box_to_center_scale, takes_raw_input
+from utils.batching import MicroBatcher
 # Import new utility functions
-from utils.image_processing_utils import calculate_symmetry_index, process_image_with_landmarks_and_symmetry
+from utils.image_processing_utils import calculate_symmetry_index, process_image_with_faces
 from utils.utils_landmarks import get_five_landmarks_from_net
 
 app = Flask(__name__)
@@ -24,27 +35,115 @@ CORS(app)
 (current_file.parent / 'utils' / '__init__.py').touch(exist_ok=True)
 
 # --- Global Model Loading ---
-face_alignment_model = None
+face_alignment_models = {}
 face_cascade = None
+landmark_batchers = {}
 HAARCASCADE_PATH = PROJECT_ROOT / 'src' / 'server' / 'utils' / 'haarcascade_frontalface_default.xml'
 # НОВОЕ: Переменная для хранения используемого device
-MODEL_DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+MODEL_DEVICE = 'cuda' if SERVING_MODE != 'slim' and torch.cuda.is_available() else 'cpu'
+# Landmark models served by this process (loaded in parallel at start), the first one is the default.
+MODEL_NAMES = [name.strip() for name in os.environ.get('MODELS', 'WFLW').split(',') if name.strip()]
+DEFAULT_MODEL = MODEL_NAMES[0]
+# fp32, fp16 (GPU), bf16 (channels_last + bf16 autocast, fp32 where the CPU has no bf16)
+# or int8 (CPU, quantized checkpoints written by tools/quantize.py).
+MODEL_PRECISION = os.environ.get('MODEL_PRECISION', 'fp32')
+# Micro-batching: concurrent requests are collected for up to BATCH_MAX_WAIT_MS
+# (or until BATCH_MAX_SIZE faces are queued) and run through the model together.
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5.0))
+# Faces (largest first) passed to the landmark model per image.
+MAX_FACES = int(os.environ.get('MAX_FACES', 10))
+# Traced and frozen graphs per batch size, e.g. JIT_BATCH_BUCKETS=1,2,4,8 (empty - eager model).
+# Graphs are cached in hrnetv2_models/compiled, batches are padded up to the nearest bucket.
+JIT_BATCH_BUCKETS = tuple(int(b) for b in os.environ.get('JIT_BATCH_BUCKETS', '').split(',') if b.strip())
+# torch or onnxruntime (runs hrnetv2_models/HR18-<MODEL>.onnx exported by tools/export_onnx.py, CPU only;
+# session pool size and threads per session: ORT_SESSIONS, ORT_INTRA_OP_THREADS, WEB_CONCURRENCY).
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'torch')
+# MULTI_HEAD=1: один backbone (из чекпоинта первой модели MODELS) и головы всех моделей MODELS,
+# несколько схем ключевых точек за один проход backbone (только SERVING_MODE=torch). Чекпоинты должны иметь общий
+# backbone: головы дообучаются на нём tools/finetune_heads.py (MODELS=WFLW-shared,300W-shared).
+MULTI_HEAD = os.environ.get('MULTI_HEAD', '0') == '1'
+# Параллельное выполнение веток HRNet: threads (пул потоков, eager) или fork (torch.jit.fork,
+# параллельно только в графах JIT_BATCH_BUCKETS; потоки inter-op - TORCH_INTEROP_THREADS). Пусто - последовательно.
+# Только SERVING_MODE=torch: в slim режиме torch не загружается и PARALLEL_BRANCHES не действует.
+PARALLEL_BRANCHES = os.environ.get('PARALLEL_BRANCHES', '') or None
+if SERVING_MODE != 'slim' and PARALLEL_BRANCHES and os.environ.get('TORCH_INTEROP_THREADS'):
+    torch.set_num_interop_threads(int(os.environ['TORCH_INTEROP_THREADS']))
+# Каскад: CASCADE_INPUT_SIZE=128 - сначала быстрый проход на кропах 128x128 (тепловые карты 32x32), полную модель
+# проходят только лица со средней уверенностью точек (максимум тепловой карты) ниже CASCADE_THRESHOLD.
+# Быстрый проход делает та же модель (eager) или `<MODEL><CASCADE_MODEL_SUFFIX>`, например обученная на 128x128.
+# Только SERVING_MODE=torch без MULTI_HEAD. 0 - без каскада.
+CASCADE_INPUT_SIZE = int(os.environ.get('CASCADE_INPUT_SIZE', 0) or 0)
+CASCADE_THRESHOLD = float(os.environ.get('CASCADE_THRESHOLD', 0.5))
+CASCADE_MODEL_SUFFIX = os.environ.get('CASCADE_MODEL_SUFFIX', '')
+cascade_models = {}
+cascade_batchers = {}
 
 
 def load_face_model():
-    global face_alignment_model, face_cascade, MODEL_DEVICE
-    if face_alignment_model is None:
+    global face_alignment_models, face_cascade, landmark_batchers, MODEL_DEVICE, cascade_models, cascade_batchers
+    if CASCADE_INPUT_SIZE and (SERVING_MODE == 'slim' or MULTI_HEAD):
+        raise ValueError("CASCADE_INPUT_SIZE работает только с SERVING_MODE=torch без MULTI_HEAD")
+    if not face_alignment_models:
         try:
             # Render бесплатный tier НЕ поддерживает CUDA.
             # Поэтому явно устанавливаем device='cpu' для модели.
             # Мы также сохраним это значение в MODEL_DEVICE.
-            app.logger.info(f"Loading face alignment model on device: {MODEL_DEVICE}")
-            face_alignment_model = get_model_by_name('WFLW', device=MODEL_DEVICE)
-            app.logger.info("Face alignment model loaded successfully.")
+            app.logger.info(f"Loading face alignment models {MODEL_NAMES} on device: {MODEL_DEVICE}")
+            if SERVING_MODE == 'slim':
+                face_alignment_models = {name: load_slim_model(name) for name in MODEL_NAMES}
+            elif MULTI_HEAD:
+                multihead_model = load_multihead_model(MODEL_NAMES, device=MODEL_DEVICE, precision=MODEL_PRECISION)
+                face_alignment_models = {name: multihead_model for name in MODEL_NAMES}
+            else:
+                num_models = len(MODEL_NAMES) * (2 if CASCADE_INPUT_SIZE else 1)
+                model_registry.capacity = max(model_registry.capacity, num_models)
+                face_alignment_models = model_registry.preload(MODEL_NAMES, device=MODEL_DEVICE,
+                                                               precision=MODEL_PRECISION,
+                                                               jit_buckets=JIT_BATCH_BUCKETS or None,
+                                                               backend=MODEL_BACKEND,
+                                                               parallel_branches=PARALLEL_BRANCHES)
+            app.logger.info("Face alignment models loaded successfully.")
         except Exception as e:
             app.logger.error(f"Failed to load face alignment model: {e}")
             raise
 
+    if CASCADE_INPUT_SIZE and not cascade_models:
+        try:
+            # быстрый проход всегда eager torch: графы JIT и ONNX построены под полный размер входа
+            cascade_models = {name: model_registry.get(name + CASCADE_MODEL_SUFFIX, device=MODEL_DEVICE,
+                                                       precision=MODEL_PRECISION,
+                                                       parallel_branches=PARALLEL_BRANCHES)
+                              for name in MODEL_NAMES}
+            app.logger.info(f"Cascade: {CASCADE_INPUT_SIZE}x{CASCADE_INPUT_SIZE} first pass, "
+                            f"threshold {CASCADE_THRESHOLD}")
+        except Exception as e:
+            app.logger.error(f"Failed to load face alignment model: {e}")
+            raise
+
+    if not landmark_batchers:
+        if MULTI_HEAD and SERVING_MODE != 'slim':
+            # все головы обслуживает один батчер общего backbone
+            batcher = MicroBatcher(face_alignment_models[DEFAULT_MODEL], device=MODEL_DEVICE,
+                                   max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                                   run_batch=run_multihead_batch)
+            landmark_batchers = {name: batcher for name in face_alignment_models}
+        else:
+            run_batch = run_slim_batch if SERVING_MODE == 'slim' else run_torch_batch
+            if CASCADE_INPUT_SIZE:
+                run_batch = partial(run_torch_batch, return_confidence=True)
+            landmark_batchers = {name: MicroBatcher(model, device=MODEL_DEVICE, max_batch_size=BATCH_MAX_SIZE,
+                                                    max_wait_ms=BATCH_MAX_WAIT_MS, run_batch=run_batch)
+                                 for name, model in face_alignment_models.items()}
+        app.logger.info(f"Micro-batching enabled: max_batch_size={BATCH_MAX_SIZE}, max_wait_ms={BATCH_MAX_WAIT_MS}")
+
+    if CASCADE_INPUT_SIZE and not cascade_batchers:
+        cascade_batchers = {name: MicroBatcher(model, device=MODEL_DEVICE, max_batch_size=BATCH_MAX_SIZE,
+                                               max_wait_ms=BATCH_MAX_WAIT_MS,
+                                               output_size=(CASCADE_INPUT_SIZE, CASCADE_INPUT_SIZE),
+                                               run_batch=partial(run_torch_batch, return_confidence=True))
+                            for name, model in cascade_models.items()}
+
     if face_cascade is None:
         if not HAARCASCADE_PATH.exists():
             app.logger.error(f"Haar Cascade XML file not found at: {HAARCASCADE_PATH}")
@@ -58,7 +157,7 @@ def load_face_model():
 
 @app.before_request
 def before_first_request():
-    if face_alignment_model is None or face_cascade is None:
+    if not face_alignment_models or face_cascade is None or not landmark_batchers:
         load_face_model()
 
 
@@ -67,6 +166,74 @@ def health_check():
     return jsonify({"status": "Server is running!", "project_root": str(PROJECT_ROOT)})
 
 
+@app.route('/metrics')
+def metrics():
+    return jsonify({
+        "serving_mode": SERVING_MODE,
+        "multi_head": MULTI_HEAD,
+        "models": list(face_alignment_models) if SERVING_MODE == 'slim' or MULTI_HEAD else
+        [list(key) for key in model_registry.keys()],
+        "batching": {name: batcher.stats() for name, batcher in landmark_batchers.items()},
+        "cascade": {"input_size": CASCADE_INPUT_SIZE, "threshold": CASCADE_THRESHOLD,
+                    "batching": {name: batcher.stats() for name, batcher in cascade_batchers.items()}}
+        if CASCADE_INPUT_SIZE else None,
+        "backends": {name: model.stats() for name, model in face_alignment_models.items() if hasattr(model, 'stats')},
+    })
+
+
+def describe_symmetry(symmetry_index):
+    return f"Индекс симметрии вашего лица: {symmetry_index}%. " + \
+        ("Великолепная симметрия! Ваше лицо очень гармонично." if symmetry_index > 90 else
+         "Высокая симметрия. У вас очень сбалансированные черты лица." if symmetry_index > 75 else
+         "Хорошая симметрия. Черты лица достаточно гармоничны." if symmetry_index > 50 else
+         "Есть заметные отклонения в симметрии. Возможно, стоит обратить внимание на некоторые детали.")
+
+
+def cascade_landmarks(img, crops, model_names, raw_input):
+    """
+    Каскад: все лица проходят быструю модель на кропах CASCADE_INPUT_SIZE, лица с уверенностью
+    ниже CASCADE_THRESHOLD - еще и полную модель. Полные проходы всех моделей запускаются вместе.
+
+    :param crops: (center, scale) лиц.
+    :param raw_input: имя модели -> принимает ли она кропы uint8 (RAW_INPUT).
+    :return: по имени модели - точки лиц, уверенность лиц (средний максимум тепловых карт точек)
+             и признак уточнения полной моделью.
+    """
+    fast_size = (CASCADE_INPUT_SIZE, CASCADE_INPUT_SIZE)
+    fast_raw_input = {name: takes_raw_input(cascade_models[name]) for name in model_names}
+    fast_inputs = {raw: [prepare_input(img, center=center, scale=scale, output_size=fast_size, normalize=not raw)
+                         for center, scale in crops]
+                   for raw in set(fast_raw_input.values())}
+    fast_futures = {name: cascade_batchers[name].submit_many(fast_inputs[fast_raw_input[name]]) for name in model_names}
+
+    lmks_by_model, confidence_by_model, hard_by_model, full_futures = {}, {}, {}, {}
+    full_inputs = {}
+    for name in model_names:
+        results = [future.result() for future in fast_futures[name]]
+        lmks_by_model[name] = [lmks for lmks, _ in results]
+        confidence_by_model[name] = [float(confidence.mean()) for _, confidence in results]
+        hard_by_model[name] = [i for i, confidence in enumerate(confidence_by_model[name])
+                               if confidence < CASCADE_THRESHOLD]
+        for i in hard_by_model[name]:
+            key = (raw_input[name], i)
+            if key not in full_inputs:
+                center, scale = crops[i]
+                full_inputs[key] = prepare_input(img, center=center, scale=scale, normalize=not raw_input[name])
+        if hard_by_model[name]:
+            full_futures[name] = landmark_batchers[name].submit_many([full_inputs[(raw_input[name], i)]
+                                                                      for i in hard_by_model[name]])
+
+    refined_by_model = {}
+    for name in model_names:
+        refined_by_model[name] = [False] * len(crops)
+        for i, future in zip(hard_by_model[name], full_futures.get(name, [])):
+            lmks, confidence = future.result()
+            lmks_by_model[name][i] = lmks
+            confidence_by_model[name][i] = float(confidence.mean())
+            refined_by_model[name][i] = True
+    return lmks_by_model, confidence_by_model, refined_by_model
+
+
 @app.route('/process-image', methods=['POST'])
 def process_image():
     if 'image' not in request.files:
@@ -97,9 +264,17 @@ def process_image():
             return jsonify({
                                "error": "Не удалось декодировать изображение. Возможно, файл поврежден или не является корректным изображением."}), 400
 
-        if face_alignment_model is None or face_cascade is None:
+        if not face_alignment_models or face_cascade is None or not landmark_batchers:
             raise Exception("Models are not loaded. Server might have failed to initialize.")
 
+        # Модель ключевых точек (датасет) можно выбрать в запросе, по умолчанию - первая из MODELS.
+        # Несколько моделей через запятую: первая - основная, точки остальных - в landmarks_by_model.
+        model_names = [name.strip() for name in request.form.get('model', DEFAULT_MODEL).split(',') if name.strip()]
+        for model_name in model_names or ['']:
+            if model_name not in landmark_batchers:
+                return jsonify({"error": f"Неизвестная модель: {model_name}. Доступны: {', '.join(landmark_batchers)}"}), 400
+        model_name = model_names[0]
+
         # --- ОБНАРУЖЕНИЕ ЛИЦА С ПОМОЩЬЮ HAAR CASCADE ---
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
@@ -117,9 +292,33 @@ def process_image():
                 "symmetry_description": "Лицо не обнаружено для анализа симметрии.",
             }), 422
 
-            # Получаем все ключевые точки от WFLW модели
-        # ИЗМЕНЕНИЕ: Передаем `MODEL_DEVICE` в `get_lmks_by_img`
-        all_lmks = get_lmks_by_img(face_alignment_model, img, device=MODEL_DEVICE)
+        # Каждое найденное лицо кадрируется по своему прямоугольнику; все лица изображения
+        # проходят через модель одним батчем (вместе с параллельными запросами).
+        faces = sorted(faces, key=lambda box: box[2] * box[3], reverse=True)[:MAX_FACES]
+        crops = [box_to_center_scale(box) for box in faces]
+        # Модели с RAW_INPUT (нормализация внутри conv1) получают кропы uint8 без нормализации;
+        # кропы готовятся один раз для каждого вида входа среди запрошенных моделей.
+        raw_input = {name: takes_raw_input(face_alignment_models[name]) for name in model_names}
+        if CASCADE_INPUT_SIZE:
+            faces_lmks_by_model, faces_confidence_by_model, faces_refined_by_model = \
+                cascade_landmarks(img, crops, model_names, raw_input)
+        elif MULTI_HEAD and SERVING_MODE != 'slim':
+            # один проход backbone, головы всех запрошенных моделей
+            inputs = [prepare_input(img, center=center, scale=scale, normalize=not raw_input[model_name])
+                      for center, scale in crops]
+            faces_results = landmark_batchers[model_name].infer_many([((x, model_names), c, s) for x, c, s in inputs])
+            faces_lmks_by_model = {name: [result[name] for result in faces_results] for name in model_names}
+        else:
+            inputs_by_kind = {raw: [prepare_input(img, center=center, scale=scale, normalize=not raw)
+                                    for center, scale in crops]
+                              for raw in set(raw_input.values())}
+            futures = {name: landmark_batchers[name].submit_many(inputs_by_kind[raw_input[name]])
+                       for name in model_names}
+            faces_lmks_by_model = {name: [future.result() for future in name_futures]
+                                   for name, name_futures in futures.items()}
+        faces_lmks = faces_lmks_by_model[model_name]
+        # Самое крупное лицо остается основным для полей верхнего уровня ответа.
+        all_lmks = faces_lmks[0]
 
         if all_lmks is None or len(all_lmks) == 0:
             is_success, buffer = cv2.imencode(".jpg", img)
@@ -134,21 +333,35 @@ def process_image():
                 "symmetry_description": "Модель ключевых точек не смогла обработать лицо.",
             }), 422
 
-        symmetry_index = calculate_symmetry_index(all_lmks, img_width=img.shape[1])
-
-        processed_image_stream = process_image_with_landmarks_and_symmetry(img, all_lmks)
+        faces_info = []
+        for i, (box, face_lmks) in enumerate(zip(faces, faces_lmks)):
+            face_symmetry_index = calculate_symmetry_index(face_lmks, img_width=img.shape[1])
+            faces_info.append({
+                "box": [int(v) for v in box],
+                "landmarks": face_lmks.tolist(),
+                "symmetry_index": face_symmetry_index,
+                "symmetry_description": describe_symmetry(face_symmetry_index),
+            })
+            if CASCADE_INPUT_SIZE:
+                faces_info[-1]["confidence"] = faces_confidence_by_model[model_name][i]
+                faces_info[-1]["refined"] = faces_refined_by_model[model_name][i]
+            if len(model_names) > 1:
+                faces_info[-1]["landmarks_by_model"] = {name: faces_lmks_by_model[name][i].tolist()
+                                                        for name in model_names}
+
+        processed_image_stream = process_image_with_faces(img, faces_lmks)
         processed_image_stream.seek(0)
 
         encoded_image = base64.b64encode(processed_image_stream.getvalue()).decode('utf-8')
 
         return jsonify({
             "processed_image": encoded_image,
-            "symmetry_index": symmetry_index,
-            "symmetry_description": f"Индекс симметрии вашего лица: {symmetry_index}%. " +
-                                    ("Великолепная симметрия! Ваше лицо очень гармонично." if symmetry_index > 90 else
-                                     "Высокая симметрия. У вас очень сбалансированные черты лица." if symmetry_index > 75 else
-                                     "Хорошая симметрия. Черты лица достаточно гармоничны." if symmetry_index > 50 else
-                                     "Есть заметные отклонения в симметрии. Возможно, стоит обратить внимание на некоторые детали."),
+            "symmetry_index": faces_info[0]["symmetry_index"],
+            "symmetry_description": faces_info[0]["symmetry_description"],
+            "model": model_name,
+            "models": model_names,
+            "num_faces": len(faces_info),
+            "faces": faces_info,
         })
 
     except Exception as e:
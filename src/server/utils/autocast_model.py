@@ -0,0 +1,59 @@
+import logging
+
+import torch
+import torch.nn as nn
+
+
+logger = logging.getLogger(__name__)
+
+
+def bf16_supported(device='cpu'):
+    """
+    Whether bf16 convolutions run natively on `device` (AVX512-BF16/AMX through oneDNN on CPU).
+    Without hardware support autocast would emulate bf16 and be slower than fp32.
+    """
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    if not torch.backends.mkldnn.is_available():
+        return False
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class ChannelsLastAutocastModel(nn.Module):
+    """
+    Runs a heatmap model in channels_last memory format under bf16 autocast.
+
+    Weights stay fp32 (autocast casts them for the convs), inputs are converted to channels_last
+    and the heatmaps are returned as contiguous fp32, so decoding is unchanged. With
+    `autocast_dtype=None` only the channels_last conversion is applied.
+    """
+
+    decodes_landmarks = False
+
+    def __init__(self, model, autocast_dtype=torch.bfloat16):
+        super(ChannelsLastAutocastModel, self).__init__()
+        self.model = model.to(memory_format=torch.channels_last)
+        self.autocast_dtype = autocast_dtype
+        self.input_dtype = torch.float32
+
+    def forward(self, x):
+        x = x.contiguous(memory_format=torch.channels_last)
+        if self.autocast_dtype is None:
+            return self.model(x).contiguous()
+        with torch.autocast(x.device.type, dtype=self.autocast_dtype):
+            return self.model(x).float().contiguous()
+
+
+def to_bf16_inference(model, device='cpu'):
+    """
+    Wrap a model for bf16 inference on `device`, falling back to fp32 channels_last
+    when the hardware has no native bf16.
+    """
+    if bf16_supported(device):
+        return ChannelsLastAutocastModel(model, autocast_dtype=torch.bfloat16)
+    logger.warning(f"bf16 is not supported on {device}, running fp32 channels_last instead")
+    return ChannelsLastAutocastModel(model, autocast_dtype=None)
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+from abc import ABC, abstractmethod
+
+import torch
+
+
+BACKENDS = ('torch', 'onnxruntime')
+
+
+class Backend(ABC):
+    """
+    Runs the landmark network on a batch of prepared inputs.
+
+    `run_model` (and so `get_lmks_by_imgs` and the micro-batcher) only talks to this interface:
+    a backend takes a (N, 3, H, W) float tensor and returns (N, num_landmarks, H/4, W/4) heatmaps,
+    decoding stays shared. Plain torch models are wrapped in `TorchBackend` on the fly.
+    """
+
+    name = None
+    decodes_landmarks = False
+    config = None
+
+    @abstractmethod
+    def infer(self, img_tensor, device='cpu'):
+        """
+        :param img_tensor: (N, 3, H, W) float tensor.
+        :param device: device of the model input (torch backends only).
+        :return: (N, num_landmarks, H/4, W/4) heatmaps tensor.
+        """
+
+
+class TorchBackend(Backend):
+    name = 'torch'
+
+    def __init__(self, model):
+        self.model = model
+        self.config = getattr(model, 'config', None)
+        input_dtype = getattr(model, 'input_dtype', None)
+        if input_dtype is None:
+            param = next(model.parameters(), None)
+            input_dtype = param.dtype if param is not None else torch.float32
+        self.input_dtype = input_dtype
+
+    def infer(self, img_tensor, device='cpu'):
+        with torch.no_grad():
+            return self.model(img_tensor.to(device, dtype=self.input_dtype))
+
+
+def get_backend(model):
+    return model if isinstance(model, Backend) else TorchBackend(model)
+
+
+def default_intra_op_threads(num_sessions=1):
+    """
+    Intra-op threads of one session: the CPUs of this process shared by every web worker
+    (WEB_CONCURRENCY, as set for gunicorn) and every session of the pool, so concurrent
+    sessions never oversubscribe the cores.
+    """
+    try:
+        num_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        num_cpus = os.cpu_count() or 1
+    num_workers = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+    return max(1, num_cpus // (num_workers * max(1, num_sessions)))
+
+
+class OnnxRuntimeBackend(Backend):
+    """
+    ONNX Runtime inference of an exported HighResolutionNet (see tools/export_onnx.py).
+
+    Keeps a pool of sessions shared by all threads of the process (Flask threads, the
+    micro-batcher worker): a call takes a free session, so at most `num_sessions` forwards
+    run at once, each with `intra_op_num_threads` threads.
+    """
+
+    name = 'onnxruntime'
+
+    def __init__(self, onnx_path, num_sessions=None, intra_op_num_threads=None, providers=None, config=None):
+        """
+        :param onnx_path: exported model with a dynamic batch axis.
+        :param num_sessions: sessions in the pool, defaults to ORT_SESSIONS or 1.
+        :param intra_op_num_threads: threads of every session, defaults to ORT_INTRA_OP_THREADS
+                                     or `default_intra_op_threads`.
+        :param providers: ORT execution providers, defaults to CPU.
+        :param config: model config, kept for callers of `model.config`.
+        """
+        import onnxruntime as ort
+
+        self.onnx_path = onnx_path
+        self.config = config
+        self.num_sessions = int(num_sessions or os.environ.get('ORT_SESSIONS', 1))
+        self.intra_op_num_threads = int(intra_op_num_threads or os.environ.get('ORT_INTRA_OP_THREADS', 0)
+                                        or default_intra_op_threads(self.num_sessions))
+        self.providers = providers or ['CPUExecutionProvider']
+
+        self._sessions = queue.Queue()
+        self._all_sessions = []
+        for _ in range(self.num_sessions):
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.intra_op_num_threads
+            options.inter_op_num_threads = 1
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = ort.InferenceSession(onnx_path, sess_options=options, providers=self.providers)
+            self._all_sessions.append(session)
+            self._sessions.put(session)
+
+        self.input_name = self._all_sessions[0].get_inputs()[0].name
+        self.output_name = self._all_sessions[0].get_outputs()[0].name
+        self._lock = threading.Lock()
+        self._num_calls = 0
+
+    def infer(self, img_tensor, device='cpu'):
+        img = img_tensor.detach().to('cpu', dtype=torch.float32).contiguous().numpy()
+        session = self._sessions.get()
+        try:
+            heatmaps = session.run([self.output_name], {self.input_name: img})[0]
+        finally:
+            self._sessions.put(session)
+        with self._lock:
+            self._num_calls += 1
+        return torch.from_numpy(heatmaps)
+
+    def stats(self):
+        with self._lock:
+            num_calls = self._num_calls
+        return {
+            'backend': self.name,
+            'num_sessions': self.num_sessions,
+            'intra_op_num_threads': self.intra_op_num_threads,
+            'free_sessions': self._sessions.qsize(),
+            'num_calls': num_calls,
+        }
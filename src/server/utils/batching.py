@@ -0,0 +1,194 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+def run_torch_batch(model, inputs, centers, scales, output_size=(256, 256), device='cpu', return_confidence=False):
+    """
+    Default batch runner: stacks the input tensors and calls `run_model`.
+
+    torch is imported here rather than at module level, so the batcher also serves
+    torch-free models (see `slim_inference.run_slim_batch`).
+
+    With `return_confidence` every input gets a (landmarks, per-landmark confidences) pair.
+    """
+    import torch
+    from .utils_inference import run_model
+
+    if return_confidence:
+        lmks, confidence = run_model(model, torch.stack(inputs), centers, scales, output_size=output_size,
+                                     device=device, return_confidence=True)
+        return list(zip(lmks.numpy(), confidence.numpy()))
+    return run_model(model, torch.stack(inputs), centers, scales, output_size=output_size, device=device).numpy()
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching in front of the landmark model.
+
+    Requests hand in already cropped and normalized inputs. A single worker thread collects
+    them for at most `max_wait_ms` (or until `max_batch_size` inputs are queued), runs one
+    batched forward pass, decodes the heatmaps and resolves the future of every request
+    with its own landmarks.
+
+    Inputs submitted together with `submit_many` (e.g. all faces of one image) are never
+    split between batches. A group larger than `max_batch_size` runs as a batch of its own.
+    """
+
+    def __init__(self, model, device='cpu', max_batch_size=8, max_wait_ms=5.0, output_size=(256, 256),
+                 run_batch=run_torch_batch):
+        """
+        :param model: landmark model, already in eval mode and on `device`.
+        :param device: device the batched input tensor is moved to.
+        :param max_batch_size: largest batch passed to the model in one forward.
+        :param max_wait_ms: how long the first queued input waits for others to join its batch.
+        :param output_size: model input size.
+        :param run_batch: callable(model, inputs, centers, scales, output_size=..., device=...) returning
+                          (N, num_landmarks, 2) numpy landmarks.
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be >= 1, got {max_batch_size}")
+        if max_wait_ms < 0:
+            raise ValueError(f"max_wait_ms must be >= 0, got {max_wait_ms}")
+
+        self.model = model
+        self.device = device
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait_ms = float(max_wait_ms)
+        self.output_size = output_size
+        self.run_batch = run_batch
+
+        self._queue = queue.Queue()
+        self._pending = None
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._num_items = 0
+        self._num_batches = 0
+        self._num_errors = 0
+        self._queue_wait_s = 0.0
+        self._forward_s = 0.0
+
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='landmarks-micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, img_tensor, center, scale):
+        """
+        Queue one model input.
+
+        :param img_tensor: (3, H, W) float tensor as returned by `prepare_input`
+                           (float32 array of `prepare_input_np` for slim models).
+        :param center: crop center used for the input.
+        :param scale: crop scale used for the input.
+        :return: Future resolved with the (num_landmarks, 2) numpy array of landmarks.
+        """
+        return self.submit_many([(img_tensor, center, scale)])[0]
+
+    def submit_many(self, inputs):
+        """
+        Queue several model inputs that must go through the same forward pass.
+
+        :param inputs: list of (img_tensor, center, scale) tuples.
+        :return: list of futures, one per input.
+        """
+        if self._closed.is_set():
+            raise RuntimeError("MicroBatcher is closed")
+        if not inputs:
+            return []
+        queued_at = time.perf_counter()
+        group = [(img_tensor, center, scale, Future(), queued_at) for img_tensor, center, scale in inputs]
+        self._queue.put(group)
+        return [item[3] for item in group]
+
+    def infer(self, img_tensor, center, scale, timeout=None):
+        """
+        Blocking version of `submit`.
+        """
+        return self.submit(img_tensor, center, scale).result(timeout=timeout)
+
+    def infer_many(self, inputs, timeout=None):
+        """
+        Blocking version of `submit_many`.
+        """
+        return [future.result(timeout=timeout) for future in self.submit_many(inputs)]
+
+    def close(self, timeout=None):
+        """
+        Stop the worker thread. Inputs that are already queued are still processed.
+        """
+        self._closed.set()
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def stats(self):
+        """
+        Batching metrics collected since start.
+        """
+        with self._stats_lock:
+            num_batches = self._num_batches
+            num_items = self._num_items
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_size': self._queue.qsize(),
+                'num_items': num_items,
+                'num_batches': num_batches,
+                'num_errors': self._num_errors,
+                'avg_batch_size': num_items / num_batches if num_batches else 0.0,
+                'avg_queue_wait_ms': 1000.0 * self._queue_wait_s / num_items if num_items else 0.0,
+                'avg_forward_ms': 1000.0 * self._forward_s / num_batches if num_batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            }
+
+    def _collect(self):
+        if self._pending is not None:
+            first, self._pending = self._pending, None
+        else:
+            first = self._queue.get()
+        if first is None:
+            return []
+        batch = list(first)
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                group = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if group is None or len(batch) + len(group) > self.max_batch_size:
+                # does not fit (or is the close sentinel): it starts the next batch
+                self._pending = group
+                break
+            batch.extend(group)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            futures = [item[3] for item in batch]
+            try:
+                lmks = self.run_batch(self.model, [item[0] for item in batch], [item[1] for item in batch],
+                                      [item[2] for item in batch], output_size=self.output_size, device=self.device)
+            except Exception as e:
+                with self._stats_lock:
+                    self._num_errors += len(batch)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            with self._stats_lock:
+                self._num_batches += 1
+                self._num_items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._forward_s += finished - started
+                self._queue_wait_s += sum(started - item[4] for item in batch)
+
+            for future, item_lmks in zip(futures, lmks):
+                future.set_result(item_lmks)
@@ -0,0 +1,105 @@
+import os
+import hashlib
+
+import torch
+import torch.nn as nn
+
+
+# batch sizes a model is compiled for, requests are padded up to the nearest one
+BATCH_BUCKETS = (1, 2, 4, 8)
+
+
+def batch_bucket(batch_size, buckets=BATCH_BUCKETS):
+    """
+    Smallest bucket that fits `batch_size`, the largest bucket if none does.
+    """
+    for bucket in buckets:
+        if batch_size <= bucket:
+            return bucket
+    return buckets[-1]
+
+
+def artifact_key(model_config, checkpoint_path, precision, device, output_size):
+    """
+    Hash of everything a traced graph depends on: config, checkpoint file, torch version,
+    precision, device type and input size. A changed checkpoint or torch upgrade gives a new key,
+    so stale artifacts are never loaded.
+    """
+    key = hashlib.sha1()
+    key.update(model_config.dump().encode('utf-8'))
+    if checkpoint_path and os.path.isfile(checkpoint_path):
+        stat = os.stat(checkpoint_path)
+        key.update(f'{os.path.basename(checkpoint_path)}:{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    key.update(f'{torch.__version__}:{precision}:{torch.device(device).type}:{tuple(output_size)}'.encode('utf-8'))
+    return key.hexdigest()[:16]
+
+
+def trace_and_freeze(model, example):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_trace=False)
+    return torch.jit.freeze(traced.eval())
+
+
+class CompiledModel(nn.Module):
+    """
+    Frozen TorchScript graphs of a landmark model, one per batch bucket.
+
+    A batch is zero-padded to the nearest bucket (and split into chunks of the largest one),
+    so no request shape ever triggers a new trace. Outputs of the padding rows are dropped.
+    """
+
+    decodes_landmarks = False
+
+    def __init__(self, graphs, input_dtype=torch.float32):
+        """
+        :param graphs: dict batch bucket -> frozen ScriptModule.
+        :param input_dtype: dtype the graphs were traced with, used by `run_model` to cast inputs.
+        """
+        super(CompiledModel, self).__init__()
+        self.buckets = tuple(sorted(graphs))
+        self.graphs = nn.ModuleDict({str(bucket): graphs[bucket] for bucket in self.buckets})
+        self.input_dtype = input_dtype
+
+    def forward(self, x):
+        outputs = []
+        for chunk in x.split(self.buckets[-1]):
+            n = chunk.size(0)
+            bucket = batch_bucket(n, self.buckets)
+            if bucket > n:
+                chunk = torch.cat([chunk, chunk.new_zeros((bucket - n,) + tuple(chunk.shape[1:]))])
+            outputs.append(self.graphs[str(bucket)](chunk)[:n])
+        return torch.cat(outputs) if len(outputs) > 1 else outputs[0]
+
+
+def compile_model(model, artifact_dir, artifact_name, buckets=BATCH_BUCKETS, output_size=(256, 256), device='cpu',
+                  dtype=torch.float32):
+    """
+    Load the frozen graph of every bucket from `artifact_dir`, tracing and saving the missing ones.
+
+    Artifacts are written to a temporary file and renamed, so workers starting together never
+    read a partial file; at worst each of them traces the same graph once.
+
+    :param model: eager landmark model in eval mode, on `device` and in `dtype`.
+    :param artifact_dir: directory of the artifacts, created if needed.
+    :param artifact_name: file name stem, should contain the `artifact_key`.
+    :param buckets: batch sizes to compile.
+    :param output_size: model input size (W, H).
+    :return: CompiledModel
+    """
+    if getattr(model, 'decodes_landmarks', False):
+        raise ValueError("Only heatmap models can be compiled")
+    os.makedirs(artifact_dir, exist_ok=True)
+
+    graphs = {}
+    for bucket in sorted(set(buckets)):
+        path = os.path.join(artifact_dir, f'{artifact_name}-b{bucket}.pt')
+        if os.path.isfile(path):
+            graphs[bucket] = torch.jit.load(path, map_location=device)
+            continue
+        example = torch.zeros(bucket, 3, output_size[1], output_size[0], device=device, dtype=dtype)
+        graphs[bucket] = trace_and_freeze(model, example)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        torch.jit.save(graphs[bucket], tmp_path)
+        os.replace(tmp_path, path)
+
+    return CompiledModel(graphs, input_dtype=dtype).eval()
@@ -0,0 +1,101 @@
+import json
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+# safetensors dtype names
+_DTYPES = {
+    'F64': (torch.float64, np.float64),
+    'F32': (torch.float32, np.float32),
+    'F16': (torch.float16, np.float16),
+    'I64': (torch.int64, np.int64),
+    'I32': (torch.int32, np.int32),
+    'U8': (torch.uint8, np.uint8),
+}
+_DTYPE_NAMES = {torch_dtype: name for name, (torch_dtype, _) in _DTYPES.items()}
+_ALIGNMENT = 8
+
+
+def save_flat_checkpoint(state_dict, path, dtype=None, metadata=None):
+    """
+    Write a state dict as one flat, memory-mappable file.
+
+    The layout is the safetensors one: 8 bytes little-endian header size, JSON header with
+    dtype/shape/offsets of every tensor, then the raw tensor bytes. Tensors are ordered by
+    element size so every tensor stays aligned to its element size.
+
+    :param state_dict: dict name -> tensor.
+    :param path: output file.
+    :param dtype: store floating point tensors in this dtype (e.g. torch.float16), None keeps them as is.
+    :param metadata: optional dict of str -> str saved in the header.
+    """
+    tensors = []
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu()
+        if dtype is not None and tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        if tensor.dtype not in _DTYPE_NAMES:
+            raise ValueError(f"Unsupported dtype {tensor.dtype} of {name}")
+        tensors.append((name, tensor.contiguous()))
+    tensors.sort(key=lambda item: -item[1].element_size())
+
+    header = OrderedDict()
+    if metadata:
+        header['__metadata__'] = {str(k): str(v) for k, v in metadata.items()}
+    offset = 0
+    for name, tensor in tensors:
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': _DTYPE_NAMES[tensor.dtype], 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + nbytes]}
+        offset += nbytes
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header_bytes += b' ' * (-(8 + len(header_bytes)) % _ALIGNMENT)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for _, tensor in tensors:
+            f.write(tensor.numpy().tobytes())
+
+
+def read_flat_header(path):
+    """
+    :return: (header dict, offset of the tensor data in the file)
+    """
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    return header, 8 + header_size
+
+
+def load_flat_checkpoint(path, dtype=None):
+    """
+    Map a flat checkpoint into memory without copying it.
+
+    The file is mapped copy-on-write: tensors are views of the page cache, so several worker
+    processes loading the same file share its pages, and nothing written to the tensors
+    reaches the file. Load it into a model with `model.load_state_dict(state_dict, assign=True)`
+    to keep the parameters on the mapped pages.
+
+    :param path: file written by `save_flat_checkpoint`.
+    :param dtype: cast floating point tensors stored in another dtype to this one
+                  (this copies them), None returns them as stored.
+    :return: OrderedDict name -> tensor
+    """
+    header, data_offset = read_flat_header(path)
+    header.pop('__metadata__', None)
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+
+    state_dict = OrderedDict()
+    for name, info in header.items():
+        torch_dtype, np_dtype = _DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        array = data[data_offset + begin:data_offset + end].view(np_dtype).reshape(info['shape'])
+        tensor = torch.from_numpy(array)
+        if dtype is not None and tensor.is_floating_point() and tensor.dtype != dtype:
+            tensor = tensor.to(dtype)
+        state_dict[name] = tensor
+    return state_dict
@@ -70,8 +70,41 @@ def process_image_with_landmarks_and_symmetry(img, all_lmks, circle_size=3, colo
     :param is_copy: If True, plot on a copy of the image.
     :return: Bytes of the processed image in JPEG format.
     """
+    return process_image_with_faces(img, [all_lmks], circle_size=circle_size, color=color, is_copy=is_copy)
+
+
+def process_image_with_faces(img, faces_lmks, circle_size=3, color=(255, 0, 0), is_copy=True):
+    """
+    Same as `process_image_with_landmarks_and_symmetry`, but for every face found on the image.
+
+    :param img: Source image (numpy array).
+    :param faces_lmks: List with the landmarks of every face.
+    :param circle_size: Size of the landmark circles.
+    :param color: Color of the landmark circles.
+    :param is_copy: If True, plot on a copy of the image.
+    :return: Bytes of the processed image in JPEG format.
+    """
     processed_img = img.copy() if is_copy else img
+    for all_lmks in faces_lmks:
+        draw_landmarks_and_symmetry(processed_img, all_lmks, circle_size=circle_size, color=color)
 
+    is_success, buffer = cv2.imencode(".jpg", processed_img)
+    if not is_success:
+        raise Exception("Could not encode image to JPEG.")
+
+    return io.BytesIO(buffer)
+
+
+def draw_landmarks_and_symmetry(processed_img, all_lmks, circle_size=3, color=(255, 0, 0)):
+    """
+    Draws landmarks and symmetry lines of one face in place.
+
+    :param processed_img: Image to draw on (numpy array).
+    :param all_lmks: All landmarks of the face.
+    :param circle_size: Size of the landmark circles.
+    :param color: Color of the landmark circles.
+    :return: The same image.
+    """
     # --- ДИНАМИЧЕСКИЙ РАСЧЕТ ТОЛЩИНЫ ЛИНИЙ ---
     min_dim = min(processed_img.shape[0], processed_img.shape[1])
 
@@ -156,8 +189,4 @@ def process_image_with_landmarks_and_symmetry(img, all_lmks, circle_size=3, colo
         except Exception as e:
             print(f"Error drawing symmetry lines: {e}")
 
-    is_success, buffer = cv2.imencode(".jpg", processed_img)
-    if not is_success:
-        raise Exception("Could not encode image to JPEG.")
-
-    return io.BytesIO(buffer)
\ No newline at end of file
+    return processed_img
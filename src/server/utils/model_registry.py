@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ModelRegistry:
+    """
+    LRU cache of loaded models.
+
+    Models are keyed by (root_models_path, model_name, prefix, model_type, device, precision, jit_buckets, backend,
+    parallel_branches).
+    Every model is built from its own frozen config, so loading one dataset never changes
+    the config another model was built from. Concurrent requests for the same key wait
+    for a single load instead of loading the model twice.
+    """
+
+    def __init__(self, loader, capacity=4):
+        """
+        :param loader: callable(model_name, root_models_path=..., prefix=..., model_type=..., device=...,
+                       precision=..., jit_buckets=..., backend=...,
+                       parallel_branches=...) returning a ready to use model.
+        :param capacity: number of models kept in memory, the least recently used one is evicted first.
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity must be >= 1, got {capacity}")
+        self.loader = loader
+        self.capacity = capacity
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks',
+                 device='cuda', precision='fp32', jit_buckets=None, backend='torch', parallel_branches=None):
+        jit_buckets = tuple(sorted(set(jit_buckets))) if jit_buckets else None
+        return (str(root_models_path), model_name, prefix, model_type, str(device), precision, jit_buckets, backend,
+                parallel_branches)
+
+    def get(self, model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks',
+            device='cuda', precision='fp32', jit_buckets=None, backend='torch', parallel_branches=None):
+        """
+        Cached model, loaded on first use.
+        """
+        key = self.make_key(model_name, root_models_path, prefix, model_type, device, precision, jit_buckets, backend,
+                            parallel_branches)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            future = self._loading.get(key)
+            is_loader = future is None
+            if is_loader:
+                future = self._loading[key] = Future()
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            model = self.loader(model_name, root_models_path=root_models_path, prefix=prefix,
+                                model_type=model_type, device=device, precision=precision, jit_buckets=key[6],
+                                backend=backend, parallel_branches=parallel_branches)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.capacity:
+                self._models.popitem(last=False)
+        future.set_result(model)
+        return model
+
+    def preload(self, model_names, max_workers=None, **kwargs):
+        """
+        Load several models in parallel, e.g. at server start.
+
+        :param model_names: model names (datasets) to load.
+        :param max_workers: number of loader threads, defaults to one per model.
+        :param kwargs: other `get` arguments shared by all models.
+        :return: dict model name -> model
+        """
+        model_names = list(model_names)
+        if len(model_names) > self.capacity:
+            raise ValueError(f"Can't preload {len(model_names)} models into a registry of capacity {self.capacity}")
+        if not model_names:
+            return {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(model_names)) as pool:
+            futures = {name: pool.submit(self.get, name, **kwargs) for name in model_names}
+            return {name: future.result() for name, future in futures.items()}
+
+    def evict(self, model_name, **kwargs):
+        """
+        Drop a model from the cache. Returns True if it was cached.
+        """
+        with self._lock:
+            return self._models.pop(self.make_key(model_name, **kwargs), None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def keys(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._models)
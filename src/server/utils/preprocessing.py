@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+
+MEAN = np.array([0.485, 0.456, 0.406])
+STD = np.array([0.229, 0.224, 0.225])
+
+
+def get_transform(center, scale, output_size, rot=0):
+    """
+    General image processing functions
+    """
+    # Generate transformation matrix
+    h = 200 * scale
+    t = np.zeros((3, 3))
+    t[0, 0] = float(output_size[1]) / h
+    t[1, 1] = float(output_size[0]) / h
+    t[0, 2] = output_size[1] * (-float(center[0]) / h + .5)
+    t[1, 2] = output_size[0] * (-float(center[1]) / h + .5)
+    t[2, 2] = 1
+    if not rot == 0:
+        rot = -rot  # To match direction of rotation from cropping
+        rot_mat = np.zeros((3, 3))
+        rot_rad = rot * np.pi / 180
+        sn, cs = np.sin(rot_rad), np.cos(rot_rad)
+        rot_mat[0, :2] = [cs, -sn]
+        rot_mat[1, :2] = [sn, cs]
+        rot_mat[2, 2] = 1
+        # Need to rotate around center
+        t_mat = np.eye(3)
+        t_mat[0, 2] = -output_size[1]/2
+        t_mat[1, 2] = -output_size[0]/2
+        t_inv = t_mat.copy()
+        t_inv[:2, 2] *= -1
+        t = np.dot(t_inv, np.dot(rot_mat, np.dot(t_mat, t)))
+    return t
+
+
+def get_inverse_transforms(center, scale, output_size, rot=0):
+    """
+    Inverse crop transforms (N, 3, 3) for lists of crop centers and scales.
+    """
+    t = np.stack([get_transform(c, s, output_size, rot=rot) for c, s in zip(center, scale)])
+    return np.linalg.inv(t)
+
+
+def box_to_center_scale(box, scale_factor=1.5):
+    """
+    Convert a face detector box into a crop center and scale.
+
+    Haar boxes cover roughly brows to mouth, so the crop is enlarged by `scale_factor`
+    to include the jaw line and the eyebrows the landmark model expects.
+
+    :param box: face box (x, y, w, h).
+    :param scale_factor: crop side relative to the longer box side.
+    :return: (center [x, y], scale)
+    """
+    x, y, w, h = [float(v) for v in box]
+    center = [x + w / 2, y + h / 2]
+    scale = max(w, h) * scale_factor / 200
+    return center, scale
+
+
+def crop_affine(img, center, scale, output_size=(256, 256), rot=0):
+    """
+    Crop (and rotate) an image region straight into the model input size with one `cv2.warpAffine`.
+
+    Uses the same transform as `get_transform`, so landmarks are decoded back with it unchanged.
+    When the crop shrinks the image by 2x or more, only the source region under the crop is
+    first reduced by an integer factor with INTER_AREA to avoid aliasing; the rest of the
+    image is never touched.
+
+    :param img: source image (H, W, C) or (H, W), uint8.
+    :param center: crop center [x, y].
+    :param scale: crop scale (crop side / 200).
+    :param output_size: (height, width) of the crop.
+    :param rot: rotation of the crop in degrees.
+    :return: uint8 crop of shape (height, width, C).
+    """
+    dsize = (int(output_size[1]), int(output_size[0]))
+    t = get_transform(center, scale, output_size, rot=rot)
+
+    step = int(200.0 * scale / max(output_size[0], output_size[1]))
+    if step >= 2:
+        # source region under the (possibly rotated) crop
+        corners = np.array([[0, 0, 1], [dsize[0], 0, 1], [0, dsize[1], 1], [dsize[0], dsize[1], 1]], dtype=np.float64)
+        src_corners = corners.dot(np.linalg.inv(t).T)[:, :2]
+        x0, y0 = np.floor(src_corners.min(0)).astype(int) - step
+        x1, y1 = np.ceil(src_corners.max(0)).astype(int) + step
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1 = x0 + (min(x1, img.shape[1]) - x0) // step * step
+        y1 = y0 + (min(y1, img.shape[0]) - y0) // step * step
+        if x1 <= x0 or y1 <= y0:
+            return np.zeros(tuple(output_size[:2]) + img.shape[2:], dtype=np.uint8)
+
+        img = cv2.resize(img[y0:y1, x0:x1], ((x1 - x0) // step, (y1 - y0) // step), interpolation=cv2.INTER_AREA)
+        # pixel r of the reduced region covers source pixels [r * step, (r + 1) * step) of the region
+        reduced_to_src = np.array([[step, 0, x0 + (step - 1) / 2.0],
+                                   [0, step, y0 + (step - 1) / 2.0],
+                                   [0, 0, 1]])
+        t = t.dot(reduced_to_src)
+
+    return cv2.warpAffine(img, t[:2], dsize, flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+def normalize_chw(img_crop, mean=MEAN, std=STD, out=None):
+    """
+    Normalize a uint8 HWC crop with ImageNet mean/std directly into a float32 CHW array.
+
+    :param img_crop: uint8 crop (H, W, 3).
+    :param mean: per-channel mean of the [0, 1] image.
+    :param std: per-channel std of the [0, 1] image.
+    :param out: optional preallocated float32 (3, H, W) array to write into.
+    :return: float32 (3, H, W) array.
+    """
+    if out is None:
+        out = np.empty((img_crop.shape[2],) + img_crop.shape[:2], dtype=np.float32)
+    mul = (1.0 / (255.0 * np.asarray(std))).astype(np.float32)
+    add = (-np.asarray(mean) / np.asarray(std)).astype(np.float32)
+    for c in range(out.shape[0]):
+        np.multiply(img_crop[:, :, c], mul[c], out=out[c])
+        out[c] += add[c]
+    return out
+
+
+def to_chw(img_crop):
+    """
+    Raw uint8 HWC crop as a contiguous uint8 CHW array, the input of models with `takes_raw_input`.
+    """
+    return np.ascontiguousarray(img_crop.transpose(2, 0, 1))
+
+
+def takes_raw_input(model):
+    """
+    Whether a model reads raw uint8 crops: its input normalization is folded into the first conv
+    (MODEL.EXTRA.RAW_INPUT, see lib/models/input_norm.py), so `normalize_chw` must be skipped.
+    """
+    if getattr(model, 'takes_raw_input', False):
+        return True
+    config = getattr(model, 'config', None)
+    return bool(config is not None and config.MODEL.EXTRA.get('RAW_INPUT', False))
@@ -0,0 +1,162 @@
+"""
+Torch-free landmark inference: the exported ONNX graph (tools/export_onnx.py) runs through
+OpenCV's `cv2.dnn`, preprocessing and heatmap decoding are NumPy ports of `utils_inference`.
+
+Nothing in this module (or in the modules it imports) imports torch, so a server in slim
+mode (SERVING_MODE=slim) starts faster and keeps a smaller resident set.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+import yaml
+
+from .preprocessing import get_inverse_transforms, crop_affine, normalize_chw, to_chw
+
+
+class CvDnnLandmarkModel:
+    """
+    Landmark network loaded with `cv2.dnn.readNetFromONNX`.
+
+    A `cv2.dnn.Net` keeps its input and intermediate blobs inside, so forwards are serialized
+    with a lock; concurrent requests are batched by the micro-batcher in front of it.
+    """
+
+    def __init__(self, onnx_path, num_threads=None, takes_raw_input=False):
+        """
+        :param onnx_path: model exported with a dynamic batch axis.
+        :param num_threads: OpenCV threads (process wide), None keeps the OpenCV default.
+        :param takes_raw_input: the graph reads raw [0, 255] crops (exported with MODEL.EXTRA.RAW_INPUT).
+        """
+        if not os.path.isfile(onnx_path):
+            raise FileNotFoundError(f"{onnx_path} not found, create it with tools/export_onnx.py")
+        if num_threads:
+            cv2.setNumThreads(int(num_threads))
+        self.onnx_path = onnx_path
+        self.takes_raw_input = takes_raw_input
+        self.net = cv2.dnn.readNetFromONNX(onnx_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self._lock = threading.Lock()
+
+    def __call__(self, img_batch):
+        """
+        :param img_batch: (N, 3, H, W) float32 array.
+        :return: (N, num_landmarks, H/4, W/4) float32 heatmaps.
+        """
+        with self._lock:
+            self.net.setInput(np.ascontiguousarray(img_batch, dtype=np.float32))
+            return self.net.forward().copy()
+
+
+def load_slim_model(model_name, root_models_path='hrnetv2_models', prefix='HR18-', num_threads=None):
+    return CvDnnLandmarkModel(f'{root_models_path}/{prefix}{model_name}.onnx', num_threads=num_threads,
+                              takes_raw_input=config_takes_raw_input(f'{root_models_path}/{prefix}{model_name}.yaml'))
+
+
+def config_takes_raw_input(config_path):
+    """
+    MODEL.EXTRA.RAW_INPUT of a model config, read as plain YAML to keep `lib` (and torch) out of the slim server.
+    """
+    if not os.path.isfile(config_path):
+        return False
+    with open(config_path) as f:
+        model_config = yaml.safe_load(f) or {}
+    return bool(model_config.get('MODEL', {}).get('EXTRA', {}).get('RAW_INPUT', False))
+
+
+def prepare_input_np(img, output_size=(256, 256), rot=0, center=None, scale=None, normalize=True):
+    """
+    `prepare_input` without torch.
+
+    :return: (CHW float32 array, or uint8 without `normalize`, crop center array, crop scale)
+    """
+    face_center = np.array([img.shape[1]//2, img.shape[0]/2] if center is None else center, dtype=np.float32)
+    crop_scale = max((img.shape[1]) / output_size[0], (img.shape[0]) / output_size[1]) if scale is None else scale
+
+    img_crop = crop_affine(img, face_center, crop_scale, output_size=output_size, rot=rot)
+
+    if not normalize:
+        return to_chw(img_crop), face_center, crop_scale
+    return normalize_chw(img_crop), face_center, crop_scale
+
+
+def get_preds_np(scores, return_confidence=False):
+    """
+    Argmax coordinates (1-based, zeroed for non-positive maxima) of (N, P, H, W) heatmaps,
+    and the (N, P) maxima with `return_confidence`.
+    """
+    assert scores.ndim == 4, 'Score maps should be 4-dim'
+    flat = scores.reshape(scores.shape[0], scores.shape[1], -1)
+    idx = flat.argmax(2)
+    maxval = np.take_along_axis(flat, idx[:, :, None], 2)[:, :, 0]
+
+    preds = np.stack([idx % scores.shape[3], idx // scores.shape[3]], 2).astype(np.float32) + 1
+    preds *= (maxval > 0)[:, :, None]
+    if return_confidence:
+        return preds, maxval
+    return preds
+
+
+def decode_preds_np(output, center, scale, res, rot=0, return_confidence=False):
+    """
+    `decode_preds` without torch: same quarter pixel refinement and inverse crop transform.
+
+    :return: (N, P, 2) float32 landmarks in source image coordinates, and (N, P) confidences with `return_confidence`.
+    """
+    coords, maxval = get_preds_np(output, return_confidence=True)
+
+    n, p, h, w = output.shape
+    px = coords[:, :, 0].astype(np.int64)
+    py = coords[:, :, 1].astype(np.int64)
+    inside = (px > 1) & (px < res[0]) & (py > 1) & (py < res[1])
+    px = px.clip(2, w - 1)
+    py = py.clip(2, h - 1)
+    hm = output.reshape(n, p, h * w)
+
+    def at(row, col):
+        return np.take_along_axis(hm, (row * w + col)[:, :, None], 2)[:, :, 0]
+
+    diff = np.stack([at(py - 1, px) - at(py - 1, px - 2), at(py, px - 1) - at(py - 2, px - 1)], 2)
+    coords += np.sign(diff) * np.float32(.25) * inside[:, :, None]
+    coords += 0.5
+
+    # Transform back
+    t_inv = get_inverse_transforms(center, scale, res, rot=rot)
+    pts = coords.astype(np.float64) - 1
+    new_pts = np.matmul(pts, t_inv[:, :2, :2].transpose(0, 2, 1)) + t_inv[:, None, :2, 2]
+    preds = (np.trunc(new_pts) + 1).astype(np.float32)
+    if return_confidence:
+        return preds, maxval
+    return preds
+
+
+def run_model_np(model, img_batch, centers, scales, output_size=(256, 256), rot=0, return_confidence=False):
+    """
+    :return: (N, num_landmarks, 2) float32 landmarks in source image coordinates,
+             and (N, num_landmarks) confidences with `return_confidence`.
+    """
+    res = [output_size[0]/4, output_size[1]/4]
+    return decode_preds_np(model(img_batch), centers, scales, res, rot=rot, return_confidence=return_confidence)
+
+
+def run_slim_batch(model, inputs, centers, scales, output_size=(256, 256), device='cpu'):
+    """
+    Batch runner of `MicroBatcher` for slim models.
+    """
+    return run_model_np(model, np.stack(inputs), centers, scales, output_size=output_size)
+
+
+def get_lmks_by_imgs_np(model, imgs, centers=None, scales=None, output_size=(256, 256), rot=0,
+                        return_confidence=False):
+    """
+    `get_lmks_by_imgs` without torch.
+    """
+    centers = centers if centers is not None else [None] * len(imgs)
+    scales = scales if scales is not None else [None] * len(imgs)
+    normalize = not model.takes_raw_input
+    inputs = [prepare_input_np(img, output_size=output_size, rot=rot, center=center, scale=scale, normalize=normalize)
+              for img, center, scale in zip(imgs, centers, scales)]
+    return run_model_np(model, np.stack([x[0] for x in inputs]), [x[1] for x in inputs], [x[2] for x in inputs],
+                        output_size=output_size, rot=rot, return_confidence=return_confidence)
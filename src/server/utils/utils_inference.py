@@ -1,98 +1,413 @@
+import os
 import math
+from collections import OrderedDict
 
-import scipy
-import scipy.misc
+import cv2
 import torch
 import numpy as np
 from PIL import Image
-from lib.models import get_face_alignment_net, get_cls_net
-from lib.config import config, config_imagenet, merge_configs
+from lib.models import get_face_alignment_net, get_cls_net, get_multihead_net, set_inplace_fuse
+from lib.config import config, config_imagenet
+from lib.models.quantization import load_int8
+from lib.models.parallel import PARALLEL_MODES, set_parallel_branches
 
+from .preprocessing import get_transform, get_inverse_transforms, crop_affine, normalize_chw, \
+    to_chw, takes_raw_input
+from .model_registry import ModelRegistry
+from .flat_checkpoint import load_flat_checkpoint
+from .compiled_models import artifact_key, compile_model
+from .backends import BACKENDS, OnnxRuntimeBackend, get_backend
+from .autocast_model import to_bf16_inference
 
-def get_model_by_name(model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks', device='cuda'):
 
-    checkpoint_path = f'{root_models_path}/{prefix}{model_name}.pth'
-    config_path = f'{root_models_path}/{prefix}{model_name}.yaml'
+PRECISIONS = ('fp32', 'fp16', 'bf16', 'int8')
+# mean heatmap maximum of a face below which `get_lmks_by_imgs_cascade` runs the full model
+CASCADE_THRESHOLD = 0.5
 
-    merge_configs(config, config_path)
 
-    config.defrost()
-    config.MODEL.INIT_WEIGHTS = False
-    config.freeze()
+def get_model_by_name(model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks', device='cuda',
+                      precision='fp32', jit_buckets=None, backend='torch', parallel_branches=None):
+    """
+    Model for (model name, prefix, device, precision, jit buckets, backend, parallel branches), loaded once and
+    cached in `model_registry`.
+    """
+    return model_registry.get(model_name, root_models_path=root_models_path, prefix=prefix, model_type=model_type,
+                              device=device, precision=precision, jit_buckets=jit_buckets, backend=backend,
+                              parallel_branches=parallel_branches)
+
 
+def get_model_config(model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks'):
+    """
+    Frozen config of a model. The global configs are cloned and never modified.
+    """
     if model_type == 'landmarks':
-        model = get_face_alignment_net(config)
+        model_config = config.clone()
+        model_config.defrost()
+        model_config.merge_from_file(f'{root_models_path}/{prefix}{model_name}.yaml')
     else:
-        model = get_cls_net(config_imagenet)
+        model_config = config_imagenet.clone()
+        model_config.defrost()
+    model_config.MODEL.INIT_WEIGHTS = False
+    model_config.freeze()
+    return model_config
+
+
+def load_model(model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks', device='cuda',
+               precision='fp32', jit_buckets=None, backend='torch', parallel_branches=None):
+    """
+    Build a model from its config and checkpoint, bypassing the cache.
+
+    A flat `{prefix}{model_name}.safetensors` checkpoint (see tools/convert_checkpoint.py) is
+    preferred over the `.pth` one: it is memory-mapped and the parameters stay on the shared
+    page cache instead of being unpickled into every process.
+
+    precision='bf16' runs the model in channels_last memory format under bf16 autocast
+    (`ChannelsLastAutocastModel`), or fp32 channels_last when the hardware has no native bf16.
 
-    model.load_state_dict(torch.load(checkpoint_path))
-    model.eval();
-    model.to(device);
+    precision='int8' loads the quantized `{prefix}{model_name}-int8.pt` TorchScript model
+    written by tools/quantize.py, it runs on CPU only.
+
+    With `jit_buckets` (e.g. (1, 2, 4, 8)) the landmark model is traced and frozen once per batch
+    bucket and the graphs are kept in `{root_models_path}/compiled`, keyed by config, checkpoint,
+    precision and device; later starts load them instead of tracing again. Batches are padded
+    to the nearest bucket (see `CompiledModel`). Ignored for int8 models, they are scripted already.
+
+    backend='onnxruntime' runs `{prefix}{model_name}.onnx` (see tools/export_onnx.py) in an
+    `OnnxRuntimeBackend` session pool instead of torch, fp32 on CPU only.
+
+    `parallel_branches` runs the HRNet branches and fuse paths concurrently (see lib/models/parallel.py):
+    'threads' uses a thread pool in eager mode, 'fork' records `torch.jit.fork` calls that only run
+    concurrently (on the inter-op pool) in the graphs traced with `jit_buckets`.
+
+    Eager landmark models fuse their branches in place (`set_inplace_fuse`), the outputs are unchanged.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {PRECISIONS}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    if parallel_branches is not None and parallel_branches not in PARALLEL_MODES:
+        raise ValueError(f"Unknown parallel mode {parallel_branches}, expected one of {PARALLEL_MODES}")
+    if parallel_branches == 'threads' and jit_buckets:
+        raise ValueError("Thread pool branches can't be traced, use parallel_branches='fork' with jit_buckets")
+    if backend == 'onnxruntime':
+        if precision != 'fp32' or torch.device(device).type != 'cpu':
+            raise ValueError(f"The onnxruntime backend runs fp32 on CPU only, got {precision} on {device}")
+        return OnnxRuntimeBackend(f'{root_models_path}/{prefix}{model_name}.onnx',
+                                  config=get_model_config(model_name, root_models_path=root_models_path, prefix=prefix,
+                                                          model_type=model_type))
+    if precision == 'int8':
+        return load_quantized_model(model_name, root_models_path=root_models_path, prefix=prefix,
+                                    model_type=model_type, device=device)
+
+    model_config = get_model_config(model_name, root_models_path=root_models_path, prefix=prefix,
+                                    model_type=model_type)
+    checkpoint_path = get_checkpoint_path(model_name, root_models_path=root_models_path, prefix=prefix)
+    state_dict = load_checkpoint(checkpoint_path, precision=precision)
+
+    # built on the meta device: the checkpoint tensors become the parameters, no random init
+    if model_type == 'landmarks':
+        model = get_face_alignment_net(model_config, state_dict=state_dict)
+    else:
+        model = get_cls_net(model_config, state_dict=state_dict)
+    model.eval()
+    model.to(device)
+    if model_type == 'landmarks':
+        set_inplace_fuse(model)
+    if parallel_branches and model_type == 'landmarks':
+        set_parallel_branches(model, parallel_branches)
+    if precision == 'fp16':
+        model.half()
+    elif precision == 'bf16':
+        model = to_bf16_inference(model, device=device)
+    if jit_buckets and model_type == 'landmarks':
+        key = artifact_key(model_config, checkpoint_path, precision, device, model_config.MODEL.IMAGE_SIZE)
+        # graphs traced with parallel branches hold torch.jit.fork calls, cached apart from the sequential ones
+        fork_suffix = '-fork' if parallel_branches else ''
+        model = compile_model(model, f'{root_models_path}/compiled',
+                              f'{prefix}{model_name}-{precision}{fork_suffix}-{key}',
+                              buckets=jit_buckets, output_size=model_config.MODEL.IMAGE_SIZE, device=device,
+                              dtype=torch.float16 if precision == 'fp16' else torch.float32)
+    model.config = model_config
 
     return model
 
 
-def get_lmks_by_img(model, img, output_size=(256, 256), rot=0, device='cuda'):
+def get_checkpoint_path(model_name, root_models_path='hrnetv2_models', prefix='HR18-'):
+    """
+    The flat `.safetensors` checkpoint if there is one, the `.pth` one otherwise.
+    """
+    flat_checkpoint_path = f'{root_models_path}/{prefix}{model_name}.safetensors'
+    if os.path.isfile(flat_checkpoint_path):
+        return flat_checkpoint_path
+    return f'{root_models_path}/{prefix}{model_name}.pth'
+
+
+def load_checkpoint(checkpoint_path, precision='fp32'):
+    if checkpoint_path.endswith('.safetensors'):
+        return load_flat_checkpoint(checkpoint_path, dtype=torch.float16 if precision == 'fp16' else torch.float32)
+    return torch.load(checkpoint_path, map_location='cpu')
+
+
+def load_multihead_model(model_names, root_models_path='hrnetv2_models', prefix='HR18-', device='cuda',
+                         precision='fp32', backbone=None, check_backbone=True):
+    """
+    One backbone with the heads of several landmark models (see `MultiHeadHighResolutionNet`).
+
+    The backbone comes from the checkpoint of `backbone` (the first model by default), every
+    head from the checkpoint of its own model. All checkpoints must hold the same backbone tensors
+    (heads fine-tuned on it, tools/finetune_heads.py), otherwise a ValueError is raised; `check_backbone=False`
+    lets tools/multihead_report.py measure how far separately trained heads drift.
+
+    :param model_names: model names (datasets), also the head names.
+    :return: MultiHeadHighResolutionNet, `config` holds the backbone config, `configs` all of them.
+    """
+    if precision not in ('fp32', 'fp16'):
+        raise ValueError(f"Multi-head models run in fp32 or fp16, got {precision}")
+    configs, state_dicts = OrderedDict(), {}
+    for name in model_names:
+        configs[name] = get_model_config(name, root_models_path=root_models_path, prefix=prefix)
+        state_dicts[name] = load_checkpoint(get_checkpoint_path(name, root_models_path=root_models_path, prefix=prefix),
+                                            precision=precision)
+
+    model = get_multihead_net(configs, state_dicts, backbone=backbone, check_backbone=check_backbone)
+    set_inplace_fuse(model)
+    model.to(device)
+    if precision == 'fp16':
+        model.half()
+    model.configs = configs
+    model.config = configs[backbone or model_names[0]]
+    return model
+
+
+def load_quantized_model(model_name, root_models_path='hrnetv2_models', prefix='HR18-', model_type='landmarks',
+                         device='cpu'):
+    if torch.device(device).type != 'cpu':
+        raise ValueError(f"INT8 models run on CPU only, got device {device}")
+    quantized_path = f'{root_models_path}/{prefix}{model_name}-int8.pt'
+    if not os.path.isfile(quantized_path):
+        raise FileNotFoundError(f"{quantized_path} not found, create it with tools/quantize.py")
+
+    model, _ = load_int8(quantized_path)
+    model.config = get_model_config(model_name, root_models_path=root_models_path, prefix=prefix,
+                                    model_type=model_type)
+    return model
+
+
+model_registry = ModelRegistry(load_model, capacity=4)
+
+
+def prepare_input(img, output_size=(256, 256), rot=0, center=None, scale=None, normalize=True):
+    """
+    Crop and normalize an image region into a model input.
+
+    :param img: source image (H, W, 3).
+    :param output_size: model input size.
+    :param rot: rotation of the crop in degrees.
+    :param center: crop center [x, y]. Defaults to the image center.
+    :param scale: crop scale (crop side / 200). Defaults to a crop covering the whole image.
+    :param normalize: False keeps the raw uint8 crop, for models with `takes_raw_input`.
+    :return: (CHW float32 tensor, or uint8 without `normalize`, crop center, crop scale)
+    """
+    face_center = torch.Tensor([img.shape[1]//2, img.shape[0]/2]) if center is None else torch.Tensor(center)
+    crop_scale = max((img.shape[1]) / output_size[0], (img.shape[0]) / output_size[1]) if scale is None else scale
+
+    img_crop = crop_affine(img, face_center, crop_scale, output_size=output_size, rot=rot)
+
+    if not normalize:
+        return torch.from_numpy(to_chw(img_crop)), face_center, crop_scale
+    return torch.from_numpy(normalize_chw(img_crop)), face_center, crop_scale
+
+
+def get_lmks_by_img(model, img, output_size=(256, 256), rot=0, device='cuda', return_confidence=False):
 #     img = np.array(Image.open(image_path).convert('RGB'), dtype=np.float32)
 
-    face_center = torch.Tensor([img.shape[1]//2, img.shape[0]/2])
-    crop_scale = max((img.shape[1]) / output_size[0], (img.shape[0]) / output_size[1])
+    if return_confidence:
+        lmks, confidence = get_lmks_by_imgs(model, [img], output_size=output_size, rot=rot, device=device,
+                                            return_confidence=True)
+        return lmks[0], confidence[0]
+    return get_lmks_by_imgs(model, [img], output_size=output_size, rot=rot, device=device)[0]
+
+
+def get_lmks_by_imgs(model, imgs, centers=None, scales=None, output_size=(256, 256), rot=0, device='cuda',
+                     batch_size=None, return_confidence=False):
+    """
+    Landmarks for a list of images (or face crops) of any size with one forward pass.
+
+    :param model: landmark model.
+    :param imgs: list of images (H, W, 3), sizes may differ.
+    :param centers: optional list of crop centers [x, y], one per image. Defaults to image centers.
+    :param scales: optional list of crop scales, one per image. Defaults to whole-image crops.
+    :param output_size: model input size.
+    :param rot: rotation of the crops in degrees.
+    :param device: device to run the model on.
+    :param batch_size: split the forward into chunks of this size (None - single forward).
+    :param return_confidence: also return the heatmap maximum of every landmark.
+    :return: (N, num_landmarks, 2) numpy array of landmarks in the coordinates of each source image,
+             and (N, num_landmarks) confidences with `return_confidence`.
+    """
+    if len(imgs) == 0:
+        lmks = np.zeros((0, 0, 2), dtype=np.float32)
+        return (lmks, np.zeros((0, 0), dtype=np.float32)) if return_confidence else lmks
+    if centers is None:
+        centers = [None] * len(imgs)
+    if scales is None:
+        scales = [None] * len(imgs)
+    if not len(imgs) == len(centers) == len(scales):
+        raise ValueError(f"Got {len(imgs)} images, {len(centers)} centers and {len(scales)} scales")
+
+    normalize = not takes_raw_input(model)
+    img_tensors, face_centers, crop_scales = [], [], []
+    for img, center, scale in zip(imgs, centers, scales):
+        img_tensor, face_center, crop_scale = prepare_input(img, output_size=output_size, rot=rot,
+                                                            center=center, scale=scale, normalize=normalize)
+        img_tensors.append(img_tensor)
+        face_centers.append(face_center)
+        crop_scales.append(crop_scale)
+    img_tensor = torch.stack(img_tensors)
+
+    batch_size = batch_size or len(imgs)
+    preds, confidences = [], []
+    for start in range(0, len(imgs), batch_size):
+        batch = slice(start, start + batch_size)
+        lmks, confidence = run_model(model, img_tensor[batch], face_centers[batch], crop_scales[batch],
+                                     output_size=output_size, rot=rot, device=device, return_confidence=True)
+        preds.append(lmks)
+        confidences.append(confidence)
+    if return_confidence:
+        return torch.cat(preds).numpy(), torch.cat(confidences).numpy()
+    return torch.cat(preds).numpy()
+
+
+def get_lmks_by_imgs_cascade(model, imgs, centers=None, scales=None, fast_model=None, fast_output_size=(128, 128),
+                             output_size=(256, 256), threshold=CASCADE_THRESHOLD, rot=0, device='cuda'):
+    """
+    Landmarks of a low resolution pass, refined by the full model for the faces it is not sure about.
+
+    Every face first goes through `fast_model` at `fast_output_size` (128x128 crops give 32x32
+    heatmaps, about 4x cheaper). A face whose confidence (mean heatmap maximum of its landmarks,
+    the training targets peak at 1) is below `threshold` runs again through `model` at `output_size`.
 
-    img_crop = crop(img, face_center, crop_scale, output_size=output_size, rot=rot)
-    img_crop = (img_crop/255.0 - np.array([0.485, 0.456, 0.406])) / np.array([0.229, 0.224, 0.225])
-    img_crop = img_crop.transpose([2, 0, 1])
+    :param fast_model: landmark model of the first pass with the same landmarks, `model` itself by default
+                       (HRNet is fully convolutional).
+    :return: (N, num_landmarks, 2) landmarks, (N, num_landmarks) confidences of the pass they come from,
+             (N,) bool array of the faces refined by the full model.
+    """
+    fast_model = model if fast_model is None else fast_model
+    centers = centers if centers is not None else [None] * len(imgs)
+    scales = scales if scales is not None else [None] * len(imgs)
+    lmks, confidence = get_lmks_by_imgs(fast_model, imgs, centers=centers, scales=scales, output_size=fast_output_size,
+                                        rot=rot, device=device, return_confidence=True)
+    refined = confidence.mean(1) < threshold if len(imgs) else np.zeros(0, dtype=bool)
+    hard = np.flatnonzero(refined)
+    if len(hard):
+        full_lmks, full_confidence = get_lmks_by_imgs(model, [imgs[i] for i in hard],
+                                                      centers=[centers[i] for i in hard],
+                                                      scales=[scales[i] for i in hard], output_size=output_size,
+                                                      rot=rot, device=device, return_confidence=True)
+        if full_lmks.shape[1:] != lmks.shape[1:]:
+            raise ValueError(f"The fast model predicts {lmks.shape[1]} landmarks, the full one {full_lmks.shape[1]}")
+        lmks[hard] = full_lmks
+        confidence[hard] = full_confidence
+    return lmks, confidence, refined
+
+
+def run_model(model, img_tensor, centers, scales, output_size=(256, 256), rot=0, device='cuda',
+              return_confidence=False):
+    """
+    Forward a batch of prepared inputs and return landmarks in source image coordinates.
+
+    Models wrapped with `HighResolutionNetWithDecoder` decode inside the graph and only
+    (N, P, 2) landmarks leave the device; everything else runs through its `Backend`
+    (torch models are wrapped in a `TorchBackend`) and the heatmaps are decoded here.
+
+    :param return_confidence: also return the heatmap maximum of every landmark.
+    :return: (N, num_landmarks, 2) float tensor on CPU, and (N, num_landmarks) confidences with `return_confidence`.
+    """
+    res = [output_size[0]/4, output_size[1]/4]
+    if getattr(model, 'decodes_landmarks', False):
+        param = next(model.parameters(), None)
+        img_tensor = img_tensor.to(device, dtype=param.dtype if param is not None else torch.float32)
+        inv_transforms = torch.from_numpy(get_inverse_transforms(centers, scales, res, rot=rot)[:, :2])
+        with torch.no_grad():
+            lmks, maxval = model(img_tensor, inv_transforms.to(device))
+        if return_confidence:
+            return lmks.float().cpu(), maxval.float().cpu()
+        return lmks.float().cpu()
+    pred = get_backend(model).infer(img_tensor, device=device).float()
+    if return_confidence:
+        lmks, maxval = decode_preds(pred, centers, scales, res, rot=rot, return_confidence=True)
+        return lmks.cpu(), maxval.cpu()
+    return decode_preds(pred, centers, scales, res, rot=rot).cpu()
+
+
+def run_multihead_model(model, img_tensor, centers, scales, heads=None, output_size=(256, 256), rot=0, device='cuda'):
+    """
+    `run_model` for a `MultiHeadHighResolutionNet`: one backbone forward, the chosen heads decoded.
 
-    img_tensor = torch.tensor(img_crop, dtype=torch.float32).unsqueeze(0)
-    img_tensor = img_tensor.to(device)
+    :param heads: head names to run, all heads by default.
+    :return: OrderedDict head name -> (N, num_landmarks, 2) float tensor on CPU.
+    """
+    res = [output_size[0]/4, output_size[1]/4]
+    param = next(model.parameters())
     with torch.no_grad():
-        pred = model(img_tensor)
-    return decode_preds(pred, [face_center], [crop_scale], [output_size[0]/4,output_size[1]/4]).cpu().numpy().squeeze(0)
+        preds = model(img_tensor.to(device, dtype=param.dtype), heads=heads)
+    return OrderedDict((name, decode_preds(pred.float(), centers, scales, res, rot=rot).cpu())
+                       for name, pred in preds.items())
+
 
+def run_multihead_batch(model, inputs, centers, scales, output_size=(256, 256), device='cpu'):
+    """
+    `MicroBatcher` batch runner for multi-head models.
 
-def get_preds(scores):
+    Every input is an (img_tensor, head names) pair: the batch runs the union of the requested
+    heads once, and every input gets a dict head name -> (num_landmarks, 2) landmarks of its own heads.
+    """
+    requested = [heads for _, heads in inputs]
+    heads = [name for name in model.heads.keys() if any(name in item_heads for item_heads in requested)]
+    lmks = run_multihead_model(model, torch.stack([img_tensor for img_tensor, _ in inputs]), centers, scales,
+                               heads=heads, output_size=output_size, device=device)
+    return [OrderedDict((name, lmks[name][i].numpy()) for name in item_heads) for i, item_heads in enumerate(requested)]
+
+
+def get_preds(scores, return_confidence=False):
     """
     get predictions from score maps in torch Tensor
-    return type: torch.LongTensor
+    return type: torch.LongTensor, and the (N, P) score maxima with `return_confidence`
     """
     assert scores.dim() == 4, 'Score maps should be 4-dim'
     maxval, idx = torch.max(scores.view(scores.size(0), scores.size(1), -1), 2)
 
-    maxval = maxval.view(scores.size(0), scores.size(1), 1)
-    idx = idx.view(scores.size(0), scores.size(1), 1) + 1
-
-    preds = idx.repeat(1, 1, 2).float()
-
-    preds[:, :, 0] = (preds[:, :, 0] - 1) % scores.size(3) + 1
-    preds[:, :, 1] = torch.floor((preds[:, :, 1] - 1) / scores.size(3)) + 1
-
-    pred_mask = maxval.gt(0).repeat(1, 1, 2).float()
-    preds *= pred_mask
+    preds = torch.stack([idx % scores.size(3), torch.div(idx, scores.size(3), rounding_mode='floor')], 2).float() + 1
+    preds *= maxval.gt(0).unsqueeze(2).float()
+    if return_confidence:
+        return preds, maxval
     return preds
 
 
-def decode_preds(output, center, scale, res):
-    coords = get_preds(output)  # float type
+def decode_preds(output, center, scale, res, rot=0, return_confidence=False):
+    coords, maxval = get_preds(output, return_confidence=True)  # float type
 
-    coords = coords.cpu()
-    # pose-processing
-    for n in range(coords.size(0)):
-        for p in range(coords.size(1)):
-            hm = output[n][p]
-            px = int(math.floor(coords[n][p][0]))
-            py = int(math.floor(coords[n][p][1]))
-            if (px > 1) and (px < res[0]) and (py > 1) and (py < res[1]):
-                diff = torch.Tensor([hm[py - 1][px] - hm[py - 1][px - 2], hm[py][px - 1]-hm[py - 2][px - 1]])
-                coords[n][p] += diff.sign() * .25
-    coords += 0.5
-    preds = coords.clone()
+    # pose-processing: quarter pixel shift towards the higher neighbour, for all points at once
+    n, p, h, w = output.shape
+    px = coords[:, :, 0].long()
+    py = coords[:, :, 1].long()
+    inside = (px > 1) & (px < res[0]) & (py > 1) & (py < res[1])
+    # indices outside of the valid range are clamped for the gather and masked out afterwards
+    px = px.clamp(2, w - 1)
+    py = py.clamp(2, h - 1)
+    hm = output.reshape(n, p, h * w)
 
-    # Transform back
-    for i in range(coords.size(0)):
-        preds[i] = transform_preds(coords[i], center[i], scale[i], res)
+    def at(row, col):
+        return hm.gather(2, (row * w + col).unsqueeze(2)).squeeze(2)
 
-    if preds.dim() < 3:
-        preds = preds.view(1, preds.size())
+    diff = torch.stack([at(py - 1, px) - at(py - 1, px - 2), at(py, px - 1) - at(py - 2, px - 1)], 2)
+    coords += diff.sign() * .25 * inside.unsqueeze(2)
+    coords = coords.cpu() + 0.5
 
+    # Transform back
+    preds = transform_preds_batch(coords, center, scale, res, rot=rot)
+    if return_confidence:
+        return preds, maxval.cpu()
     return preds
 
 
@@ -106,9 +421,9 @@ def crop(img, center, scale, output_size=(256,256), rot=0):
     if sf < 2:
         sf = 1
     else:
-        new_size = int(np.math.floor(max(ht, wd) / sf))
-        new_ht = int(np.math.floor(ht / sf))
-        new_wd = int(np.math.floor(wd / sf))
+        new_size = int(math.floor(max(ht, wd) / sf))
+        new_ht = int(math.floor(ht / sf))
+        new_wd = int(math.floor(wd / sf))
         if new_size < 2:
             return torch.zeros(output_size[0], output_size[1], img.shape[2]) \
                         if len(img.shape) > 2 else torch.zeros(output_size[0], output_size[1])
@@ -145,8 +460,9 @@ def crop(img, center, scale, output_size=(256,256), rot=0):
     new_img[new_y[0]:new_y[1], new_x[0]:new_x[1]] = img[old_y[0]:old_y[1], old_x[0]:old_x[1]]
 
     if not rot == 0:
-        # Remove padding
-        new_img = scipy.misc.imrotate(new_img, rot)
+        # Remove padding (scipy.misc.imrotate is gone from scipy, cv2 rotates the same way)
+        rot_mat = cv2.getRotationMatrix2D((new_img.shape[1] / 2, new_img.shape[0] / 2), rot, 1)
+        new_img = cv2.warpAffine(new_img, rot_mat, (new_img.shape[1], new_img.shape[0]))
         new_img = new_img[pad:-pad, pad:-pad]
     new_img = np.array(Image.fromarray(new_img.astype(np.uint8)).resize(output_size[::-1]))
 #     new_img = scipy.misc.imresize(new_img, output_size)
@@ -163,38 +479,19 @@ def transform_pixel(pt, center, scale, output_size, invert=0, rot=0):
     return new_pt[:2].astype(int) + 1
 
 
-def get_transform(center, scale, output_size, rot=0):
-    """
-    General image processing functions
-    """
-    # Generate transformation matrix
-    h = 200 * scale
-    t = np.zeros((3, 3))
-    t[0, 0] = float(output_size[1]) / h
-    t[1, 1] = float(output_size[0]) / h
-    t[0, 2] = output_size[1] * (-float(center[0]) / h + .5)
-    t[1, 2] = output_size[0] * (-float(center[1]) / h + .5)
-    t[2, 2] = 1
-    if not rot == 0:
-        rot = -rot  # To match direction of rotation from cropping
-        rot_mat = np.zeros((3, 3))
-        rot_rad = rot * np.pi / 180
-        sn, cs = np.sin(rot_rad), np.cos(rot_rad)
-        rot_mat[0, :2] = [cs, -sn]
-        rot_mat[1, :2] = [sn, cs]
-        rot_mat[2, 2] = 1
-        # Need to rotate around center
-        t_mat = np.eye(3)
-        t_mat[0, 2] = -output_size[1]/2
-        t_mat[1, 2] = -output_size[0]/2
-        t_inv = t_mat.copy()
-        t_inv[:2, 2] *= -1
-        t = np.dot(t_inv, np.dot(rot_mat, np.dot(t_mat, t)))
-    return t
+def transform_preds(coords, center, scale, output_size):
+    coords[:, 0:2] = transform_preds_batch(coords[None, :, 0:2], [center], [scale], output_size)[0]
+    return coords
 
 
-def transform_preds(coords, center, scale, output_size):
+def transform_preds_batch(coords, center, scale, output_size, rot=0):
+    """
+    Map (N, P, 2) heatmap coordinates back to the source images of the N crops.
 
-    for p in range(coords.size(0)):
-        coords[p, 0:2] = torch.tensor(transform_pixel(coords[p, 0:2], center, scale, output_size, 1, 0))
-    return coords
\ No newline at end of file
+    Equivalent to calling `transform_pixel(pt, center[i], scale[i], output_size, invert=1)`
+    for every point, with one inverse affine per sample applied as a matrix multiply.
+    """
+    t_inv = torch.from_numpy(get_inverse_transforms(center, scale, output_size, rot=rot))
+    pts = coords.double() - 1
+    new_pts = torch.matmul(pts, t_inv[:, :2, :2].transpose(1, 2)) + t_inv[:, None, :2, 2]
+    return (new_pts.trunc() + 1).to(coords.dtype)
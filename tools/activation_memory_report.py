@@ -0,0 +1,153 @@
+"""
+Peak activation memory and allocations per stage, regular and in-place branch fusion.
+
+Every tensor storage created during the forward is tracked until it is freed (parameters and
+the input are not counted). For each stage of the network the report shows the peak of the live
+activation bytes while the stage runs, the number of new storages and the bytes they take.
+The in-place fusion (`set_inplace_fuse`) is measured from empty upsample buffers, so the
+buffers it keeps between forwards are included.
+
+    python tools/activation_memory_report.py --models WFLW --batch-sizes 1 8 16
+"""
+import os
+import sys
+import copy
+import json
+import weakref
+import argparse
+from collections import OrderedDict
+
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.models.inplace_fuse import set_inplace_fuse, upsample_buffers
+from lib.utils import latency_ms
+from utils.utils_inference import load_model
+
+STEM = ('conv1', 'bn1', 'conv2', 'bn2', 'relu', 'layer1')
+STAGES = ('stem', 'transition1', 'stage2', 'transition2', 'stage3', 'transition3', 'stage4', 'head')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Per-stage activation memory report')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16])
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    return parser.parse_args()
+
+
+class ActivationTracker(TorchDispatchMode):
+    """
+    Live bytes of the storages created by the ops, attributed to the current stage.
+    """
+
+    def __init__(self):
+        super(ActivationTracker, self).__init__()
+        self.live = 0
+        self.stage = None
+        self.stats = OrderedDict()
+        self._seen = set()
+
+    def enter(self, stage):
+        self.stage = stage
+        self.stats.setdefault(stage, {'peak_bytes': self.live, 'allocations': 0, 'allocated_bytes': 0})
+
+    def _free(self, key, nbytes):
+        self.live -= nbytes
+        self._seen.discard(key)
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        for t in tree_flatten(out)[0]:
+            if not isinstance(t, torch.Tensor):
+                continue
+            storage = t.untyped_storage()
+            key = storage._cdata
+            if key in self._seen:
+                continue
+            self._seen.add(key)
+            nbytes = storage.nbytes()
+            self.live += nbytes
+            weakref.finalize(storage, self._free, key, nbytes)
+            if self.stage is not None:
+                stats = self.stats[self.stage]
+                stats['allocations'] += 1
+                stats['allocated_bytes'] += nbytes
+                stats['peak_bytes'] = max(stats['peak_bytes'], self.live)
+        return out
+
+
+def stage_of(name):
+    top = name.split('.')[0]
+    return 'stem' if top in STEM else top
+
+
+def measure(model, x):
+    """
+    :return: (OrderedDict stage -> stats, overall peak bytes)
+    """
+    tracker = ActivationTracker()
+    handles = []
+    for name, module in model.named_children():
+        targets = module if isinstance(module, torch.nn.ModuleList) else [module]
+        for target in targets:
+            if target is not None:
+                handles.append(target.register_forward_pre_hook(
+                    lambda _, __, stage=stage_of(name): tracker.enter(stage)))
+
+    upsample_buffers.clear()
+    try:
+        with torch.no_grad(), tracker:
+            branches = model(x, with_head=False)
+            # the branch concatenation belongs to the head
+            tracker.enter('head')
+            model.forward_head(branches)
+    finally:
+        for handle in handles:
+            handle.remove()
+    stats = OrderedDict((stage, tracker.stats[stage]) for stage in STAGES if stage in tracker.stats)
+    return stats, max(s['peak_bytes'] for s in stats.values())
+
+
+def main():
+    args = parse_args()
+    report = []
+    mb = 1024 * 1024
+    for model_name in args.models:
+        model = load_model(model_name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        variants = OrderedDict([('regular', set_inplace_fuse(copy.deepcopy(model), False)),
+                                ('inplace', set_inplace_fuse(copy.deepcopy(model), True))])
+        size = model.config.MODEL.IMAGE_SIZE
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, 3, size[1], size[0])
+            results = {name: measure(variant, x) for name, variant in variants.items()}
+            times = {name: latency_ms(variant, x, repeats=3) for name, variant in variants.items()}
+
+            print(f"{model_name}, batch {batch_size}: peak live MB / allocations / allocated MB")
+            print(f"{'stage':>12} | " + ' | '.join(f'{name:>24}' for name in variants))
+            for stage in results['regular'][0]:
+                cells = []
+                for name in variants:
+                    s = results[name][0][stage]
+                    cells.append(f"{s['peak_bytes'] / mb:>8.1f} {s['allocations']:>6d} {s['allocated_bytes'] / mb:>8.1f}")
+                print(f"{stage:>12} | " + ' | '.join(cells))
+            print(f"{'peak':>12} | " + ' | '.join(f'{results[name][1] / mb:>8.1f}{"":>16}' for name in variants))
+            print(f"{'forward ms':>12} | " + ' | '.join(f'{times[name]:>8.1f}{"":>16}' for name in variants))
+            print()
+            report.append({'model': model_name, 'batch_size': batch_size,
+                           'variants': {name: {'stages': results[name][0], 'peak_bytes': results[name][1],
+                                               'forward_ms': times[name]} for name in variants}})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: eager torch vs the onnxruntime backend on the same inputs.
+
+Measures single-caller latency per batch size and the throughput of several concurrent
+callers (as Flask threads sharing one backend), and checks that both backends give the
+same landmarks. Needs {prefix}{model}.onnx from tools/export_onnx.py.
+
+    python tools/bench_backends.py --models WFLW --images ./faces --batch-sizes 1 4 8 --clients 4
+    ORT_SESSIONS=2 python tools/bench_backends.py --models WFLW --clients 4
+"""
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.datasets import load_images
+from lib.utils import make_inputs
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare torch and onnxruntime backends')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--images', default=None, help='folder with face images, random inputs if not given')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--clients', type=int, default=4, help='concurrent callers for the throughput test')
+    parser.add_argument('--repeats', type=int, default=5)
+    return parser.parse_args()
+
+
+def latency_ms(model, img_tensor, centers, scales, repeats):
+    run_model(model, img_tensor, centers, scales, device='cpu')
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run_model(model, img_tensor, centers, scales, device='cpu')
+        times.append(1000.0 * (time.perf_counter() - start))
+    return float(np.median(times))
+
+
+def throughput(model, img_tensor, centers, scales, clients, repeats):
+    """
+    Images per second with `clients` threads calling the model at the same time.
+    """
+    def call(_):
+        run_model(model, img_tensor, centers, scales, device='cpu')
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(call, range(clients)))
+        start = time.perf_counter()
+        list(pool.map(call, range(clients * repeats)))
+        elapsed = time.perf_counter() - start
+    return clients * repeats * len(img_tensor) / elapsed
+
+
+def main():
+    args = parse_args()
+    images = load_images(args.images) if args.images else []
+
+    for name in args.models:
+        backends = {
+            'torch': load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu'),
+            'onnxruntime': load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu',
+                                      backend='onnxruntime'),
+        }
+        img_tensor, centers, scales = make_inputs(images, prepare_input, max(args.batch_sizes),
+                                                  image_size=backends['torch'].config.MODEL.IMAGE_SIZE)
+        lmks = {key: run_model(model, img_tensor, centers, scales, device='cpu') for key, model in backends.items()}
+        print(f"{name}: max landmark diff {(lmks['torch'] - lmks['onnxruntime']).abs().max().item():.3f} px, "
+              f"onnxruntime {backends['onnxruntime'].stats()}")
+
+        print(f"{'batch':>6} | {'torch ms':>9} | {'ort ms':>9} | {'speedup':>7}")
+        for batch_size in args.batch_sizes:
+            batch = img_tensor[:batch_size], centers[:batch_size], scales[:batch_size]
+            torch_ms = latency_ms(backends['torch'], *batch, args.repeats)
+            ort_ms = latency_ms(backends['onnxruntime'], *batch, args.repeats)
+            print(f"{batch_size:>6} | {torch_ms:>9.1f} | {ort_ms:>9.1f} | {torch_ms / ort_ms:>6.2f}x")
+
+        batch = img_tensor[:1], centers[:1], scales[:1]
+        torch_ips = throughput(backends['torch'], *batch, args.clients, args.repeats)
+        ort_ips = throughput(backends['onnxruntime'], *batch, args.clients, args.repeats)
+        print(f"{args.clients} concurrent clients, batch 1: torch {torch_ips:.1f} img/s, "
+              f"onnxruntime {ort_ips:.1f} img/s ({ort_ips / torch_ips:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Cost and accuracy of the confidence-gated cascade (`get_lmks_by_imgs_cascade`) per threshold.
+
+Every face runs through the fast pass (the model itself at --fast-size, or {prefix}{model}{--fast-suffix}),
+faces whose mean landmark confidence is below the threshold run through the full model again. For every
+threshold reports the share of refined faces, the time per face and the NME against the full model alone,
+to pick CASCADE_THRESHOLD for the server. Also prints the confidence distribution of both passes.
+
+    python tools/bench_cascade.py --model WFLW --images ./faces --thresholds 0.3 0.4 0.5 0.6
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.evaluation import compute_nme
+from lib.datasets import load_images
+from utils.utils_inference import load_model, get_lmks_by_imgs, get_lmks_by_imgs_cascade
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the low resolution cascade')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--model', default='WFLW')
+    parser.add_argument('--fast-suffix', default='', help='fast pass model {model}{suffix}, the model itself by default')
+    parser.add_argument('--fast-size', type=int, default=128)
+    parser.add_argument('--images', required=True, help='folder with face crops')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.3, 0.4, 0.5, 0.6, 0.7])
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=None)
+    return parser.parse_args()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    images = load_images(args.images)
+    model = load_model(args.model, root_models_path=args.root, prefix=args.prefix, device='cpu')
+    fast_model = load_model(args.model + args.fast_suffix, root_models_path=args.root, prefix=args.prefix,
+                            device='cpu') if args.fast_suffix else model
+    output_size = tuple(model.config.MODEL.IMAGE_SIZE)
+    fast_size = (args.fast_size, args.fast_size)
+
+    def full():
+        return get_lmks_by_imgs(model, images, output_size=output_size, device='cpu', batch_size=args.batch_size,
+                                return_confidence=True)
+
+    def fast():
+        return get_lmks_by_imgs(fast_model, images, output_size=fast_size, device='cpu', batch_size=args.batch_size,
+                                return_confidence=True)
+
+    full()  # warm up
+    (full_lmks, full_confidence), full_s = timed(full)
+    fast()
+    (fast_lmks, fast_confidence), fast_s = timed(fast)
+    num = len(images)
+    print(f"{args.model}: {num} faces, full {output_size[0]}x{output_size[1]} {1000 * full_s / num:.1f} ms/face, "
+          f"fast {fast_size[0]}x{fast_size[1]} {1000 * fast_s / num:.1f} ms/face, "
+          f"fast NME vs full {np.nanmean(compute_nme(fast_lmks, full_lmks)):.4f}")
+    for name, confidence in (('full', full_confidence), ('fast', fast_confidence)):
+        print(f"  {name} face confidence percentiles 10/50/90: " +
+              ' / '.join(f'{v:.3f}' for v in np.percentile(confidence.mean(1), [10, 50, 90])))
+
+    print(f"{'threshold':>9} | {'refined %':>9} | {'ms/face':>8} | {'speedup':>7} | {'NME vs full':>11}")
+    for threshold in args.thresholds:
+        (lmks, _, refined), cascade_s = timed(lambda: get_lmks_by_imgs_cascade(
+            model, images, fast_model=fast_model, fast_output_size=fast_size, output_size=output_size,
+            threshold=threshold, device='cpu'))
+        print(f"{threshold:>9.2f} | {100.0 * refined.mean():>9.1f} | {1000 * cascade_s / num:>8.1f} | "
+              f"{full_s / cascade_s:>7.2f} | {np.nanmean(compute_nme(lmks, full_lmks)):>11.4f}")
+
+
+if __name__ == '__main__':
+    main()
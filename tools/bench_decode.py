@@ -0,0 +1,81 @@
+"""
+Microbenchmark: vectorized heatmap decoding vs the previous per-point loop.
+
+    python tools/bench_decode.py --batch-sizes 1 8 32 --num-joints 98
+"""
+import os
+import sys
+import math
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from utils.utils_inference import decode_preds, get_preds, transform_pixel
+
+
+def decode_preds_loop(output, center, scale, res):
+    """
+    Previous implementation of `decode_preds`: one Python iteration and one `transform_pixel`
+    (with its own 3x3 inverse) per landmark.
+    """
+    coords = get_preds(output)
+    coords = coords.cpu()
+    for n in range(coords.size(0)):
+        for p in range(coords.size(1)):
+            hm = output[n][p]
+            px = int(math.floor(coords[n][p][0]))
+            py = int(math.floor(coords[n][p][1]))
+            if (px > 1) and (px < res[0]) and (py > 1) and (py < res[1]):
+                diff = torch.Tensor([hm[py - 1][px] - hm[py - 1][px - 2], hm[py][px - 1] - hm[py - 2][px - 1]])
+                coords[n][p] += diff.sign() * .25
+    coords += 0.5
+    preds = coords.clone()
+    for i in range(coords.size(0)):
+        for p in range(coords.size(1)):
+            preds[i, p, 0:2] = torch.tensor(transform_pixel(coords[i, p, 0:2], center[i], scale[i], res, 1, 0))
+    return preds
+
+
+def timeit(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return 1000.0 * float(np.median(times))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark heatmap decoding')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--num-joints', type=int, default=98)
+    parser.add_argument('--heatmap-size', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    res = [args.heatmap_size, args.heatmap_size]
+    torch.manual_seed(0)
+
+    print(f"{'batch':>6} {'loop, ms':>10} {'vectorized, ms':>15} {'speedup':>8} {'max abs diff':>13}")
+    for batch_size in args.batch_sizes:
+        output = torch.randn(batch_size, args.num_joints, *res)
+        center = [torch.Tensor([320 + 10 * i, 240]) for i in range(batch_size)]
+        scale = [2.5 + 0.1 * i for i in range(batch_size)]
+
+        diff = (decode_preds_loop(output, center, scale, res) - decode_preds(output, center, scale, res)).abs().max()
+        loop_ms = timeit(lambda: decode_preds_loop(output, center, scale, res), args.repeats)
+        vec_ms = timeit(lambda: decode_preds(output, center, scale, res), args.repeats)
+        print(f"{batch_size:>6} {loop_ms:>10.2f} {vec_ms:>15.3f} {loop_ms / vec_ms:>7.1f}x {diff.item():>13.4g}")
+
+
+if __name__ == '__main__':
+    main()
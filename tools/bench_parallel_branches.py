@@ -0,0 +1,137 @@
+"""
+Latency of sequential and concurrent HRNet branch execution for a sweep of core counts.
+
+Every (cores, mode) point runs in a fresh Python process pinned to the first `cores` CPUs
+(inter-op threads can be set only once per process):
+
+    sequential      eager model, `cores` intra-op threads
+    sequential-jit  traced and frozen graph, `cores` intra-op threads
+    threads         eager model, branches and fuse paths on a --workers thread pool,
+                    cores // workers intra-op threads per pool thread
+    fork            traced graph with torch.jit.fork, --workers inter-op threads,
+                    cores // workers intra-op threads
+
+    python tools/bench_parallel_branches.py --models WFLW --cores 1 2 4 8 --batch-sizes 1 4
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SERVER_DIR = os.path.join(PROJECT_ROOT, 'src', 'server')
+
+MODES = ('sequential', 'sequential-jit', 'threads', 'fork')
+
+# runs in the child process, prints one JSON line
+CHILD = r'''
+import os, json, time
+os.sched_setaffinity(0, CPUS)
+import torch
+parallel = MODE in ('threads', 'fork')
+intra = max(1, len(CPUS) // WORKERS) if parallel else len(CPUS)
+torch.set_num_threads(len(CPUS) if MODE == 'threads' else intra)
+torch.set_num_interop_threads(WORKERS if MODE == 'fork' else 1)
+
+from utils.utils_inference import load_model
+from lib.models.parallel import set_parallel_branches
+
+jit = MODE in ('sequential-jit', 'fork')
+model = load_model(MODEL, root_models_path=ROOT, prefix=PREFIX, device='cpu',
+                   jit_buckets=BATCH_SIZES if jit else None, parallel_branches='fork' if MODE == 'fork' else None)
+reference = load_model(MODEL, root_models_path=ROOT, prefix=PREFIX, device='cpu')
+if MODE == 'threads':
+    set_parallel_branches(model, 'threads', num_workers=WORKERS, intra_op_threads=intra)
+
+size = model.config.MODEL.IMAGE_SIZE
+results = {}
+with torch.no_grad():
+    for batch_size in BATCH_SIZES:
+        x = torch.randn(batch_size, 3, size[1], size[0], generator=torch.Generator().manual_seed(0))
+        for _ in range(WARMUP):
+            out = model(x)
+        times = []
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            model(x)
+            times.append(1000.0 * (time.perf_counter() - start))
+        results[batch_size] = {
+            'median_ms': sorted(times)[len(times) // 2],
+            'max_abs_diff': (out.float() - reference(x)).abs().max().item(),
+        }
+print(json.dumps({'intra_op_threads': intra, 'results': results}))
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent HRNet branches over core counts')
+    parser.add_argument('--root', default=os.path.join(SERVER_DIR, 'hrnetv2_models'), help='models directory')
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--cores', type=int, nargs='+', default=None,
+                        help='core counts to sweep, powers of two up to the available CPUs by default')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--workers', type=int, default=4, help='concurrent branches (pool or inter-op threads)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    return parser.parse_args()
+
+
+def default_cores(available):
+    cores = [1]
+    while cores[-1] * 2 <= available:
+        cores.append(cores[-1] * 2)
+    if cores[-1] != available:
+        cores.append(available)
+    return cores
+
+
+def run_point(model_name, cpus, mode, args):
+    env = dict(os.environ, OMP_NUM_THREADS=str(len(cpus)),
+               PYTHONPATH=os.pathsep.join([os.path.abspath(SERVER_DIR), os.path.abspath(PROJECT_ROOT)]))
+    code = f'CPUS = {cpus!r}\nMODE = {mode!r}\nMODEL = {model_name!r}\nROOT = {os.path.abspath(args.root)!r}\n' \
+           f'PREFIX = {args.prefix!r}\nWORKERS = {args.workers}\nBATCH_SIZES = {args.batch_sizes!r}\n' \
+           f'WARMUP = {args.warmup}\nREPEATS = {args.repeats}\n' + CHILD
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{model_name} {mode} on {len(cpus)} cores failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    available = sorted(os.sched_getaffinity(0))
+    core_counts = args.cores or default_cores(len(available))
+    if max(core_counts) > len(available):
+        raise ValueError(f"Only {len(available)} CPUs available, asked for {max(core_counts)}")
+
+    report = []
+    for model_name in args.models:
+        print(f"{model_name}: median ms per batch (speedup vs sequential)")
+        print(f"{'cores':>5} {'mode':>15} {'intra':>5} | " +
+              ' | '.join(f'{"batch " + str(b):>17}' for b in args.batch_sizes) + ' | max abs diff')
+        for cores in core_counts:
+            baseline = None
+            for mode in args.modes:
+                point = run_point(model_name, available[:cores], mode, args)
+                results = {int(b): r for b, r in point['results'].items()}
+                baseline = baseline or results
+                cells = []
+                for batch_size in args.batch_sizes:
+                    ms = results[batch_size]['median_ms']
+                    cells.append(f"{ms:>9.1f} ({baseline[batch_size]['median_ms'] / ms:>4.2f}x)")
+                diff = max(r['max_abs_diff'] for r in results.values())
+                print(f"{cores:>5} {mode:>15} {point['intra_op_threads']:>5} | " + ' | '.join(cells) + f' | {diff:.2e}')
+                report.append({'model': model_name, 'cores': cores, 'mode': mode,
+                               'intra_op_threads': point['intra_op_threads'], 'results': results})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Throughput and accuracy of the CPU inference precisions on this machine.
+
+Compares fp32, fp32 in channels_last, bf16 (channels_last + bf16 autocast) and, when
+{prefix}{model}-int8.pt exists, int8. Accuracy is the NME of the landmarks against fp32.
+
+    python tools/bench_precision.py --models WFLW --images ./faces --batch-sizes 1 8
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.evaluation import compute_nme
+from lib.datasets import load_images
+from lib.utils import make_inputs
+from utils.autocast_model import ChannelsLastAutocastModel, bf16_supported
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare CPU inference precisions')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--images', default=None, help='folder with face images, random inputs if not given')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    return parser.parse_args()
+
+
+def images_per_second(model, img_tensor, repeats):
+    with torch.no_grad():
+        model(img_tensor)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(img_tensor)
+    return repeats * len(img_tensor) / (time.perf_counter() - start)
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(f"CPU capability: {torch.backends.cpu.get_cpu_capability()}, native bf16: {bf16_supported('cpu')}, "
+          f"threads: {torch.get_num_threads()}")
+
+    images = load_images(args.images) if args.images else []
+
+    for name in args.models:
+        fp32 = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        img_tensor, centers, scales = make_inputs(images, prepare_input, max(args.batch_sizes),
+                                                  image_size=fp32.config.MODEL.IMAGE_SIZE)
+        variants = {
+            'fp32': fp32,
+            'channels_last': ChannelsLastAutocastModel(copy.deepcopy(fp32), autocast_dtype=None),
+            'bf16': load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu', precision='bf16'),
+        }
+        if os.path.isfile(os.path.join(args.root, f'{args.prefix}{name}-int8.pt')):
+            variants['int8'] = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu',
+                                          precision='int8')
+
+        with torch.no_grad():
+            reference_heatmaps = fp32(img_tensor)
+        reference = run_model(fp32, img_tensor, centers, scales, device='cpu').numpy()
+
+        print(f"{name}:")
+        print(f"{'variant':>14} | " + ' | '.join(f'{f"img/s b{b}":>9}' for b in args.batch_sizes) +
+              f" | {'heatmap diff':>12} | {'NME vs fp32':>11}")
+        for key, model in variants.items():
+            ips = [images_per_second(model, img_tensor[:b], args.repeats) for b in args.batch_sizes]
+            with torch.no_grad():
+                heatmap_diff = (model(img_tensor).float() - reference_heatmaps).abs().max().item()
+            nme = compute_nme(run_model(model, img_tensor, centers, scales, device='cpu').numpy(), reference)
+            print(f"{key:>14} | " + ' | '.join(f'{v:>9.2f}' for v in ips) +
+                  f" | {heatmap_diff:>12.2e} | {np.nanmean(nme):>11.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Cold start and memory of the server in torch and slim (cv2.dnn, no torch) serving modes.
+
+Every mode runs in a fresh Python process started in --server-dir (the directory with
+hrnetv2_models/, as for the server): import of main.py, model loading, first and warm
+/process-image requests, peak RSS. The slim mode needs {prefix}{model}.onnx from tools/export_onnx.py.
+
+    python tools/bench_serving_modes.py --models WFLW --image images/example.jpg
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'server')
+PROJECT_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# runs in the child process, prints one JSON line
+CHILD = r'''
+import io, sys, json, time, resource
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.load_face_model()
+loaded = time.perf_counter()
+
+import numpy as np, cv2
+if IMAGE:
+    data = open(IMAGE, 'rb').read()
+else:
+    data = cv2.imencode('.jpg', (np.random.RandomState(0).rand(480, 640, 3) * 255).astype(np.uint8))[1].tobytes()
+if not IMAGE or DETECTOR == 'fixed':
+    class FixedFaces:
+        def detectMultiScale(self, *args, **kwargs):
+            return np.array([[100, 100, 160, 160]])
+    main.face_cascade = FixedFaces()
+
+client = main.app.test_client()
+def request():
+    t = time.perf_counter()
+    r = client.post('/process-image', data={'image': (io.BytesIO(data), 'face.jpg', 'image/jpeg')},
+                    content_type='multipart/form-data')
+    return r.status_code, 1000.0 * (time.perf_counter() - t)
+status, first_ms = request()
+warm_ms = sorted(request()[1] for _ in range(REPEATS))[REPEATS // 2]
+
+rss_kb = [int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS')]
+print(json.dumps({
+    'import_s': imported - start,
+    'load_s': loaded - imported,
+    'first_request_ms': first_ms,
+    'warm_request_ms': warm_ms,
+    'status': status,
+    'rss_mb': rss_kb[0] / 1024 if rss_kb else None,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'torch_imported': 'torch' in sys.modules,
+}))
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare torch and slim serving modes')
+    parser.add_argument('--server-dir', default=SERVER_DIR, help='working directory of the server (with hrnetv2_models/)')
+    parser.add_argument('--models', default='WFLW', help='comma separated, as MODELS of the server')
+    parser.add_argument('--modes', nargs='+', default=['torch', 'slim'])
+    parser.add_argument('--image', default=None, help='face image to post, a random image with a fixed face box if not given')
+    parser.add_argument('--detector', default='haar', choices=['haar', 'fixed'],
+                        help='fixed: skip Haar detection and use one fixed face box')
+    parser.add_argument('--repeats', type=int, default=5)
+    return parser.parse_args()
+
+
+def run_mode(mode, args):
+    env = dict(os.environ, SERVING_MODE=mode, MODELS=args.models, MODEL_PRECISION='fp32',
+               PYTHONPATH=os.pathsep.join([os.path.abspath(SERVER_DIR), os.path.abspath(PROJECT_ROOT)]))
+    code = f'IMAGE = {os.path.abspath(args.image) if args.image else None!r}\n' \
+           f'DETECTOR = {args.detector!r}\nREPEATS = {args.repeats}\n' + CHILD
+    out = subprocess.run([sys.executable, '-c', code], cwd=args.server_dir, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{mode} mode failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    results = {mode: run_mode(mode, args) for mode in args.modes}
+
+    keys = ['import_s', 'load_s', 'first_request_ms', 'warm_request_ms', 'rss_mb', 'peak_rss_mb', 'torch_imported', 'status']
+    print(f"{'':>18} | " + ' | '.join(f'{mode:>10}' for mode in args.modes))
+    for key in keys:
+        values = [results[mode][key] for mode in args.modes]
+        print(f"{key:>18} | " + ' | '.join(f'{v:>10.2f}' if isinstance(v, float) else f'{str(v):>10}' for v in values))
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
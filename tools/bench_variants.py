@@ -0,0 +1,95 @@
+"""
+Speed/accuracy matrix of the HRNet variants (lib/config/variants.py).
+
+For every variant reports parameters, MACs per face, CPU latency and the NME of its landmarks
+against the full model of the dataset. A variant is trained when {prefix}{model}-{variant}.yaml
+and its checkpoint are in --root (see tools/distill.py), it is loaded like any served model.
+Untrained variants are built with random weights: their cost is measured, their NME is not.
+
+    python tools/bench_variants.py --model WFLW --images ./faces --batch-sizes 1 8
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.config import VARIANTS, get_variant_config
+from lib.core.distillation import teacher_inputs
+from lib.core.evaluation import compute_nme
+from lib.datasets import load_images
+from lib.models import get_face_alignment_net, set_inplace_fuse
+from lib.utils import count_parameters, count_macs, make_inputs
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark HRNet variants')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--model', default='WFLW', help='dataset model, the reference of the NME')
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    parser.add_argument('--images', default=None, help='folder with face images, random inputs if not given')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--repeats', type=int, default=5)
+    return parser.parse_args()
+
+
+def latency_ms(model, img_tensor, repeats):
+    with torch.no_grad():
+        model(img_tensor)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(img_tensor)
+            times.append(1000.0 * (time.perf_counter() - start))
+    return sorted(times)[len(times) // 2]
+
+
+def load_variant(args, variant, reference_config):
+    """
+    :return: (model, trained)
+    """
+    name = f'{args.model}-{variant}'
+    if os.path.isfile(os.path.join(args.root, f'{args.prefix}{name}.yaml')):
+        return load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu'), True
+    model = get_face_alignment_net(get_variant_config(variant, base_config=reference_config)).eval()
+    return set_inplace_fuse(model), False
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    images = load_images(args.images) if args.images else []
+    reference = load_model(args.model, root_models_path=args.root, prefix=args.prefix, device='cpu')
+    img_tensor, centers, scales = make_inputs(images, prepare_input, max(args.batch_sizes),
+                                              image_size=reference.config.MODEL.IMAGE_SIZE)
+    # the crops are normalized, a RAW_INPUT model reads their pixel values
+    reference_lmks = run_model(reference, teacher_inputs(reference, img_tensor), centers, scales, device='cpu').numpy()
+    input_size = (3,) + tuple(reference.config.MODEL.IMAGE_SIZE[::-1])
+
+    print(f"{args.model}, {torch.get_num_threads()} threads")
+    print(f"{'variant':>18} | {'params M':>8} | {'GMACs':>6} | " +
+          ' | '.join(f'{f"ms b{b}":>8}' for b in args.batch_sizes) + f" | {'NME':>7}")
+    rows = [('reference', reference, True)] + [(v,) + load_variant(args, v, reference.config) for v in args.variants]
+    for variant, model, trained in rows:
+        latencies = [latency_ms(model, img_tensor[:b], args.repeats) for b in args.batch_sizes]
+        if trained:
+            lmks = run_model(model, teacher_inputs(model, img_tensor), centers, scales, device='cpu').numpy()
+            nme = f'{np.nanmean(compute_nme(lmks, reference_lmks)):>7.4f}'
+        else:
+            nme = f'{"-":>7}'
+        print(f"{variant:>18} | {count_parameters(model) / 1e6:>8.2f} | {count_macs(model, input_size) / 1e9:>6.2f} | " +
+              ' | '.join(f'{ms:>8.1f}' for ms in latencies) + f" | {nme}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Convert .pth checkpoints into flat memory-mappable .safetensors files that `load_model` maps zero-copy.
+
+    python tools/convert_checkpoint.py --root src/server/hrnetv2_models --models WFLW 300W COFW AFLW
+    python tools/convert_checkpoint.py --models WFLW --fp16
+"""
+import os
+import sys
+import time
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from utils.flat_checkpoint import save_flat_checkpoint, load_flat_checkpoint
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert checkpoints to the flat mmap format')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'),
+                        help='directory with {prefix}{model}.pth checkpoints')
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--fp16', action='store_true', help='store floating point tensors as fp16')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for name in args.models:
+        src = os.path.join(args.root, f'{args.prefix}{name}.pth')
+        dst = os.path.join(args.root, f'{args.prefix}{name}.safetensors')
+
+        start = time.perf_counter()
+        state_dict = torch.load(src, map_location='cpu')
+        pth_load_s = time.perf_counter() - start
+
+        save_flat_checkpoint(state_dict, dst, dtype=torch.float16 if args.fp16 else None,
+                             metadata={'source': os.path.basename(src), 'fp16': args.fp16})
+
+        start = time.perf_counter()
+        flat = load_flat_checkpoint(dst, dtype=torch.float32)
+        flat_load_s = time.perf_counter() - start
+
+        max_diff = max((flat[k].float() - v.float()).abs().max().item() for k, v in state_dict.items() if v.numel())
+        print(f"{name}: {os.path.getsize(src) / 2 ** 20:.1f} MB -> {os.path.getsize(dst) / 2 ** 20:.1f} MB, "
+              f"load {1000 * pth_load_s:.1f} ms -> {1000 * flat_load_s:.1f} ms, max abs diff {max_diff:.3g}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Distill a landmark model into a smaller HRNet variant (lib/config/variants.py).
+
+The student learns the teacher heatmaps on augmented crops (random scale, rotation and flip,
+through the inference crop) of a local image folder, no annotations needed. The best epoch
+(heatmap loss on --val-images) is written as {prefix}{teacher}-{variant}.pth and .yaml into
+--root, so `get_model_by_name('{teacher}-{variant}')` and the server (MODELS=...) load it as is.
+Reports the NME of the student against the teacher and the latency of both.
+
+    python tools/distill.py --teacher WFLW --variant w12 --images ./faces --epochs 60
+    # CPU smoke run
+    python tools/distill.py --teacher WFLW --variant w9-small-3branch --images ./faces --epochs 1 --max-steps 2
+"""
+import os
+import sys
+import logging
+import argparse
+
+import numpy as np
+import torch
+import torch.utils.data as data
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.config import VARIANTS, get_variant_config
+from lib.core.distillation import get_optimizer, get_criterion, copy_stem, distill_epoch, validate, teacher_inputs
+from lib.core.evaluation import compute_nme
+from lib.datasets import FaceCropDataset
+from lib.models import get_face_alignment_net
+from lib.utils import latency_ms
+from utils.utils_inference import get_model_by_name, load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Distill a landmark model into a smaller HRNet')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--teacher', default='WFLW', help='teacher model (dataset)')
+    parser.add_argument('--variant', default='w12', choices=list(VARIANTS))
+    parser.add_argument('--images', required=True, help='folder with face crops to train on')
+    parser.add_argument('--val-images', default=None, help='folder with face crops to validate on, --images if not given')
+    parser.add_argument('--epochs', type=int, default=None, help='TRAIN.END_EPOCH of the teacher config by default')
+    parser.add_argument('--batch-size', type=int, default=None, help='TRAIN.BATCH_SIZE_PER_GPU by default')
+    parser.add_argument('--lr', type=float, default=None, help='TRAIN.LR by default')
+    parser.add_argument('--max-steps', type=int, default=None, help='batches per epoch, for smoke runs')
+    parser.add_argument('--no-stem-init', action='store_true', help="don't start from the teacher stem")
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def student_config(teacher_config, args):
+    cfg = get_variant_config(args.variant, base_config=teacher_config)
+    cfg.defrost()
+    # the student is a plain trainable network, whatever inference form the teacher was exported in
+    cfg.MODEL.EXTRA.FOLDED_BN = False
+    cfg.MODEL.EXTRA.LEAN_HEAD = False
+    cfg.MODEL.EXTRA.RAW_INPUT = False
+    if args.epochs is not None:
+        cfg.TRAIN.END_EPOCH = cfg.TRAIN.BEGIN_EPOCH + args.epochs
+    if args.batch_size is not None:
+        cfg.TRAIN.BATCH_SIZE_PER_GPU = args.batch_size
+    if args.lr is not None:
+        cfg.TRAIN.LR = args.lr
+    cfg.freeze()
+    return cfg
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    teacher = load_model(args.teacher, root_models_path=args.root, prefix=args.prefix, device=args.device)
+    cfg = student_config(teacher.config, args)
+    student = get_face_alignment_net(cfg)
+    if not args.no_stem_init:
+        print(f"Student stem initialized from the teacher: {copy_stem(teacher, student)} tensors")
+    student.to(args.device)
+
+    output_size = cfg.MODEL.IMAGE_SIZE
+    train_set = FaceCropDataset(args.images, prepare_input, output_size=output_size,
+                                scale_factor=cfg.DATASET.SCALE_FACTOR, rot_factor=cfg.DATASET.ROT_FACTOR,
+                                flip=cfg.DATASET.FLIP)
+    val_set = FaceCropDataset(args.val_images or args.images, prepare_input, output_size=output_size, is_train=False)
+    batch_size = cfg.TRAIN.BATCH_SIZE_PER_GPU
+    train_loader = data.DataLoader(train_set, batch_size=batch_size, shuffle=cfg.TRAIN.SHUFFLE,
+                                   num_workers=args.workers, drop_last=len(train_set) > batch_size)
+    val_loader = data.DataLoader(val_set, batch_size=batch_size, shuffle=False, num_workers=args.workers)
+
+    criterion = get_criterion()
+    optimizer = get_optimizer(cfg, student)
+    lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer, cfg.TRAIN.LR_STEP, cfg.TRAIN.LR_FACTOR)
+
+    best_loss, best_state = None, None
+    for epoch in range(cfg.TRAIN.BEGIN_EPOCH, cfg.TRAIN.END_EPOCH):
+        train_loss = distill_epoch(teacher, student, train_loader, criterion, optimizer, epoch, device=args.device,
+                                   print_freq=cfg.PRINT_FREQ, max_steps=args.max_steps)
+        lr_scheduler.step()
+        val_loss = validate(teacher, student, val_loader, criterion, device=args.device)
+        print(f"epoch {epoch}: train loss {train_loss:.6f}, val loss {val_loss:.6f}")
+        if best_loss is None or val_loss < best_loss:
+            best_loss = val_loss
+            best_state = {k: v.detach().cpu().clone() for k, v in student.state_dict().items()}
+
+    name = f'{args.teacher}-{args.variant}'
+    if os.path.isfile(os.path.join(args.root, f'{args.prefix}{name}.safetensors')):
+        print(f"Warning: {args.prefix}{name}.safetensors is loaded before the new .pth, remove or regenerate it")
+    torch.save(best_state, os.path.join(args.root, f'{args.prefix}{name}.pth'))
+    with open(os.path.join(args.root, f'{args.prefix}{name}.yaml'), 'w') as f:
+        f.write(cfg.dump())
+    print(f"Saved {args.prefix}{name}.pth/.yaml (val loss {best_loss:.6f})")
+
+    # through the regular loader, as the server will load it
+    distilled = get_model_by_name(name, root_models_path=args.root, prefix=args.prefix, device=args.device)
+    inputs = [prepare_input(img, output_size=output_size) for img in val_set.images]
+    img_tensor = torch.stack([x[0] for x in inputs])
+    centers, scales = [x[1] for x in inputs], [x[2] for x in inputs]
+    teacher_lmks = run_model(teacher, teacher_inputs(teacher, img_tensor), centers, scales, output_size=output_size,
+                             device=args.device).numpy()
+    student_lmks = run_model(distilled, img_tensor, centers, scales, output_size=output_size, device=args.device).numpy()
+    nme = np.nanmean(compute_nme(student_lmks, teacher_lmks))
+
+    sample = img_tensor[:1].to(args.device)
+    batch = img_tensor[:batch_size].to(args.device)
+    print(f"{'model':>24} | {'ms b1':>8} | {f'ms b{len(batch)}':>8} | {'NME vs teacher':>14}")
+    print(f"{args.teacher:>24} | {latency_ms(teacher, teacher_inputs(teacher, sample)):>8.1f} | "
+          f"{latency_ms(teacher, teacher_inputs(teacher, batch)):>8.1f} | {0:>14.4f}")
+    print(f"{name:>24} | {latency_ms(distilled, sample):>8.1f} | {latency_ms(distilled, batch):>8.1f} | {nme:>14.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Export slim inference checkpoints: every BatchNorm folded into its conv, training-only modules dropped.
+
+Writes {prefix}{model}{suffix}.pth and .yaml next to the source checkpoint, so the result loads with
+get_model_by_name('WFLW-folded'), once the folded model reloads and matches the original one. RAW_INPUT
+models are folded with their plain first conv, the loader folds the input normalization into it again.
+
+    python tools/export_inference.py --models WFLW 300W --images ./faces
+"""
+import os
+import sys
+import copy
+import shutil
+import tempfile
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.distillation import teacher_inputs
+from lib.datasets import load_images
+from lib.models.fold_bn import fold_batchnorm, count_batchnorm
+from lib.models.input_norm import unfold_input_normalization
+from lib.utils import make_inputs, latency_ms
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fold BatchNorm and export inference checkpoints')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--suffix', default='-folded')
+    parser.add_argument('--images', default=None, help='folder with face images for the parity check')
+    parser.add_argument('--num-random', type=int, default=8, help='random inputs used when no images are given')
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='max allowed heatmap difference')
+    return parser.parse_args()
+
+
+def compare(reference, model, img_tensor, centers, scales):
+    with torch.no_grad():
+        heatmap_diff = (reference(img_tensor) - model(img_tensor)).abs().max().item()
+    lmks_diff = (run_model(reference, img_tensor, centers, scales, device='cpu') -
+                 run_model(model, img_tensor, centers, scales, device='cpu')).abs().max().item()
+    return heatmap_diff, lmks_diff
+
+
+def main():
+    args = parse_args()
+    images = load_images(args.images) if args.images else []
+
+    failed = False
+    for name in args.models:
+        model = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        img_tensor, centers, scales = make_inputs(images, prepare_input, args.num_random,
+                                                  image_size=model.config.MODEL.IMAGE_SIZE)
+        # fold_batchnorm knows the plain stem conv only, RAW_INPUT is applied again by the loader
+        folded = fold_batchnorm(unfold_input_normalization(copy.deepcopy(model)))
+
+        export_name = f'{name}{args.suffix}'
+        folded_config = model.config.clone()
+        folded_config.defrost()
+        folded_config.MODEL.EXTRA.FOLDED_BN = True
+        folded_config.freeze()
+        files = [f'{args.prefix}{export_name}.pth', f'{args.prefix}{export_name}.yaml']
+        # round trip through the regular loader in a scratch directory, --root only gets checkpoints that pass
+        with tempfile.TemporaryDirectory() as scratch:
+            torch.save(folded.state_dict(), os.path.join(scratch, files[0]))
+            with open(os.path.join(scratch, files[1]), 'w') as f:
+                f.write(folded_config.dump())
+            reloaded = load_model(export_name, root_models_path=scratch, prefix=args.prefix, device='cpu')
+
+            model_inputs = teacher_inputs(model, img_tensor)
+            heatmap_diff, lmks_diff = compare(model, reloaded, model_inputs, centers, scales)
+            sample = model_inputs[:1]
+            print(f"{name} -> {args.prefix}{export_name}: "
+                  f"BatchNorm2d {count_batchnorm(model)} -> {count_batchnorm(reloaded)}, "
+                  f"max heatmap diff {heatmap_diff:.2e}, max landmark diff {lmks_diff:.2f} px, "
+                  f"latency {latency_ms(model, sample):.1f} -> {latency_ms(reloaded, sample):.1f} ms")
+            if heatmap_diff > args.tolerance:
+                print(f"  parity check FAILED: {heatmap_diff:.2e} > {args.tolerance:.0e}, not written")
+                failed = True
+                continue
+            for file_name in files:
+                shutil.move(os.path.join(scratch, file_name), os.path.join(args.root, file_name))
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
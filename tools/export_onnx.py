@@ -0,0 +1,65 @@
+"""
+Export landmark models to ONNX with a dynamic batch axis, for the onnxruntime backend.
+
+Writes {prefix}{model}.onnx next to the checkpoint and checks it with ONNX Runtime against
+the torch model on several batch sizes.
+
+    python tools/export_onnx.py --models WFLW 300W
+"""
+import os
+import sys
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from utils.backends import OnnxRuntimeBackend
+from utils.utils_inference import load_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export landmark models to ONNX')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--check-batch-sizes', type=int, nargs='+', default=[1, 3, 8])
+    parser.add_argument('--tolerance', type=float, default=1e-3, help='max allowed heatmap difference')
+    return parser.parse_args()
+
+
+def export_onnx(model, path, image_size=(256, 256), opset=17):
+    example = torch.zeros(2, 3, image_size[1], image_size[0])
+    torch.onnx.export(model, (example,), path, input_names=['input'], output_names=['heatmaps'],
+                      dynamic_axes={'input': {0: 'batch'}, 'heatmaps': {0: 'batch'}},
+                      opset_version=opset, do_constant_folding=True, dynamo=False)
+
+
+def main():
+    args = parse_args()
+    failed = False
+    for name in args.models:
+        model = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        image_size = model.config.MODEL.IMAGE_SIZE
+        path = os.path.join(args.root, f'{args.prefix}{name}.onnx')
+        export_onnx(model, path, image_size=image_size, opset=args.opset)
+
+        backend = OnnxRuntimeBackend(path)
+        diffs = []
+        for batch_size in args.check_batch_sizes:
+            x = torch.randn(batch_size, 3, image_size[1], image_size[0])
+            with torch.no_grad():
+                diffs.append((model(x) - backend.infer(x)).abs().max().item())
+        print(f"{name} -> {os.path.basename(path)} ({os.path.getsize(path) / 2 ** 20:.1f} MB), max heatmap diff "
+              + ", ".join(f"batch {b}: {d:.2e}" for b, d in zip(args.check_batch_sizes, diffs)))
+        if max(diffs) > args.tolerance:
+            print(f"  parity check FAILED: {max(diffs):.2e} > {args.tolerance:.0e}")
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
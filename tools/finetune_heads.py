@@ -0,0 +1,211 @@
+"""
+Fine-tune the heads of several landmark models on one shared backbone, for MULTI_HEAD=1.
+
+The per-dataset checkpoints are separately trained networks, their heads only fit their own
+backbone. This tool keeps the backbone of --backbone (the first model by default) frozen and
+trains every other head on the heatmaps of its own full model (lib/core/distillation.py) on
+augmented crops of a local image folder, no annotations needed. Writes {prefix}{model}{suffix}.pth
+and .yaml for every model, the backbone tensors identical in all of them, so that
+
+    MULTI_HEAD=1 MODELS=WFLW-shared,300W-shared,COFW-shared
+
+loads them (the check of `get_multihead_net` passes). Reports the NME of every head against its
+own full model before and after.
+
+    python tools/finetune_heads.py --models WFLW 300W COFW --images ./faces --epochs 20
+    # CPU smoke run
+    python tools/finetune_heads.py --models WFLW 300W --images ./faces --epochs 1 --max-steps 2
+"""
+import os
+import sys
+import logging
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.utils.data as data
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.distillation import get_optimizer, get_criterion, distill_epoch, validate, teacher_inputs
+from lib.core.evaluation import compute_nme
+from lib.datasets import FaceCropDataset
+from utils.utils_inference import load_model, load_multihead_model, get_checkpoint_path, load_checkpoint, \
+    prepare_input, run_model, run_multihead_model
+
+# config fields that make the backbone tensors of two checkpoints interchangeable
+BACKBONE_FIELDS = ('STAGE1', 'STAGE2', 'STAGE3', 'STAGE4', 'FOLDED_BN', 'RAW_INPUT')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fine-tune landmark heads on one shared backbone')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW', '300W', 'COFW'])
+    parser.add_argument('--backbone', default=None, help='model whose backbone is shared, the first one by default')
+    parser.add_argument('--suffix', default='-shared', help='name suffix of the written checkpoints')
+    parser.add_argument('--images', required=True, help='folder with face crops to train on')
+    parser.add_argument('--val-images', default=None, help='folder with face crops to validate on, --images if not given')
+    parser.add_argument('--epochs', type=int, default=None, help='TRAIN.END_EPOCH of the model configs by default')
+    parser.add_argument('--batch-size', type=int, default=None, help='TRAIN.BATCH_SIZE_PER_GPU by default')
+    parser.add_argument('--lr', type=float, default=None, help='TRAIN.LR by default')
+    parser.add_argument('--max-steps', type=int, default=None, help='batches per epoch, for smoke runs')
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+class SharedBackboneHead(nn.Module):
+    """
+    One head of a MultiHeadHighResolutionNet on the shared backbone, as a heatmap network for
+    `distill_epoch`: the backbone stays frozen and in eval mode (BatchNorm statistics included).
+    """
+
+    def __init__(self, model, name):
+        super(SharedBackboneHead, self).__init__()
+        self.model = model
+        self.name = name
+
+    def train(self, mode=True):
+        super(SharedBackboneHead, self).train(mode)
+        self.model.backbone.eval()
+        return self
+
+    def forward(self, x):
+        # the crops are normalized, as for the teachers a RAW_INPUT backbone gets their pixel values
+        return self.model(teacher_inputs(self.model.backbone, x), heads=[self.name])[self.name]
+
+
+def check_configs(configs, backbone):
+    extra = configs[backbone].MODEL.EXTRA
+    for name, cfg in configs.items():
+        if cfg.MODEL.EXTRA.get('LEAN_HEAD', False):
+            raise ValueError(f"{name}: fine-tune the heads of the plain checkpoints, convert them to LEAN_HEAD after")
+        different = [field for field in BACKBONE_FIELDS if cfg.MODEL.EXTRA.get(field) != extra.get(field)]
+        if different:
+            raise ValueError(f"{name}: MODEL.EXTRA.{', '.join(different)} differ from the {backbone} backbone")
+
+
+def train_config(cfg, args):
+    cfg = cfg.clone()
+    cfg.defrost()
+    if args.epochs is not None:
+        cfg.TRAIN.END_EPOCH = cfg.TRAIN.BEGIN_EPOCH + args.epochs
+    if args.batch_size is not None:
+        cfg.TRAIN.BATCH_SIZE_PER_GPU = args.batch_size
+    if args.lr is not None:
+        cfg.TRAIN.LR = args.lr
+    cfg.freeze()
+    return cfg
+
+
+def finetune_head(teacher, multihead, name, cfg, train_set, val_set, args):
+    """
+    :return: best validation loss; the head of `multihead` is left with its best epoch.
+    """
+    head = multihead.heads[name]
+    batch_size = cfg.TRAIN.BATCH_SIZE_PER_GPU
+    train_loader = data.DataLoader(train_set, batch_size=batch_size, shuffle=cfg.TRAIN.SHUFFLE,
+                                   num_workers=args.workers, drop_last=len(train_set) > batch_size)
+    val_loader = data.DataLoader(val_set, batch_size=batch_size, shuffle=False, num_workers=args.workers)
+    student = SharedBackboneHead(multihead, name)
+    criterion = get_criterion()
+    optimizer = get_optimizer(cfg, head)
+    lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer, cfg.TRAIN.LR_STEP, cfg.TRAIN.LR_FACTOR)
+
+    best_loss, best_state = None, None
+    for epoch in range(cfg.TRAIN.BEGIN_EPOCH, cfg.TRAIN.END_EPOCH):
+        train_loss = distill_epoch(teacher, student, train_loader, criterion, optimizer, epoch, device=args.device,
+                                   print_freq=cfg.PRINT_FREQ, max_steps=args.max_steps)
+        lr_scheduler.step()
+        val_loss = validate(teacher, student, val_loader, criterion, device=args.device)
+        print(f"{name} epoch {epoch}: train loss {train_loss:.6f}, val loss {val_loss:.6f}")
+        if best_loss is None or val_loss < best_loss:
+            best_loss = val_loss
+            best_state = {k: v.detach().clone() for k, v in head.state_dict().items()}
+    head.load_state_dict(best_state)
+    head.eval()
+    return best_loss
+
+
+def head_nmes(multihead, full_models, img_tensor, centers, scales, output_size, device):
+    """
+    :return: dict head name -> NME of the head landmarks against its own full model.
+    """
+    lmks = run_multihead_model(multihead, teacher_inputs(multihead.backbone, img_tensor), centers, scales,
+                               output_size=output_size, device=device)
+    return {name: np.nanmean(compute_nme(lmks[name].numpy(),
+                                         run_model(model, teacher_inputs(model, img_tensor), centers, scales,
+                                                   output_size=output_size, device=device).numpy()))
+            for name, model in full_models.items()}
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    backbone = args.backbone or args.models[0]
+    if backbone not in args.models:
+        raise ValueError(f"--backbone {backbone} is not one of --models")
+
+    full_models = {name: load_model(name, root_models_path=args.root, prefix=args.prefix, device=args.device)
+                   for name in args.models}
+    configs = {name: model.config for name, model in full_models.items()}
+    check_configs(configs, backbone)
+    multihead = load_multihead_model(args.models, root_models_path=args.root, prefix=args.prefix, device=args.device,
+                                     backbone=backbone, check_backbone=False)
+    for param in multihead.backbone.parameters():
+        param.requires_grad_(False)
+
+    output_size = configs[backbone].MODEL.IMAGE_SIZE
+    data_cfg = configs[backbone].DATASET
+    train_set = FaceCropDataset(args.images, prepare_input, output_size=output_size,
+                                scale_factor=data_cfg.SCALE_FACTOR, rot_factor=data_cfg.ROT_FACTOR, flip=data_cfg.FLIP)
+    val_set = FaceCropDataset(args.val_images or args.images, prepare_input, output_size=output_size, is_train=False)
+    inputs = [prepare_input(img, output_size=output_size) for img in val_set.images]
+    img_tensor = torch.stack([x[0] for x in inputs])
+    centers, scales = [x[1] for x in inputs], [x[2] for x in inputs]
+    before = head_nmes(multihead, full_models, img_tensor, centers, scales, output_size, args.device)
+
+    for name in args.models:
+        if name != backbone:
+            finetune_head(full_models[name], multihead, name, train_config(configs[name], args), train_set, val_set,
+                          args)
+
+    # the backbone tensors exactly as in the --backbone checkpoint, every model with its own head
+    backbone_state = {k: v for k, v in load_checkpoint(get_checkpoint_path(backbone, root_models_path=args.root,
+                                                                           prefix=args.prefix)).items()
+                      if not k.startswith('head.')}
+    export_names = []
+    for name in args.models:
+        export_name = f'{name}{args.suffix}'
+        if os.path.isfile(os.path.join(args.root, f'{args.prefix}{export_name}.safetensors')):
+            print(f"Warning: {args.prefix}{export_name}.safetensors is loaded before the new .pth, "
+                  f"remove or regenerate it")
+        state_dict = dict(backbone_state)
+        head_state = multihead.heads[name].state_dict()
+        state_dict.update({f'head.{k}': v.detach().cpu().clone() for k, v in head_state.items()})
+        torch.save(state_dict, os.path.join(args.root, f'{args.prefix}{export_name}.pth'))
+        with open(os.path.join(args.root, f'{args.prefix}{export_name}.yaml'), 'w') as f:
+            f.write(configs[name].dump())
+        export_names.append(export_name)
+
+    # through the regular multi-head loader, as the server will load them
+    shared = load_multihead_model(export_names, root_models_path=args.root, prefix=args.prefix, device=args.device)
+    shared.heads = nn.ModuleDict((name, shared.heads[export_name])
+                                 for name, export_name in zip(args.models, export_names))
+    after = head_nmes(shared, full_models, img_tensor, centers, scales, output_size, args.device)
+    print(f"backbone: {backbone}, written: {', '.join(args.prefix + n for n in export_names)}")
+    print(f"{'head':>8} | {'NME before':>10} | {'NME after':>10}")
+    for name in args.models:
+        print(f"{name:>8} | {before[name]:>10.4f} | {after[name]:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Accuracy and cost of the lean landmark head, exact and low-rank.
+
+For every rank (0 = exact) reports the head MACs, head and full model latency, the largest
+heatmap difference and the NME of the landmarks against the original head.
+
+    python tools/lean_head_report.py --models WFLW --images ./faces --ranks 0 128 64 32
+"""
+import os
+import sys
+import copy
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.evaluation import compute_nme
+from lib.datasets import load_images
+from lib.models.lean_head import convert_to_lean_head
+from lib.utils import make_inputs
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Lean head accuracy report')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--images', default=None, help='folder with face images, random inputs if not given')
+    parser.add_argument('--num-random', type=int, default=4)
+    parser.add_argument('--ranks', type=int, nargs='+', default=[0, 128, 64, 32])
+    parser.add_argument('--repeats', type=int, default=3)
+    return parser.parse_args()
+
+
+def conv_macs(module, fn):
+    """
+    Multiply-accumulates of the Conv2d layers of `module` while `fn()` runs on one sample.
+    """
+    macs = []
+
+    def hook(conv, _, output):
+        kernel = conv.kernel_size[0] * conv.kernel_size[1] * conv.in_channels // conv.groups
+        macs.append(output[0].numel() * kernel)
+
+    handles = [m.register_forward_hook(hook) for m in module.modules() if isinstance(m, nn.Conv2d)]
+    with torch.no_grad():
+        fn()
+    for handle in handles:
+        handle.remove()
+    return sum(macs)
+
+
+def timed_ms(fn, repeats):
+    with torch.no_grad():
+        fn()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn()
+    return 1000.0 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    args = parse_args()
+    images = load_images(args.images) if args.images else []
+
+    for name in args.models:
+        model = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        img_tensor, centers, scales = make_inputs(images, prepare_input, args.num_random,
+                                                  image_size=model.config.MODEL.IMAGE_SIZE)
+        with torch.no_grad():
+            branches = model(img_tensor, with_head=False)
+            reference_heatmaps = model.forward_head(branches)
+        reference = run_model(model, img_tensor, centers, scales, device='cpu').numpy()
+
+        print(f"{name}:")
+        print(f"{'head':>10} | {'head MMACs':>10} | {'head ms':>8} | {'model ms':>8} | {'heatmap diff':>12} | {'NME':>8}")
+        variants = [('original', model)]
+        for rank in args.ranks:
+            lean = convert_to_lean_head(copy.deepcopy(model), model.branch_channels, rank=rank)
+            variants.append(('exact' if lean.head.rank == 0 else f'rank {lean.head.rank}', lean))
+
+        sample = [branch[:1] for branch in branches]
+        for label, variant in variants:
+            # head time includes the upsampling and concatenation of the original head
+            head_ms = timed_ms(lambda: variant.forward_head(branches), args.repeats)
+            model_ms = timed_ms(lambda: variant(img_tensor), args.repeats)
+            head_macs = conv_macs(variant.head, lambda: variant.forward_head(sample))
+            with torch.no_grad():
+                heatmap_diff = (variant.forward_head(branches) - reference_heatmaps).abs().max().item()
+            nme = compute_nme(run_model(variant, img_tensor, centers, scales, device='cpu').numpy(), reference)
+            print(f"{label:>10} | {head_macs / 1e6:>10.1f} | {head_ms:>8.1f} | {model_ms:>8.1f} | "
+                  f"{heatmap_diff:>12.2e} | {np.nanmean(nme):>8.4f}")
+
+
+if __name__ == '__main__':
+    main()
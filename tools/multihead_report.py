@@ -0,0 +1,82 @@
+"""
+Multi-head model vs separate full models: landmark drift per head and latency.
+
+The backbone comes from the first model. Heads of separately trained checkpoints run on features
+they were not trained with (the server refuses them), the NME of their landmarks against their own
+full model shows how far off they are. Heads fine-tuned on the shared backbone (tools/finetune_heads.py,
+the -shared checkpoints) should stay close to their full models.
+
+    python tools/multihead_report.py --models WFLW 300W COFW --images ./faces
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.evaluation import compute_nme
+from lib.datasets import load_images
+from lib.utils import make_inputs
+from utils.utils_inference import load_model, load_multihead_model, prepare_input, run_model, run_multihead_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Drift and latency of the multi-head model')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW', '300W', 'COFW'])
+    parser.add_argument('--backbone', default=None, help='model whose backbone is shared, the first one by default')
+    parser.add_argument('--images', default=None, help='folder with face images, random inputs if not given')
+    parser.add_argument('--num-random', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    return parser.parse_args()
+
+
+def timed_ms(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1000.0 * (time.perf_counter() - start) / repeats
+
+
+def count_params(module):
+    return sum(p.numel() for p in module.parameters())
+
+
+def main():
+    args = parse_args()
+    images = load_images(args.images) if args.images else []
+
+    full_models = {name: load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+                   for name in args.models}
+    multihead = load_multihead_model(args.models, root_models_path=args.root, prefix=args.prefix, device='cpu',
+                                     backbone=args.backbone, check_backbone=False)
+    backbone = args.backbone or args.models[0]
+    img_tensor, centers, scales = make_inputs(images, prepare_input, args.num_random,
+                                              image_size=multihead.config.MODEL.IMAGE_SIZE)
+
+    multihead_lmks = run_multihead_model(multihead, img_tensor, centers, scales, device='cpu')
+    print(f"backbone: {backbone}, {len(img_tensor)} inputs")
+    print(f"{'head':>8} | {'NME vs own model':>16} | {'max diff px':>11} | {'head params':>11}")
+    for name, model in full_models.items():
+        lmks = run_model(model, img_tensor, centers, scales, device='cpu')
+        nme = compute_nme(multihead_lmks[name].numpy(), lmks.numpy())
+        print(f"{name:>8} | {np.nanmean(nme):>16.4f} | {(multihead_lmks[name] - lmks).abs().max().item():>11.2f} | "
+              f"{count_params(multihead.heads[name]):>11,}")
+
+    full_ms = timed_ms(lambda: [run_model(m, img_tensor, centers, scales, device='cpu') for m in full_models.values()],
+                       args.repeats)
+    multihead_ms = timed_ms(lambda: run_multihead_model(multihead, img_tensor, centers, scales, device='cpu'),
+                            args.repeats)
+    full_params = sum(count_params(m) for m in full_models.values())
+    print(f"{len(full_models)} full models: {full_ms:.1f} ms, {full_params:,} params")
+    print(f"multi-head: {multihead_ms:.1f} ms ({full_ms / multihead_ms:.2f}x), {count_params(multihead):,} params")
+
+
+if __name__ == '__main__':
+    main()
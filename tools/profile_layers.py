@@ -0,0 +1,142 @@
+"""
+Where the time goes inside an HRNet: wall time, MACs, parameters and activation sizes per module
+and per branch (lib/utils/profiler.py).
+
+Profiles served models (--models, loaded like the server loads them), any model yaml (--cfg) or the
+layouts of lib/config/variants.py (--variants), as landmark networks (hrnet.py) or as ImageNet
+classifiers (cls_hrnet.py, --model-type imagenet). Networks without a checkpoint get random weights,
+which doesn't change their cost. Prints a table per network and writes all of them to --json, to
+compare variants and optimizations over time.
+
+    python tools/profile_layers.py --models WFLW --json profile.json
+    python tools/profile_layers.py --variants w18 w12 w9-small-3branch --batch-size 8 --depth 2
+    python tools/profile_layers.py --cfg experiments/cls_w18.yaml --model-type imagenet
+"""
+import os
+import sys
+import json
+import argparse
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.config import config, config_imagenet, VARIANTS, get_variant_config
+from lib.models import get_face_alignment_net, get_cls_net, set_inplace_fuse
+from lib.utils import profile_modules, group_branches, format_table
+from utils.utils_inference import load_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Per-module and per-branch profile of HRNet models')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=[], help='served models, with their checkpoints')
+    parser.add_argument('--cfg', nargs='+', default=[], help='model yaml files, random weights')
+    parser.add_argument('--variants', nargs='+', default=[], choices=list(VARIANTS), help='layouts, random weights')
+    parser.add_argument('--model-type', default='landmarks', choices=['landmarks', 'imagenet'])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--depth', type=int, default=1, help='module path depth of the table')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--json', default=None, help='write all profiles to this file')
+    args = parser.parse_args()
+    if not (args.models or args.cfg or args.variants):
+        args.models = ['WFLW']
+    if args.model_type == 'imagenet':
+        for variant in args.variants:
+            error = imagenet_layout_error(get_variant_config(variant, base_config=base_config(args.model_type)))
+            if error:
+                parser.error(f"--variants {variant}: {error}")
+    return args
+
+
+def imagenet_layout_error(cfg):
+    # the classification head of cls_hrnet.py is built for the four stage 4 branches of W18-W64
+    num_branches = cfg.MODEL.EXTRA.STAGE4.NUM_BRANCHES
+    if num_branches < 4:
+        return (f"cls_hrnet.py needs 4 stage 4 branches, the layout has {num_branches}; "
+                f"profile it with --model-type landmarks")
+    return None
+
+
+def base_config(model_type):
+    if model_type == 'landmarks':
+        return config
+    # the ImageNet defaults have no stage layout, start from the W18 one of the landmark defaults
+    cfg = config_imagenet.clone()
+    cfg.defrost()
+    for stage in ('STAGE1', 'STAGE2', 'STAGE3', 'STAGE4'):
+        if stage in config.MODEL.EXTRA:
+            cfg.MODEL.EXTRA[stage] = config.MODEL.EXTRA[stage].clone()
+    cfg.freeze()
+    return cfg
+
+
+def build(cfg, model_type):
+    if model_type == 'landmarks':
+        return set_inplace_fuse(get_face_alignment_net(cfg).eval())
+    return get_cls_net(cfg).eval()
+
+
+def networks(args):
+    """
+    :return: (label, model, config) for every requested network.
+    """
+    for name in args.models:
+        model = load_model(name, root_models_path=args.root, prefix=args.prefix, model_type=args.model_type,
+                           device=args.device)
+        yield name, model, model.config
+    for path in args.cfg:
+        cfg = base_config(args.model_type).clone()
+        cfg.defrost()
+        cfg.merge_from_file(path)
+        cfg.MODEL.INIT_WEIGHTS = False
+        cfg.freeze()
+        error = imagenet_layout_error(cfg) if args.model_type == 'imagenet' else None
+        if error:
+            raise ValueError(f"{path}: {error}")
+        yield os.path.basename(path), build(cfg, args.model_type).to(args.device), cfg
+    for variant in args.variants:
+        cfg = get_variant_config(variant, base_config=base_config(args.model_type))
+        yield variant, build(cfg, args.model_type).to(args.device), cfg
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    reports = []
+    for label, model, cfg in networks(args):
+        width, height = cfg.MODEL.IMAGE_SIZE
+        param = next(model.parameters())
+        x = torch.randn(args.batch_size, 3, height, width, device=param.device, dtype=param.dtype)
+        stats = profile_modules(model, x, repeats=args.repeats, warmup=args.warmup)
+        branches = group_branches(stats)
+        total = stats['']
+        modules = {path: entry for path, entry in stats.items() if path and path.count('.') < args.depth}
+
+        print(f"\n{label} ({type(model).__name__}, {width}x{height}, batch {args.batch_size}, "
+              f"{torch.get_num_threads()} threads): {total['time_ms']:.1f} ms, {total['macs'] / 1e9:.2f} GMACs/sample, "
+              f"{total['params'] / 1e6:.2f}M params")
+        print(format_table(modules, total))
+        if branches:
+            print()
+            print(format_table(branches, total, title='branch'))
+        reports.append({'name': label, 'model': type(model).__name__, 'image_size': [width, height],
+                        'batch_size': args.batch_size, 'threads': torch.get_num_threads(), 'repeats': args.repeats,
+                        'total': total, 'branches': branches,
+                        'modules': {path: entry for path, entry in stats.items() if path}})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+        print(f"\nWrote {len(reports)} profiles to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Structured channel pruning of landmark models into smaller dense HRNets (lib/models/pruning.py).
+
+Channels of every branch are ranked by BatchNorm gamma or by mean activation on --images and
+removed from the blocks, fuse layers, transitions and head together. Writes {prefix}{model}{suffix}.pth
+and .yaml next to the source checkpoint, so the result loads with the regular loader. Optionally
+recovers accuracy by distilling the original model into the pruned one (--finetune-epochs, see tools/distill.py).
+Reports parameters, MACs, latency and the NME against the original model.
+
+    python tools/prune.py --models WFLW --ratio 0.25 --images ./faces
+    python tools/prune.py --models WFLW --branch-ratios 0.25 0.25 0.5 0.5 --criterion activation --images ./faces \
+        --finetune-epochs 10
+"""
+import os
+import sys
+import logging
+import argparse
+
+import numpy as np
+import torch
+import torch.utils.data as data
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.distillation import get_optimizer, get_criterion, distill_epoch, teacher_inputs
+from lib.core.evaluation import compute_nme
+from lib.datasets import FaceCropDataset, load_images
+from lib.models.pruning import CRITERIA, prune_hrnet
+from lib.utils import count_parameters, count_macs, make_inputs, latency_ms
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Prune HRNet channels into a smaller dense model')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--ratio', type=float, default=0.25, help='fraction of the channels of every branch to remove')
+    parser.add_argument('--branch-ratios', type=float, nargs='+', default=None, help='one ratio per branch instead')
+    parser.add_argument('--criterion', default='gamma', choices=CRITERIA)
+    parser.add_argument('--multiple-of', type=int, default=1, help='round kept channels to a multiple of this')
+    parser.add_argument('--images', default=None, help='face crops for the activation statistics, fine-tuning and NME')
+    parser.add_argument('--num-random', type=int, default=8, help='random inputs when no images are given')
+    parser.add_argument('--finetune-epochs', type=int, default=0)
+    parser.add_argument('--max-steps', type=int, default=None, help='fine-tuning batches per epoch, for smoke runs')
+    parser.add_argument('--suffix', default=None, help='name suffix, -pruned<percent> by default')
+    return parser.parse_args()
+
+
+def finetune(teacher, student, config, images_folder, epochs, max_steps):
+    dataset = FaceCropDataset(images_folder, prepare_input, output_size=config.MODEL.IMAGE_SIZE,
+                              scale_factor=config.DATASET.SCALE_FACTOR, rot_factor=config.DATASET.ROT_FACTOR,
+                              flip=config.DATASET.FLIP)
+    loader = data.DataLoader(dataset, batch_size=config.TRAIN.BATCH_SIZE_PER_GPU, shuffle=True)
+    criterion = get_criterion()
+    optimizer = get_optimizer(config, student)
+    for epoch in range(epochs):
+        loss = distill_epoch(teacher, student, loader, criterion, optimizer, epoch, print_freq=config.PRINT_FREQ,
+                             max_steps=max_steps)
+        print(f"  fine-tuning epoch {epoch}: loss {loss:.6f}")
+    return student.eval()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    images = load_images(args.images) if args.images else []
+    if args.finetune_epochs and not args.images:
+        raise ValueError("Fine-tuning needs --images")
+    ratios = args.branch_ratios or args.ratio
+    suffix = args.suffix or f'-pruned{int(round(100 * (max(ratios) if args.branch_ratios else ratios)))}'
+
+    for name in args.models:
+        model = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        img_tensor, centers, scales = make_inputs(images, prepare_input, args.num_random,
+                                                  image_size=model.config.MODEL.IMAGE_SIZE)
+        # normalized crops, RAW_INPUT models read their pixel values (the pruned model reads them normalized)
+        model_inputs = teacher_inputs(model, img_tensor)
+        pruned, config = prune_hrnet(model, model.config, ratios, criterion=args.criterion, inputs=model_inputs,
+                                     multiple_of=args.multiple_of)
+        if args.finetune_epochs:
+            pruned = finetune(model, pruned, config, args.images, args.finetune_epochs, args.max_steps)
+
+        export_name = f'{name}{suffix}'
+        if os.path.isfile(os.path.join(args.root, f'{args.prefix}{export_name}.safetensors')):
+            print(f"Warning: {args.prefix}{export_name}.safetensors is loaded before the new .pth, remove or regenerate it")
+        torch.save(pruned.state_dict(), os.path.join(args.root, f'{args.prefix}{export_name}.pth'))
+        with open(os.path.join(args.root, f'{args.prefix}{export_name}.yaml'), 'w') as f:
+            f.write(config.dump())
+
+        # round trip through the regular loader
+        reloaded = load_model(export_name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        reference = run_model(model, model_inputs, centers, scales, device='cpu').numpy()
+        nme = np.nanmean(compute_nme(run_model(reloaded, img_tensor, centers, scales, device='cpu').numpy(), reference))
+        input_size = (3,) + tuple(config.MODEL.IMAGE_SIZE[::-1])
+        sample = img_tensor[:1]
+        print(f"{name} -> {args.prefix}{export_name} ({args.criterion}): channels "
+              f"{list(model.config.MODEL.EXTRA.STAGE4.NUM_CHANNELS)} -> {list(config.MODEL.EXTRA.STAGE4.NUM_CHANNELS)}, "
+              f"params {count_parameters(model) / 1e6:.2f}M -> {count_parameters(reloaded) / 1e6:.2f}M, "
+              f"GMACs {count_macs(model, input_size) / 1e9:.2f} -> {count_macs(reloaded, input_size) / 1e9:.2f}, "
+              f"latency {latency_ms(model, model_inputs[:1]):.1f} -> {latency_ms(reloaded, sample):.1f} ms, "
+              f"NME vs original {nme:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+INT8 static post-training quantization for CPU serving.
+
+Calibrates the activation ranges on a folder of face images, writes {prefix}{model}-int8.pt
+next to the fp32 checkpoint (loaded by get_model_by_name(..., device='cpu', precision='int8'))
+and reports the NME drift against the fp32 model and the latency of both.
+
+    python tools/quantize.py --models WFLW 300W --images ./faces
+    python tools/quantize.py --models WFLW --images ./faces --eval-images ./faces_val --backend qnnpack
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'server'))
+
+from lib.core.evaluation import compute_nme
+from lib.datasets import load_images
+from lib.models.quantization import quantize_int8, save_int8
+from lib.utils import latency_ms
+from utils.preprocessing import takes_raw_input
+from utils.utils_inference import load_model, prepare_input, run_model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Quantize landmark models to INT8')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(__file__), '..', 'src', 'server', 'hrnetv2_models'))
+    parser.add_argument('--prefix', default='HR18-')
+    parser.add_argument('--models', nargs='+', default=['WFLW'])
+    parser.add_argument('--images', required=True, help='folder with face images for calibration')
+    parser.add_argument('--eval-images', default=None, help='folder with face images for the report, defaults to --images')
+    parser.add_argument('--num-images', type=int, default=None, help='use at most this many calibration images')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--backend', default='x86', choices=['x86', 'fbgemm', 'qnnpack'])
+    parser.add_argument('--threads', type=int, default=None, help='torch threads for the latency measurement')
+    return parser.parse_args()
+
+
+def prepare_batch(images, normalize=True):
+    inputs = [prepare_input(img, normalize=normalize) for img in images]
+    return torch.stack([x[0] for x in inputs]), [x[1] for x in inputs], [x[2] for x in inputs]
+
+
+def report(name, model, quantized, img_tensor, centers, scales, batch_size):
+    lmks = run_model(model, img_tensor, centers, scales, device='cpu').numpy()
+    lmks_int8 = run_model(quantized, img_tensor, centers, scales, device='cpu').numpy()
+    nme = compute_nme(lmks_int8, lmks)
+
+    batch = img_tensor[:batch_size]
+    result = {
+        'model': name,
+        'num_images': len(img_tensor),
+        'nme_drift_mean': float(nme.mean()),
+        'nme_drift_max': float(nme.max()),
+        'max_landmark_diff_px': float(np.abs(lmks_int8 - lmks).max()),
+        'latency_ms': {
+            'fp32': {'batch_1': latency_ms(model, batch[:1]), f'batch_{len(batch)}': latency_ms(model, batch)},
+            'int8': {'batch_1': latency_ms(quantized, batch[:1]), f'batch_{len(batch)}': latency_ms(quantized, batch)},
+        },
+    }
+    return result
+
+
+def main():
+    args = parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    calibration_images = load_images(args.images, limit=args.num_images)
+    if not calibration_images:
+        raise SystemExit(f"No images found in {args.images}")
+    eval_images = load_images(args.eval_images) if args.eval_images else calibration_images
+
+    for name in args.models:
+        model = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu')
+        # RAW_INPUT models calibrate and run on raw crops, as they are served
+        normalize = not takes_raw_input(model)
+        calibration_tensor = prepare_batch(calibration_images, normalize=normalize)[0]
+        img_tensor, centers, scales = prepare_batch(eval_images, normalize=normalize)
+        quantized = quantize_int8(model, calibration_tensor.split(args.batch_size), backend=args.backend)
+
+        path = os.path.join(args.root, f'{args.prefix}{name}-int8.pt')
+        save_int8(quantized, path, backend=args.backend)
+        # report on the saved artifact, as it is served
+        reloaded = load_model(name, root_models_path=args.root, prefix=args.prefix, device='cpu', precision='int8')
+        result = report(name, model, reloaded, img_tensor, centers, scales, args.batch_size)
+        result['calibration_images'] = len(calibration_images)
+        result['backend'] = args.backend
+        with open(os.path.join(args.root, f'{args.prefix}{name}-int8.json'), 'w') as f:
+            json.dump(result, f, indent=2)
+
+        fp32_ms, int8_ms = result['latency_ms']['fp32'], result['latency_ms']['int8']
+        print(f"{name} -> {os.path.basename(path)} ({os.path.getsize(path) / 2 ** 20:.1f} MB), "
+              f"{len(calibration_images)} calibration images")
+        print(f"  NME drift vs fp32: mean {result['nme_drift_mean']:.4f}, max {result['nme_drift_max']:.4f}, "
+              f"max landmark diff {result['max_landmark_diff_px']:.2f} px")
+        for key in fp32_ms:
+            print(f"  latency {key}: fp32 {fp32_ms[key]:.1f} ms, int8 {int8_ms[key]:.1f} ms "
+                  f"({fp32_ms[key] / int8_ms[key]:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()